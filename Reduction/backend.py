@@ -0,0 +1,25 @@
+import os
+
+# AIPS backend, selected with the RCW142_BACKEND environment variable 
+# ('aips' for ParselTongue and Wizardry, 'local' for the simulator)
+BACKEND = os.environ.get('RCW142_BACKEND', 'aips').lower()
+
+if BACKEND == 'aips':
+    from AIPS import AIPS
+    from AIPSData import AIPSCat, AIPSImage, AIPSUVData
+    from AIPSTask import AIPSList, AIPSTask
+    from AIPSTV import AIPSTV
+    from Wizardry.AIPSData import AIPSImage as wAIPSImage
+    from Wizardry.AIPSData import AIPSTableRow
+    from Wizardry.AIPSData import AIPSUVData as wAIPSUVData
+elif BACKEND == 'local':
+    from simulator import (
+        AIPS, AIPSCat, AIPSImage, AIPSList, AIPSTableRow, AIPSTask, AIPSTV, 
+        AIPSUVData
+    )
+    from simulator import WizardryImage as wAIPSImage
+    from simulator import WizardryUVData as wAIPSUVData
+else:
+    raise ValueError(
+        f"unknown RCW142_BACKEND '{BACKEND}' (expected 'aips' or 'local')"
+    )
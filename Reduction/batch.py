@@ -0,0 +1,252 @@
+from argparse import ArgumentParser
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+import yaml
+
+from backend import AIPS
+
+# batch scheduling functions
+def load_manifest(filename):
+    # load epochs from a manifest, merging in the manifest defaults and
+    # resolving file paths relative to the manifest
+    with open(filename, 'r') as file:
+        manifest = yaml.safe_load(file)
+    directory = os.path.dirname(os.path.abspath(filename))
+    defaults = manifest.get('defaults', {})
+    epochs = []
+    for epoch in manifest['epochs']:
+        options = {'snedt': 'auto', **defaults, **epoch}
+        for key in ('file', 'flag_file', 'antab_file'):
+            if options.get(key) is not None:
+                options[key] = os.path.join(directory, options[key])
+        epochs.append(options)
+    return epochs
+
+def pipeline_command(epoch, userno, disk):
+    # build the pipeline.py command line for an epoch
+    pipeline = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'pipeline.py'
+    )
+    command = [
+        sys.executable, pipeline, str(userno), '--disk', str(disk),
+        '--log', f'{epoch["name"]}.log',
+        '--state', f'{epoch["name"]}_state.json',
+    ]
+    for key, value in epoch.items():
+        if key in ('name', 'userno', 'disk', 'size', 'required'):
+            continue
+        if value is True:
+            command.append(f'--{key}')
+        elif isinstance(value, list):
+            command.extend([f'--{key}', *map(str, value)])
+        elif value is not None and value is not False:
+            command.extend([f'--{key}', str(value)])
+    return command
+
+def required_space(epoch, factor):
+    # disk space needed by an epoch (explicit, or scaled input size)
+    if epoch.get('size') is not None:
+        return float(epoch['size']) * 1e9
+    return os.path.getsize(epoch['file']) * factor
+
+def free_space(disk):
+    # free bytes on the filesystem of an AIPS disk
+    return shutil.disk_usage(AIPS.disks[disk].dirname).free
+
+def pick_disk(epoch, disks, running, args):
+    # least loaded disk with a free slot and enough space, if any
+    candidates = []
+    for disk in disks:
+        active = [job for job in running if job['disk'] == disk]
+        if len(active) >= args.per_disk:
+            continue
+        reserved = sum(job['size'] for job in active)
+        if free_space(disk) - reserved >= epoch['required'] + args.reserve:
+            candidates.append((len(active), reserved, disk))
+    return min(candidates)[2] if candidates else None
+
+def write_status(filename, jobs):
+    # persist per-epoch status
+    with open(filename, 'w') as file:
+        json.dump(
+            {
+                job['name']: {
+                    key: job[key]
+                    for key in ('status', 'userno', 'disk', 'elapsed')
+                }
+                for job in jobs
+            },
+            file, indent=4
+        )
+
+# ----- #
+
+if __name__ == '__main__':
+    """
+    This script runs pipeline.py on many KaVA epochs concurrently,
+    assigning AIPS user numbers and disks to each reduction.
+    """
+    # parse arguments
+    ps = ArgumentParser(
+        prog='KaVA Batch Pipeline',
+        description='''Multi-epoch batch driver for the KaVA Star
+            Formation LP pipeline. The manifest is a YAML file with an
+            optional "defaults" mapping and an "epochs" list, where each
+            epoch has a "name" and pipeline.py options (by long name,
+            e.g. file, target, calibrator, antab_file, refant,
+            phase_ref_chan). An epoch may also set its own "userno",
+            "disk", and expected disk usage "size" in GB.''',
+        fromfile_prefix_chars='@'
+    )
+    ps.add_argument(
+        'manifest', type=str,
+        help='Epoch manifest file',
+        metavar='MANIFEST'
+    )
+    ps.add_argument(
+        '-u', '--userno', type=int,
+        help='First AIPS user number, incremented for each epoch',
+        metavar='USER_NO', required=True
+    )
+    ps.add_argument(
+        '-d', '--disks', type=int, nargs='+',
+        help='AIPS disk numbers to schedule reductions on',
+        metavar=('DISK_1', 'DISK_2'), default=[1]
+    )
+    ps.add_argument(
+        '--per_disk', type=int,
+        help='Maximum number of concurrent reductions per disk',
+        metavar='N', default=1
+    )
+    ps.add_argument(
+        '--space_factor', type=float,
+        help='''Disk usage of a reduction as a multiple of its input
+            file size (for epochs without a "size")''',
+        metavar='FACTOR', default=5
+    )
+    ps.add_argument(
+        '--reserve', type=float,
+        help='Free space in GB to always keep on each disk',
+        metavar='GB', default=10
+    )
+    ps.add_argument(
+        '--workdir', type=str,
+        help='Directory for per-epoch logs, states, and outputs',
+        metavar='WORKDIR', default='./'
+    )
+    ps.add_argument(
+        '--status', type=str,
+        help='Batch status file',
+        metavar='STATUS', default='batch_status.json'
+    )
+    ps.add_argument(
+        '--poll', type=float,
+        help='Seconds between checks on running reductions',
+        metavar='SECONDS', default=10
+    )
+    args = ps.parse_args()
+    args.reserve *= 1e9
+
+    # prepare epochs (skipping those with missing input files)
+    jobs = []
+    for i, epoch in enumerate(load_manifest(args.manifest)):
+        missing = [
+            epoch[key] for key in ('file', 'flag_file', 'antab_file')
+            if epoch.get(key) is not None and not os.path.exists(epoch[key])
+        ]
+        if missing:
+            print(f'{epoch["name"]}: skipped (missing {", ".join(missing)})')
+        epoch['required'] = (
+            None if missing else required_space(epoch, args.space_factor)
+        )
+        jobs.append({
+            'name': epoch['name'],
+            'epoch': epoch,
+            'userno': epoch.get('userno', args.userno + i),
+            'disk': None,
+            'size': epoch['required'],
+            'status': 'missing' if missing else 'pending',
+            'elapsed': None,
+        })
+
+    # check that no two epochs share an AIPS user number
+    usernos = {}
+    for job in jobs:
+        usernos.setdefault(job['userno'], []).append(job['name'])
+    shared = {
+        userno: names for userno, names in usernos.items() if len(names) > 1
+    }
+    if shared:
+        ps.error('epochs share AIPS user numbers: ' + '; '.join(
+            f'{userno} ({", ".join(names)})'
+            for userno, names in shared.items()
+        ))
+
+    # run reductions
+    start = time.perf_counter()
+    running = []
+    pending = [job for job in jobs if job['status'] == 'pending']
+    while pending or running:
+        # check running reductions
+        for job in list(running):
+            returncode = job['process'].poll()
+            if returncode is None:
+                continue
+            job['log'].close()
+            job['elapsed'] = time.perf_counter() - job['start']
+            job['status'] = 'done' if returncode == 0 else 'failed'
+            running.remove(job)
+            print(
+                f'{job["name"]}: {job["status"]} in {job["elapsed"]:.0f} s '
+                f'(user {job["userno"]}, disk {job["disk"]})'
+            )
+
+        # start pending reductions where disks allow
+        for job in list(pending):
+            disks = [job['epoch']['disk']] \
+                if 'disk' in job['epoch'] else args.disks
+            disk = pick_disk(job['epoch'], disks, running, args)
+            if disk is None:
+                if not running:
+                    job['status'] = 'skipped'
+                    pending.remove(job)
+                    print(f'{job["name"]}: skipped (not enough disk space)')
+                continue
+            directory = os.path.join(args.workdir, job['name'])
+            os.makedirs(directory, exist_ok=True)
+            job['disk'] = disk
+            job['log'] = open(os.path.join(directory, 'batch.log'), 'a')
+            job['process'] = subprocess.Popen(
+                pipeline_command(job['epoch'], job['userno'], disk),
+                cwd=directory,
+                stdin=subprocess.DEVNULL,
+                stdout=job['log'], stderr=subprocess.STDOUT
+            )
+            job['start'] = time.perf_counter()
+            job['status'] = 'running'
+            running.append(job)
+            pending.remove(job)
+            print(
+                f'{job["name"]}: started (user {job["userno"]}, disk {disk})'
+            )
+
+        write_status(args.status, jobs)
+        if pending or running:
+            time.sleep(args.poll)
+
+    # report throughput
+    elapsed = time.perf_counter() - start
+    done = [job for job in jobs if job['status'] == 'done']
+    volume = sum(os.path.getsize(job['epoch']['file']) for job in done)
+    print(
+        f'Reduced {len(done)}/{len(jobs)} epochs in {elapsed/3600:.2f} h '
+        f'({len(done)/elapsed*3600:.2f} epochs/h, '
+        f'{volume/1e9/elapsed*3600:.1f} GB/h)'
+    )
+    for job in jobs:
+        elapsed = f'{job["elapsed"]:.0f} s' if job['elapsed'] else '-'
+        print(f'{job["name"]:<20} {job["status"]:<8} {elapsed}')
@@ -0,0 +1,226 @@
+from argparse import ArgumentParser
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+# benchmark against the local simulator unless a backend is chosen
+os.environ.setdefault('RCW142_BACKEND', 'local')
+
+from backend import AIPS, BACKEND
+
+from estimate import load_cost_model, uv_dimensions, plan_imaging
+from simulator import synthesize_uvfits
+from tasks import fitld
+from wizardry import grab_uv, iter_uv, uv_frequencies, weighted_average, \
+    vector_average, scalar_average, masked_vector_average, average_uv, \
+    grid_uv, dirty_image
+
+# benchmark functions
+def load_synthetic(directory, disk, **kwargs):
+    # synthesize noise visibilities (see synthesize_uvfits) and load
+    # them with FITLD
+    filename = os.path.join(directory, 'benchmark.uvfits')
+    synthesize_uvfits(filename, **kwargs)
+    return fitld(datain=filename, outdisk=disk, clint=0.25)
+
+def grid_channel(uvdata, source, IFs, channel, cellsize, imsize, scale):
+    # grid one channel of every IF in a single read, as rms_check does
+    grid, weight = None, 0.0
+    for chunk in iter_uv(uvdata, source, IF=IFs, compact=True):
+        grid, chunk_weight = grid_uv(
+            chunk, channel, cellsize, imsize, scale=scale, grid=grid
+        )
+        weight += chunk_weight
+    return grid, weight
+
+def benchmark_cases(uvdata, source, channel, cellsize, imsize, fields, niter):
+    # named calls to time, with the inputs of the averages, FFT, and
+    # imaging plan prepared once up front
+    IFs = list(range(1, len(uv_frequencies(uvdata)) + 1))
+    header = uvdata.header
+    reffreq = header['crval'][header['ctype'].index('FREQ')]
+    scale = uv_frequencies(uvdata)[:, channel - 1] / reffreq
+    uv = grab_uv(uvdata, source, IF=IFs)
+    compact = grab_uv(uvdata, source, IF=IFs, compact=True)
+    real, imag, weig = (
+        np.asarray(uv[key]) for key in ('real', 'imag', 'weig')
+    )
+    vis = np.asarray(compact['vis'])
+    grid, weight = grid_channel(
+        uvdata, source, IFs, channel, cellsize, imsize, scale
+    )
+    dims = uv_dimensions(uvdata)
+    model = load_cost_model()
+    plan_fields = [
+        {'index': i + 1, 'imsize': imsize, 'bchan': 0, 'echan': 0}
+        for i in range(fields)
+    ]
+    return {
+        'grab_uv': lambda: grab_uv(uvdata, source, IF=IFs),
+        'grab_uv (compact)': lambda: grab_uv(
+            uvdata, source, IF=IFs, compact=True
+        ),
+        'iter_uv (compact)': lambda: [
+            len(chunk) for chunk in iter_uv(
+                uvdata, source, IF=IFs, compact=True
+            )
+        ],
+        'weighted_average': lambda: weighted_average(real, imag, weig, 0),
+        'vector_average': lambda: vector_average(vis, None, weig, 0),
+        'scalar_average': lambda: scalar_average(vis, None, weig, 0),
+        'masked_vector_average': lambda: masked_vector_average(
+            vis, None, weig, 0
+        ),
+        'average_uv': lambda: average_uv(compact),
+        'grid_uv': lambda: grid_channel(
+            uvdata, source, IFs, channel, cellsize, imsize, scale
+        ),
+        'dirty_image': lambda: dirty_image(grid, weight),
+        'uv_dimensions': lambda: uv_dimensions(uvdata),
+        'plan_imaging': lambda: plan_imaging(dims, plan_fields, niter, model),
+    }
+
+def run_benchmarks(cases, repeat):
+    # best and mean wall-clock seconds of repeated calls of each case
+    results = {}
+    for name, call in cases.items():
+        seconds = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            call()
+            seconds.append(time.perf_counter() - start)
+        results[name] = {
+            'best': min(seconds), 'mean': sum(seconds) / len(seconds)
+        }
+    return results
+
+def print_results(results, dims):
+    # print a table of benchmark timings
+    print(
+        f"{dims['nvis']} visibilities of {dims['nif']} IFs x "
+        f"{dims['nchan']} channels x {dims['nstokes']} Stokes "
+        f"({BACKEND} backend)"
+    )
+    print(f"{'Benchmark':<24} {'Best (ms)':>12} {'Mean (ms)':>12}")
+    for name, result in results.items():
+        print(
+            f"{name:<24} {1e3 * result['best']:>12.3f} "
+            f"{1e3 * result['mean']:>12.3f}"
+        )
+
+# ----- #
+
+if __name__ == '__main__':
+    """
+    This script times the visibility reading, averaging, gridding, and
+    imaging plan functions on synthesized data.
+    """
+    # parse arguments
+    ps = ArgumentParser(
+        prog='Benchmark',
+        description='''Times grab_uv, iter_uv, the visibility averages,
+            the gridder, and the imaging plan on noise visibilities
+            synthesized with synthesize_uvfits (against the local
+            simulator backend unless RCW142_BACKEND is set).''',
+        fromfile_prefix_chars='@'
+    )
+    ps.add_argument(
+        'userno', type=int,
+        help='AIPS user number',
+        metavar='USER_NO'
+    )
+    ps.add_argument(
+        '--disk', type=int,
+        help='AIPS disk to load the synthesized data to',
+        metavar='DISK', default=1
+    )
+    ps.add_argument(
+        '--nant', type=int,
+        help='Number of antennas',
+        metavar='NANT', default=7
+    )
+    ps.add_argument(
+        '--nif', type=int,
+        help='Number of IFs',
+        metavar='NIF', default=2
+    )
+    ps.add_argument(
+        '--nchan', type=int,
+        help='Number of channels per IF',
+        metavar='NCHAN', default=64
+    )
+    ps.add_argument(
+        '--ntime', type=int,
+        help='Number of integrations',
+        metavar='NTIME', default=1000
+    )
+    ps.add_argument(
+        '--channel', type=int,
+        help='Channel to grid',
+        metavar='CHAN', default=1
+    )
+    ps.add_argument(
+        '--cellsize', type=float,
+        help='Cell size in arcseconds',
+        metavar='CELLSIZE', default=1e-3
+    )
+    ps.add_argument(
+        '--imsize', type=int,
+        help='Image size in pixels',
+        metavar='IMSIZE', default=1024
+    )
+    ps.add_argument(
+        '--fields', type=int,
+        help='Number of fields in the imaging plan',
+        metavar='FIELDS', default=100
+    )
+    ps.add_argument(
+        '--niter', type=int,
+        help='Number of clean iterations in the imaging plan',
+        metavar='NITER', default=1000
+    )
+    ps.add_argument(
+        '--repeat', type=int,
+        help='Number of timed calls of each benchmark',
+        metavar='REPEAT', default=5
+    )
+    ps.add_argument(
+        '-o', '--output', type=str,
+        help='JSON file to write the timings to',
+        metavar='FILE', default=None
+    )
+    args = ps.parse_args()
+    if not 1 <= args.channel <= args.nchan:
+        ps.error('--channel must be within the synthesized channels')
+
+    # prepare AIPS
+    AIPS.userno = args.userno
+
+    # synthesize and load data, then time each benchmark
+    with tempfile.TemporaryDirectory() as directory:
+        uvdata = load_synthetic(
+            directory, args.disk, nant=args.nant, nif=args.nif,
+            nchan=args.nchan, ntime=args.ntime
+        )
+    try:
+        cases = benchmark_cases(
+            uvdata, 'TARGET', args.channel, args.cellsize, args.imsize,
+            args.fields, args.niter
+        )
+        results = run_benchmarks(cases, args.repeat)
+        dims = uv_dimensions(uvdata)
+    finally:
+        uvdata.zap()
+
+    # report timings
+    print_results(results, dims)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(
+                {'backend': BACKEND, 'dims': dims, 'args': vars(args),
+                 'results': results},
+                file, indent=4
+            )
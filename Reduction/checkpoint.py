@@ -0,0 +1,146 @@
+import json
+import os
+
+from backend import AIPS, AIPSImage, AIPSUVData
+
+from tasks import grab_catalogue
+
+# main checkpoint class
+class Checkpoint:
+    """
+    Persisted stage state for resumable AIPS pipelines. Each stage is
+    run through the checkpoint, which records its inputs, the
+    catalogue entry of the UV data it returns, and the table versions
+    attached to that data once the stage completes. On a rerun, stages
+    are skipped for as long as they completed before with the same
+    inputs; from the first stage that failed or changed onwards, every
+    stage is run again.
+    Parameters:
+        filename (str): JSON file to persist the stage state in.
+        restart (bool, optional): Whether to ignore any persisted state
+            and run every stage.
+    Usage:
+        checkpoint = Checkpoint('pipeline_state.json')
+        uvdata = checkpoint.run('load', load, None, file=..., ...)
+        uvdata = checkpoint.run('calibrate', calibrate, uvdata, ...)
+    Methods:
+        run(name, func, uvdata, **inputs): Runs (or skips) a stage,
+            returning the resulting UV data.
+    Notes:
+        File paths given as inputs are recorded with their modification
+        time, so editing a flag or ANTAB file reruns its stage. Each 
+        stage also records the AIPS catalogue (of every disk) when it 
+        starts. If a stage fails, and before a stage from an earlier 
+        run is rerun, the catalogue entries added since that record 
+        (e.g. FITLD, MSORT, or CVEL outputs of a failed attempt, or of 
+        the stages after it) are zapped, and tables that were added to 
+        the UV data after the previous stage completed are deleted, so 
+        sequence numbers and table versions stay consistent. Entries 
+        are compared per AIPS user, so other reductions under the same 
+        user number must not run alongside.
+    """
+    def __init__(self, filename, restart=False):
+        self.filename = filename
+        self.stages = {}
+        self.previous = None
+        self.resuming = not restart
+        if self.resuming and os.path.exists(filename):
+            with open(filename, 'r') as file:
+                self.stages = json.load(file)
+
+    def run(self, name, func, uvdata, **inputs):
+        recorded = self._normalize(inputs)
+        if uvdata is not None:
+            recorded['uvdata'] = self._catalogue(uvdata)
+
+        # skip stage if completed with the same inputs
+        record = self.stages.get(name)
+        if (
+            self.resuming and record is not None
+            and record['status'] == 'done' and record['inputs'] == recorded
+        ):
+            output = AIPSUVData(*record['uvdata'])
+            if output.exists():
+                print(f'Skipping completed stage: {name}')
+                self.previous = record
+                return output
+
+        # roll back the catalogue of the previous run from this stage on
+        if self.resuming and record is not None and 'catalogue' in record:
+            self._restore_catalogue(record['catalogue'])
+        self.resuming = False
+
+        # restore tables and run stage
+        self._restore(uvdata, None)
+        self.stages[name] = {
+            'status': 'running', 'inputs': recorded, 
+            'catalogue': self._catalogues(),
+        }
+        self._save()
+        try:
+            output = func(uvdata, **inputs)
+        except BaseException:
+            self.stages[name]['status'] = 'failed'
+            self._save()
+            self._restore(uvdata, self.stages[name]['catalogue'])
+            raise
+
+        # record stage output
+        self.stages[name].update({
+            'status': 'done',
+            'uvdata': self._catalogue(output),
+            'tables': self._tables(output),
+        })
+        self._save()
+        self.previous = self.stages[name]
+        return output
+
+    # helper methods for state handling
+    def _save(self):
+        with open(self.filename, 'w') as file:
+            json.dump(self.stages, file, indent=4)
+
+    def _normalize(self, inputs):
+        # round-trip inputs through JSON and stamp input files
+        inputs = json.loads(json.dumps(inputs))
+        stamps = {
+            f'{key}_mtime': os.stat(value).st_mtime_ns
+            for key, value in inputs.items()
+            if isinstance(value, str) and os.path.isfile(value)
+        }
+        return {**inputs, **stamps}
+
+    def _catalogue(self, uvdata):
+        return [uvdata.name, uvdata.klass, uvdata.disk, uvdata.seq]
+
+    def _tables(self, uvdata):
+        return [[table[1], table[0]] for table in uvdata.tables]
+
+    def _catalogues(self):
+        # catalogue entries of every disk as [disk, name, class, seq, type]
+        return [
+            [disk, *key] 
+            for disk in range(1, len(AIPS.disks)) 
+            for key in grab_catalogue(disk)
+        ]
+
+    def _restore(self, uvdata, catalogue):
+        # zap entries added since the catalogue record (if given), and 
+        # delete tables added to uvdata since the previous stage
+        if catalogue is not None:
+            self._restore_catalogue(catalogue)
+        if uvdata is not None and self.previous is not None:
+            self._restore_tables(uvdata, self.previous['tables'])
+
+    def _restore_catalogue(self, catalogue):
+        # zap catalogue entries added since the recorded catalogue
+        for disk, name, klass, seq, data_type in self._catalogues():
+            if [disk, name, klass, seq, data_type] not in catalogue:
+                data_class = AIPSUVData if data_type == 'UV' else AIPSImage
+                data_class(name, klass, disk, seq).zap()
+
+    def _restore_tables(self, uvdata, tables):
+        # delete tables added since the recorded table versions
+        for table in self._tables(uvdata):
+            if table not in tables:
+                uvdata.zap_table(table[0].replace('AIPS ', ''), table[1])
@@ -4,11 +4,12 @@ from astropy import units as u
 from astropy.table import vstack
 import numpy as np
 
-from AIPS import AIPS
-from AIPSData import AIPSUVData
+from backend import AIPS, AIPSUVData
 
-from tasks import imagr, ccmrg
-from wizardry import switch_spectral, grab_table, grab_wcs
+from estimate import load_cost_model, uv_dimensions, plan_imaging, \
+    check_plan, print_plan
+from tasks import imagr
+from wizardry import switch_spectral, grab_tables, grab_wcs, merge_components
 
 # ----- #
 
@@ -65,6 +66,19 @@ if __name__ == '__main__':
         metavar='OUTPUT',
         default='coarse_imaging.fits'
     )
+    ps.add_argument(
+        '--plan', action='store_true', 
+        help='Print the predicted runtime and disk usage, and exit'
+    )
+    ps.add_argument(
+        '--force', action='store_true', 
+        help='Run even if the projected disk usage exceeds free space'
+    )
+    ps.add_argument(
+        '--cost_model', type=str, 
+        help='Cost model file for runtime predictions (see estimate.py)', 
+        metavar='COST_MODEL', default=None
+    )
     args = ps.parse_args()
     args.catalogue[2] = int(args.catalogue[2])
     args.catalogue[3] = int(args.catalogue[3])
@@ -78,6 +92,21 @@ if __name__ == '__main__':
         args.catalogue[3], args.catalogue[2]
     )
     
+    # plan runtime and disk usage
+    plan = plan_imaging(
+        uv_dimensions(uvdata), 
+        [{
+            'index': 'coarse', 'imsize': args.imsize, 
+            'bchan': args.channel[0], 'echan': args.channel[1], 
+            'nchav': args.nchav
+        }], 
+        args.niter, load_cost_model(args.cost_model)
+    )
+    print_plan(plan, 'field')
+    check_plan(ps, {args.catalogue[3]: plan[0]['bytes']}, check=not args.force)
+    if args.plan:
+        ps.exit()
+    
     # perform imaging
     _, image = imagr(
         indata=uvdata, 
@@ -93,27 +122,18 @@ if __name__ == '__main__':
             'dotv': -1
         }
     )
-    for chan in range(
-        int((args.channel[1] - args.channel[0] + 1) / args.nchav)
-    ):
-        ccmrg(
-            indata=image, 
-            params={
-                'invers': chan + 1,
-                'outvers': chan + 1,
-            }
-        )
     switch_spectral(image)
     
-    # grab clean components (before the first negative flux)
+    # grab and merge clean components (before the first negative flux, 
+    # in CCMRG order; the CC tables in AIPS are left unmerged)
     wcs = grab_wcs(image)
+    nplanes = int((args.channel[1] - args.channel[0] + 1) / args.nchav)
+    cc_tables = grab_tables(
+        image, 'CC', range(1, nplanes + 1), ignore=['_status']
+    )
     ccs = []
-    for chan in range(
-        int((args.channel[1] - args.channel[0] + 1) / args.nchav)
-    ):
-        cc = grab_table(
-            image, 'CC', table_index=chan + 1, ignore=['_status']
-        )
+    for chan, cc in enumerate(cc_tables):
+        cc = merge_components(cc)
         cc['flux'].unit = u.Jy
         cc['deltax'] *= 3600
         cc['deltay'] *= 3600
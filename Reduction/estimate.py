@@ -0,0 +1,309 @@
+from argparse import ArgumentParser
+import json
+import shutil
+
+from astropy.io import fits
+import numpy as np
+
+from backend import AIPS, wAIPSUVData
+
+# default cost model: seconds per GB of visibilities read by each task,
+# fixed seconds per task call, and the imaging terms of IMAGR (seconds
+# per GB of gridded visibilities, per 1e9 FFT operations, and per 1e6
+# clean iterations over a plane)
+COST_MODEL = {
+    'task_overhead': 3.0,
+    'seconds_per_gb': {
+        'FITLD': 60.0, 'MSORT': 60.0, 'INDXR': 10.0, 'ACCOR': 20.0,
+        'CLCAL': 5.0, 'ANTAB': 1.0, 'APCAL': 2.0, 'BPASS': 20.0,
+        'FRING': 120.0, 'SNEDT': 0.0, 'TABED': 0.0, 'SETJY': 0.0,
+        'UVFLG': 1.0, 'CVEL': 60.0, 'SPLIT': 40.0, 'FITTP': 10.0,
+    },
+    'imagr_grid': 30.0,
+    'imagr_fft': 2.0,
+    'imagr_clean': 20.0,
+}
+
+# pipeline.py stages: tasks run, copies of the data kept after the
+# stage, and temporary copies during the stage
+PIPELINE_STAGES = {
+    'load': (['FITLD', 'MSORT', 'INDXR'], 1, 1),
+    'flag': (['UVFLG'], 0, 0),
+    'calibrate_amplitudes': (
+        ['ACCOR', 'SNEDT', 'CLCAL', 'ANTAB', 'APCAL', 'CLCAL', 'BPASS'], 0, 0
+    ),
+    'calibrate_delays': (['FRING', 'SNEDT', 'CLCAL'], 0, 0),
+    'calibrate_doppler': (['TABED', 'SETJY', 'CVEL', 'TABED'], 1, 0),
+    'calibrate_rates': (['FRING', 'SNEDT', 'CLCAL'], 0, 0),
+    'finalize': (['SPLIT'], 1, 0),
+}
+
+# cost model functions
+def load_cost_model(filename=None):
+    """
+    Loads the cost model, with coefficients from a JSON file (e.g. from
+    calibrate_cost_model) replacing the defaults.
+    Parameters:
+        filename (str, optional): The cost model file.
+    Returns:
+        dict: The cost model.
+    """
+    model = json.loads(json.dumps(COST_MODEL))
+    if filename is not None:
+        with open(filename, 'r') as file:
+            custom = json.load(file)
+        model['seconds_per_gb'].update(custom.pop('seconds_per_gb', {}))
+        model.update(custom)
+    return model
+
+def calibrate_cost_model(trace_file, size, model=None):
+    """
+    Calibrates the per-task costs of a cost model from the trace of a
+    previous run (see tasks.write_trace).
+    Parameters:
+        trace_file (str): The trace file of the run.
+        size (float): The size of the visibilities of the run in bytes.
+        model (dict, optional): The cost model to calibrate (defaults
+            to the default cost model).
+    Returns:
+        dict: The calibrated cost model.
+    Notes:
+        Each task's cost is its mean duration per call, less the fixed
+        task overhead, per GB of visibilities. IMAGR is not calibrated,
+        as its cost depends on the imaging parameters.
+    """
+    model = json.loads(json.dumps(model or COST_MODEL))
+    with open(trace_file, 'r') as file:
+        events = json.loads('[' + file.read().strip().strip('[,') + ']')
+    durations = {}
+    for event in events:
+        if event.get('cat') == 'task' and event['name'] != 'IMAGR':
+            durations.setdefault(event['name'], []).append(event['dur'] / 1e6)
+    for task, values in durations.items():
+        model['seconds_per_gb'][task] = max(
+            np.mean(values) - model['task_overhead'], 0
+        ) / (size / 1e9)
+    return model
+
+# data dimension functions
+def fits_dimensions(filename):
+    """
+    Reads the dimensions of the visibilities in a FITS-IDI or random
+    groups UV FITS file from its headers.
+    Parameters:
+        filename (str): The FITS file name.
+    Returns:
+        dict: The number of visibilities (nvis), IFs (nif), channels
+            (nchan), and polarizations (nstokes), and the record size
+            in bytes (lrec) once loaded into AIPS.
+    """
+    with fits.open(filename) as hdul:
+        if isinstance(hdul[0], fits.GroupsHDU):
+            header = hdul[0].header
+            axes = {
+                header[f'CTYPE{i}'].strip(): header[f'NAXIS{i}']
+                for i in range(2, header['NAXIS'] + 1)
+            }
+            dims = {
+                'nvis': header['GCOUNT'], 'nif': axes.get('IF', 1),
+                'nchan': axes['FREQ'], 'nstokes': axes['STOKES'],
+            }
+        else:
+            dims = {'nvis': 0}
+            for hdu in hdul:
+                if hdu.name == 'UV_DATA':
+                    dims = {
+                        'nvis': dims['nvis'] + hdu.header['NAXIS2'],
+                        'nif': hdu.header['NO_BAND'],
+                        'nchan': hdu.header['NO_CHAN'],
+                        'nstokes': hdu.header['NO_STKD'],
+                    }
+    return _with_record_size(dims)
+
+def uv_dimensions(uvdata):
+    """
+    Reads the dimensions of the visibilities of an AIPSUVData object
+    from its header (and the number of visibilities from Wizardry).
+    Parameters:
+        uvdata (AIPSUVData): The AIPS UV data object.
+    Returns:
+        dict: The dimensions, as in fits_dimensions.
+    """
+    temp_uv = wAIPSUVData(uvdata.name, uvdata.klass, uvdata.disk, uvdata.seq)
+    header = temp_uv.header
+    axes = dict(zip(header['ctype'], header['naxis']))
+    return _with_record_size({
+        'nvis': len(temp_uv), 'nif': axes.get('IF', 1),
+        'nchan': axes['FREQ'], 'nstokes': axes['STOKES'],
+    })
+
+# planning functions
+def plan_pipeline(dims, model):
+    """
+    Predicts the runtime and disk usage of each pipeline.py stage.
+    Parameters:
+        dims (dict): The dimensions of the input visibilities.
+        model (dict): The cost model.
+    Returns:
+        list: Stage predictions as dicts of stage name, seconds, bytes
+            on disk after the stage, and peak bytes during the stage.
+    Notes:
+        Disk usage assumes the worst case, where MSORT is needed and
+        the target makes up all of the data.
+    """
+    size = dims['nvis'] * dims['lrec']
+    plan, used = [], 0
+    for stage, (tasks, copies, temporary) in PIPELINE_STAGES.items():
+        plan.append({
+            'stage': stage,
+            'seconds': sum(_task_seconds(task, size, model) for task in tasks),
+            'bytes': used + copies * size,
+            'peak': used + (copies + temporary) * size,
+        })
+        used += copies * size
+    return plan
+
+def plan_imaging(dims, fields, niter, model, export=False):
+    """
+    Predicts the runtime and disk usage of IMAGR runs.
+    Parameters:
+        dims (dict): The dimensions of the visibilities.
+        fields (list): Fields as dicts of imsize, bchan, echan, and
+            optionally nchav (with channels of 0 meaning all channels,
+            as in IMAGR).
+        niter (int): The number of clean iterations per plane.
+        model (dict): The cost model.
+        export (bool, optional): Whether each image is also exported
+            with FITTP.
+    Returns:
+        list: Field predictions as dicts of field index, seconds, image
+            bytes in AIPS, and exported bytes.
+    """
+    plan = []
+    for i, field in enumerate(fields):
+        imsize, nchav = int(field['imsize']), int(field.get('nchav', 1))
+        bchan = max(int(field['bchan']), 1)
+        echan = int(field['echan']) or dims['nchan']
+        nchan = echan - bchan + 1
+        nplanes = nchan // nchav
+        pixels = nplanes * imsize**2
+        gridded = dims['nvis'] * nchan * dims['nstokes'] * 12
+        seconds = (
+            model['task_overhead']
+            + model['imagr_grid'] * gridded / 1e9
+            + model['imagr_fft'] * 2 * pixels * np.log2(imsize**2) / 1e9
+            + model['imagr_clean'] * nplanes * niter / 1e6
+        )
+        if export:
+            seconds += _task_seconds('FITTP', pixels * 4, model)
+        plan.append({
+            'field': field.get('index', i + 1),
+            'seconds': seconds,
+            'bytes': 2 * pixels * 4,
+            'export': pixels * 4 if export else 0,
+        })
+    return plan
+
+def check_plan(ps, required, check=True):
+    """
+    Prints the disk space a run needs on each disk or directory, and
+    stops the run if any does not have enough free space.
+    Parameters:
+        ps (ArgumentParser): The script's argument parser (for errors).
+        required (dict): Bytes needed, keyed by AIPS disk number or
+            directory.
+        check (bool, optional): Whether to stop the run.
+    """
+    for location, size in required.items():
+        free = _free_space(location)
+        name = f'disk {location}' if isinstance(location, int) else location
+        print(
+            f'{name}: {_gb(size)} needed, '
+            f'{_gb(free) if free is not None else "unknown"} free'
+        )
+        if check and free is not None and size > free:
+            ps.error(
+                f'projected disk use on {name} exceeds free space '
+                '(use --force to run anyway)'
+            )
+
+def print_plan(plan, key, workers=1):
+    # print per-stage or per-field predictions, and the total runtime
+    for item in plan:
+        print(
+            f'{item[key]:<24} {item["seconds"]/60:8.1f} min '
+            f'{_gb(item.get("peak", item["bytes"])):>10}'
+        )
+    total = sum(item['seconds'] for item in plan) / workers
+    print(f'{"total":<24} {total/60:8.1f} min')
+
+# utility functions
+def _with_record_size(dims):
+    # add the AIPS record size (random parameters and visibilities)
+    visibilities = dims['nif'] * dims['nchan'] * dims['nstokes'] * 3
+    return {**dims, 'lrec': 4 * (9 + visibilities)}
+
+def _task_seconds(task, size, model):
+    # predicted runtime of a task reading size bytes
+    return model['task_overhead'] + (
+        model['seconds_per_gb'].get(task, 0.0) * size / 1e9
+    )
+
+def _free_space(location):
+    # free bytes on an AIPS disk or in a directory (None if unknown)
+    try:
+        if isinstance(location, int):
+            location = AIPS.disks[location].dirname
+        return shutil.disk_usage(location).free
+    except (AttributeError, IndexError, OSError):
+        return None
+
+def _gb(size):
+    return f'{size/1e9:.2f} GB'
+
+# ----- #
+
+if __name__ == '__main__':
+    """
+    This script calibrates the cost model used by the planning mode of
+    pipeline.py, coarse_imaging.py, and fine_imaging.py.
+    """
+    # parse arguments
+    ps = ArgumentParser(
+        prog='Estimate',
+        description='''Calibrates the runtime cost model from the trace
+            (PYAIPSTASK_TRACE) of a previous pipeline run.''',
+        fromfile_prefix_chars='@'
+    )
+    ps.add_argument(
+        'trace', type=str,
+        help='Trace file of a previous run',
+        metavar='TRACE'
+    )
+    ps.add_argument(
+        '-f', '--file', type=str,
+        help='Visibility file name loaded in the run',
+        metavar='FILE', required=True
+    )
+    ps.add_argument(
+        '--cost_model', type=str,
+        help='Cost model file to start from',
+        metavar='COST_MODEL', default=None
+    )
+    ps.add_argument(
+        '-o', '--output', type=str,
+        help='Calibrated cost model file',
+        metavar='OUTPUT', default='cost_model.json'
+    )
+    args = ps.parse_args()
+
+    # calibrate and save cost model
+    dims = fits_dimensions(args.file)
+    model = calibrate_cost_model(
+        args.trace, dims['nvis'] * dims['lrec'],
+        load_cost_model(args.cost_model)
+    )
+    with open(args.output, 'w') as file:
+        json.dump(model, file, indent=4)
+    for task, cost in sorted(model['seconds_per_gb'].items()):
+        print(f'{task:<8} {cost:8.1f} s/GB')
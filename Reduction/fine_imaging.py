@@ -1,13 +1,73 @@
 from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import os
+import time
 
 from astropy.table import Table
 
-from AIPS import AIPS
-from AIPSData import AIPSUVData
+from backend import AIPS, AIPSUVData
 
+from estimate import load_cost_model, uv_dimensions, plan_imaging, \
+    check_plan, print_plan
 from tasks import imagr, fittp
 from wizardry import switch_spectral
 
+def init_worker(userno):
+    # prepare AIPS for a worker
+    AIPS.userno = userno
+
+def assign_fields(plan, workers):
+    # split fields between workers ahead of time, longest predicted 
+    # field first onto the least loaded worker
+    blocks = [[] for _ in range(workers)]
+    load = [0.0] * workers
+    for i in sorted(range(len(plan)), key=lambda i: -plan[i]['seconds']):
+        worker = load.index(min(load))
+        blocks[worker].append(i)
+        load[worker] += plan[i]['seconds']
+    return [sorted(block) for block in blocks]
+
+def image_fields(catalogue, outdisk, fields, niter, output):
+    # image a worker's block of fields in turn on its own output disk
+    for field in fields:
+        index, elapsed = image_field(
+            catalogue, outdisk, field, niter, output
+        )
+        print(
+            f'Field {index:03}: {elapsed:.1f} s (disk {outdisk})\n', 
+            end='', flush=True
+        )
+    return len(fields)
+
+def image_field(catalogue, outdisk, field, niter, output):
+    # image a single field and export it to FITS
+    start = time.perf_counter()
+    uvdata = AIPSUVData(
+        catalogue[0], catalogue[1], 
+        catalogue[3], catalogue[2]
+    )
+    _, image = imagr(
+        indata=uvdata,
+        outdisk=outdisk,
+        cellsize=float(field['cellsize']),
+        imsize=int(field['imsize']),
+        niter=niter,
+        params={
+            'bchan': int(field['bchan']),
+            'echan': int(field['echan']),
+            'do3dimag': 1,
+            'rashift|1': float(field['rashift']),
+            'decshift|1': float(field['decshift']),
+            'dotv': -1
+        }
+    )
+    switch_spectral(image)
+    fittp(
+        indata=image, 
+        dataout=f'{output}fine{field["index"]:03}.fits'
+    )
+    return field['index'], time.perf_counter() - start
+
 # ----- #
 
 if __name__ == '__main__':
@@ -45,39 +105,87 @@ if __name__ == '__main__':
         help='Output prefix for all images', 
         metavar='OUTPUT', default='./'
     )
+    ps.add_argument(
+        '--workers', type=int, 
+        help='Number of fields to image concurrently', 
+        metavar='WORKERS', default=1
+    )
+    ps.add_argument(
+        '--disks', type=int, nargs='+', 
+        help='''AIPS disk numbers for image outputs, one per worker 
+            (defaults to the visibility disk)''', 
+        metavar=('DISK_1', 'DISK_2'), default=None
+    )
+    ps.add_argument(
+        '--plan', action='store_true', 
+        help='Print the predicted runtime and disk usage, and exit'
+    )
+    ps.add_argument(
+        '--force', action='store_true', 
+        help='Run even if the projected disk usage exceeds free space'
+    )
+    ps.add_argument(
+        '--cost_model', type=str, 
+        help='Cost model file for runtime predictions (see estimate.py)', 
+        metavar='COST_MODEL', default=None
+    )
     args = ps.parse_args()
     args.catalogue[2] = int(args.catalogue[2])
     args.catalogue[3] = int(args.catalogue[3])
+    if args.disks is None:
+        args.disks = [args.catalogue[3]]
+    if len(set(args.disks[:args.workers])) < args.workers:
+        ps.error('each worker needs its own output disk (see --disks)')
     
     # prepare AIPS
     AIPS.userno = args.userno
     
-    # load visibility data and fields
+    # load fields and output disks of workers
+    fields = Table.read(args.field, format='ascii.commented_header')
+    fields = [dict(zip(fields.colnames, field)) for field in fields]
+    disks = args.disks[:args.workers]
+    
+    # plan runtime and disk usage, with fields assigned to workers (and 
+    # so to disks) ahead of time, so each disk holds exactly its fields
     uvdata = AIPSUVData(
         args.catalogue[0], args.catalogue[1], 
         args.catalogue[3], args.catalogue[2]
     )
-    fields = Table.read(args.field, format='ascii.commented_header')
+    plan = plan_imaging(
+        uv_dimensions(uvdata), 
+        fields, args.niter, load_cost_model(args.cost_model), export=True
+    )
+    print_plan(plan, 'field', workers=args.workers)
+    blocks = assign_fields(plan, len(disks))
+    required = {}
+    for disk, block in zip(disks, blocks):
+        required[disk] = required.get(disk, 0) + sum(
+            plan[i]['bytes'] for i in block
+        )
+    required[os.path.dirname(args.output) or '.'] = sum(
+        field['export'] for field in plan
+    )
+    check_plan(ps, required, check=not args.force)
+    if args.plan:
+        ps.exit()
     
     # perform imaging
-    images = []
-    for field in fields:
-        _, image = imagr(
-            indata=uvdata,
-            cellsize=float(field['cellsize']),
-            imsize=int(field['imsize']),
-            niter=args.niter,
-            params={
-                'bchan': int(field['bchan']),
-                'echan': int(field['echan']),
-                'do3dimag': 1,
-                'rashift|1': float(field['rashift']),
-                'decshift|1': float(field['decshift']),
-                'dotv': -1
-            }
-        )
-        switch_spectral(image)
-        fittp(
-            indata=image, 
-            dataout=f'{args.output}fine{field["index"]:03}.fits'
-        )
\ No newline at end of file
+    start = time.perf_counter()
+    with ProcessPoolExecutor(
+        max_workers=args.workers, 
+        initializer=init_worker, 
+        initargs=(args.userno,)
+    ) as pool:
+        futures = [
+            pool.submit(
+                image_fields, args.catalogue, disk, 
+                [fields[i] for i in block], args.niter, args.output
+            )
+            for disk, block in zip(disks, blocks)
+        ]
+        for future in as_completed(futures):
+            future.result()
+    print(
+        f'Imaged {len(fields)} fields in {time.perf_counter() - start:.1f} s '
+        f'with {args.workers} worker(s)'
+    )
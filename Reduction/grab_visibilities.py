@@ -1,7 +1,6 @@
 from argparse import ArgumentParser
 
-from AIPS import AIPS
-from AIPSData import AIPSUVData
+from backend import AIPS, AIPSUVData
 
 from tasks import fittp
 
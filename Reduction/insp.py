@@ -1,9 +1,7 @@
 import os
 from argparse import ArgumentParser
 
-from AIPS import AIPS
-from AIPSTask import AIPSList
-from AIPSData import AIPSUVData
+from backend import AIPS, AIPSList, AIPSUVData
 
 from tasks import possm, uvplt, vplot
 
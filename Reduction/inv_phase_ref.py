@@ -1,10 +1,193 @@
 from argparse import ArgumentParser
 
-from AIPS import AIPS
-from AIPSTask import AIPSList
+from concurrent.futures import ProcessPoolExecutor
+
+from backend import AIPS, AIPSList
 
 from tasks import *
 
+def calibrate_beam(beam, args, disk):
+    # calibrate a single beam up to the dual-beam correction, returning 
+    # its catalogue entry and flag table version
+    # load, sort, and index visibility data
+    uv = fitld(
+        datain=args.files[beam],
+        outdisk=disk,
+        sources=[args.target, *args.calibrator, args.weak_continuum],
+        clint=args.clint,
+        params={'doconcat': 0}
+    )
+    uv = sort_tb(uv)
+    indxr(indata=uv, solint=args.clint)
+
+    # flag visibilities
+    if args.flag_files[beam] is not None:
+        tbin(intext=args.flag_files[beam], outdata=uv)
+        flagver = 1
+    else:
+        flagver = -1
+    
+    # calibrate amplitudes
+    accor(indata=uv, solint=args.accor_solint)
+    edit_sn(
+        indata=uv, invers=1, 
+        mode=args.snedt, nsigma=args.snedt_nsigma, 
+        params={'flagver': flagver}
+    )
+    clcal(
+        indata=uv,
+        snver=2, invers=2, gainver=1, gainuse=2,
+        params={'interpol': '2PT'}
+    )
+    antab(indata=uv, calin=args.antab_files[beam])
+    apcal(indata=uv, params={'solint': args.apcal_solint})
+    clcal(
+        indata=uv,
+        snver=3, invers=3, gainver=2, gainuse=3,
+        params={
+            'interpol': '2PT', 
+            'samptype': 'BOX', 
+            'bparm|1': args.apcal_solint/60
+        }
+    )
+    bpass(
+        indata=uv,
+        calsour=args.calibrator,
+        params={
+            'flagver': flagver,
+            'solint': -1,
+            'bpassprm|1': 1,
+        }
+    )
+    
+    # calibrate doppler in A-beam
+    if beam == 'A':
+        tabed(
+            indata=uv,
+            params={
+                'inext': 'AN',
+                'invers': 1,
+                'optype': 'KEY',
+                'aparm|4': 3,
+                'keyword': 'ARRNAM',
+                'keystrng': 'VLBA',
+            }
+        )
+        setjy(
+            indata=uv,
+            sources=args.target,
+            params={
+                'optype': 'VCAL',
+                'restfreq|1': args.restfreq[0],
+                'restfreq|2': args.restfreq[1],
+                'veltyp': 'LSR',
+                'veldef': 'RADIO',
+            }
+        )
+        uv = cvel(
+            indata=uv,
+            sources=args.target,
+            params={
+                'aparm|4': 1,
+                'aparm|10': 1,
+            }
+        )
+        tabed(
+            indata=uv,
+            params={
+                'inext': 'AN',
+                'invers': 1,
+                'optype': 'KEY',
+                'aparm|4': 3,
+                'keyword': 'ARRNAM',
+                'keystrng': 'VERA',
+            }
+        )
+    
+    # apply uvw corrections
+    tbin(outdata=uv, intext=args.uvw_files[beam])
+    edit_sn(
+        indata=uv, invers=4, 
+        mode=args.snedt, nsigma=args.snedt_nsigma, 
+        params={'dodelay': 1}
+    )
+    clcal(
+        indata=uv,
+        snver=5, invers=5, gainver=3, gainuse=4,
+        params={
+            'opcode': 'CALP',
+            'refant': args.refant
+        }
+    )
+    
+    # calibrate delays with continuum calibrator
+    fring(
+        indata=uv,
+        calsour=args.calibrator,
+        params={
+            'docalib': 1,
+            'gainuse': 4,
+            'flagver': flagver,
+            'refant': args.refant,
+            'solint': args.continuum_solint,
+            'solsub': args.continuum_solsub,
+            'aparm|1': 2,
+            'aparm|4': -1,
+            'aparm|5': 1,
+            'aparm|7': 4,
+            'aparm|9': 1,
+            'dparm|1': 2,
+            'dparm|2': args.continuum_solwin[0],
+            'dparm|3': args.continuum_solwin[1],
+            'dparm|5': -1,
+            'dparm|8': 1,
+        }
+    )
+    edit_sn(
+        indata=uv, invers=6, 
+        mode=args.snedt, nsigma=args.snedt_nsigma, 
+        params={'flagver': flagver}
+    )
+    clcal(
+        indata=uv,
+        calsour=args.calibrator,
+        snver=7, invers=7, gainver=4, gainuse=5,
+        params={
+            'opcode': 'CALP',
+            'interpol': '2PT',
+            'samptype': 'BOX',
+            'smotype': 'FULL',
+            'refant': args.refant,
+        }
+    )
+    
+    # average B-beam weak continuum source in frequency
+    if beam == 'B':
+        uv = splat(
+            indata=uv,
+            sources=args.weak_continuum,
+            params={
+                'outname': args.weak_continuum,
+                'docalib': 1,
+                'gainuse': 5,
+                # 'flagver': 1,
+                'aparm|1': 2,
+            }
+        )
+    
+    return (uv.name, uv.klass, uv.disk, uv.seq), flagver
+
+def beam_worker(beam, args, disk):
+    # calibrate a beam in a worker process, logging to its own file
+    AIPS.userno = args.userno
+    if args.log is not None:
+        AIPS.log = open(f'{args.log}.{beam}', 'w')
+    try:
+        return calibrate_beam(beam, args, disk)
+    finally:
+        if args.log is not None:
+            AIPS.log.close()
+
 # ----- #
 
 if __name__ == "__main__":
@@ -47,9 +230,12 @@ if __name__ == "__main__":
         metavar='WEAK_CONTINUUM', required=True
     )
     ps.add_argument(
-        '-d', '--disk', type=int,
-        help='AIPS disk number to load into',
-        metavar='DISK', default=1
+        '-d', '--disk', type=int, nargs='+',
+        help='''AIPS disk number(s) to load into (A-beam and B-beam, 
+            which are calibrated in parallel if the disks differ; this 
+            needs --snedt auto, as parallel SNEDT sessions would share 
+            the AIPS TV)''',
+        metavar=('DISK_A', 'DISK_B'), default=[1]
     )
     ps.add_argument(
         '-i', '--clint', type=float,
@@ -136,185 +322,62 @@ if __name__ == "__main__":
         help='Maser rate solution window in mHz', 
         metavar='RATE', default=120
     )
+    ps.add_argument(
+        '--snedt', type=str, choices=['interactive', 'auto'], 
+        help='SN table editing mode (SNEDT or automatic outlier flagging)', 
+        metavar='MODE', default='interactive'
+    )
+    ps.add_argument(
+        '--snedt_nsigma', type=float, 
+        help='Outlier threshold in robust sigma for automatic SN editing', 
+        metavar='NSIGMA', default=5.0
+    )
     args = ps.parse_args()
     beams = ['A', 'B']
     args.files = {beam: args.files[i] for i, beam in enumerate(beams)}
     args.flag_files = {beam: args.flag_files[i] for i, beam in enumerate(beams)}
     args.antab_files = {beam: args.antab_files[i] for i, beam in enumerate(beams)}
     args.uvw_files = {beam: args.uvw_files[i] for i, beam in enumerate(beams)}
+    if len(args.disk) > 2:
+        ps.error('at most two disks (A-beam and B-beam) can be given')
+    if len(set(args.disk)) > 1 and args.snedt == 'interactive':
+        ps.error(
+            'beams on different disks are calibrated in parallel, which '
+            'needs --snedt auto (interactive SNEDT uses the AIPS TV)'
+        )
     
     # prepare AIPS
     AIPS.userno = args.userno
     if args.log is not None:
         AIPS.log = open(args.log, 'w')
     
-    # load, sort, and index visibility data
-    uvdata = {
-        beam: fitld(
-            datain=args.files[beam],
-            outdisk=args.disk,
-            sources=[args.target, *args.calibrator, args.weak_continuum],
-            clint=args.clint,
-            params={'doconcat': 0}
-        )
-        for beam in beams
-    }
-    sorted_uvdata = {
-        beam: msort(indata=uv, sort='TB') for beam, uv in uvdata.items()
-    }
-    for uv in uvdata.values(): uv.zap()
-    uvdata = sorted_uvdata
-    for beam, uv in uvdata.items(): indxr(indata=uv, solint=args.clint)
-
-    # flag visibilities
-    flagver = {}
-    for beam, uv in uvdata.items():
-        if args.flag_files[beam] is not None:
-            tbin(intext=args.flag_files[beam], outdata=uv)
-            flagver[beam] = 1
-        else:
-            flagver[beam] = -1
-    
-    # calibrate amplitudes
-    for beam, uv in uvdata.items():
-        accor(indata=uv, solint=args.accor_solint)
-        snedt(indata=uv, invers=1, params={'flagver': flagver[beam]})
-        clcal(
-            indata=uv,
-            snver=2, invers=2, gainver=1, gainuse=2,
-            params={'interpol': '2PT'}
-        )
-        antab(indata=uv, calin=args.antab_files[beam])
-        apcal(indata=uv, params={'solint': args.apcal_solint})
-        clcal(
-            indata=uv,
-            snver=3, invers=3, gainver=2, gainuse=3,
-            params={
-                'interpol': '2PT', 
-                'samptype': 'BOX', 
-                'bparm|1': args.apcal_solint/60
-            }
-        )
-        bpass(
-            indata=uv,
-            calsour=args.calibrator,
-            params={
-                'flagver': flagver[beam],
-                'solint': -1,
-                'bpassprm|1': 1,
-            }
-        )
-    
-    # calibrate doppler in A-beam
-    tabed(
-        indata=uvdata['A'],
-        params={
-            'inext': 'AN',
-            'invers': 1,
-            'optype': 'KEY',
-            'aparm|4': 3,
-            'keyword': 'ARRNAM',
-            'keystrng': 'VLBA',
-        }
-    )
-    setjy(
-        indata=uvdata['A'],
-        sources=args.target,
-        params={
-            'optype': 'VCAL',
-            'restfreq|1': args.restfreq[0],
-            'restfreq|2': args.restfreq[1],
-            'veltyp': 'LSR',
-            'veldef': 'RADIO',
-        }
-    )
-    uvdata['A'] = cvel(
-        indata=uvdata['A'],
-        sources=args.target,
-        params={
-            'aparm|4': 1,
-            'aparm|10': 1,
-        }
-    )
-    tabed(
-        indata=uvdata['A'],
-        params={
-            'inext': 'AN',
-            'invers': 1,
-            'optype': 'KEY',
-            'aparm|4': 3,
-            'keyword': 'ARRNAM',
-            'keystrng': 'VERA',
-        }
-    )
-    
-    # apply uvw corrections
-    for beam, uv in uvdata.items():
-        tbin(outdata=uv, intext=args.uvw_files[beam])
-        snedt(indata=uv, invers=4, params={'dodelay': 1})
-        clcal(
-            indata=uv,
-            snver=5, invers=5, gainver=3, gainuse=4,
-            params={
-                'opcode': 'CALP',
-                'refant': args.refant
-            }
-        )
-    
-    # calibrate delays with continuum calibrator
-    for beam, uv in uvdata.items():
-        fring(
-            indata=uv,
-            calsour=args.calibrator,
-            params={
-                'docalib': 1,
-                'gainuse': 4,
-                'flagver': flagver[beam],
-                'refant': args.refant,
-                'solint': args.continuum_solint,
-                'solsub': args.continuum_solsub,
-                'aparm|1': 2,
-                'aparm|4': -1,
-                'aparm|5': 1,
-                'aparm|7': 4,
-                'aparm|9': 1,
-                'dparm|1': 2,
-                'dparm|2': args.continuum_solwin[0],
-                'dparm|3': args.continuum_solwin[1],
-                'dparm|5': -1,
-                'dparm|8': 1,
+    # calibrate beams independently up to the dual-beam correction, in 
+    # parallel if each beam has its own disk
+    disks = {beam: args.disk[min(i, len(args.disk) - 1)] 
+        for i, beam in enumerate(beams)}
+    if disks['A'] != disks['B']:
+        with ProcessPoolExecutor(max_workers=2) as pool:
+            futures = {
+                beam: pool.submit(beam_worker, beam, args, disks[beam])
+                for beam in beams
             }
-        )
-        snedt(indata=uv, invers=6, params={'flagver': flagver[beam]})
-        clcal(
-            indata=uv,
-            calsour=args.calibrator,
-            snver=7, invers=7, gainver=4, gainuse=5,
-            params={
-                'opcode': 'CALP',
-                'interpol': '2PT',
-                'samptype': 'BOX',
-                'smotype': 'FULL',
-                'refant': args.refant,
+            results = {
+                beam: future.result() for beam, future in futures.items()
             }
-        )
-    
-    # average B-beam weak continuum source in frequency
-    uvdata['B'] = splat(
-        indata=uvdata['B'],
-        sources=args.weak_continuum,
-        params={
-            'outname': args.weak_continuum,
-            'docalib': 1,
-            'gainuse': 5,
-            # 'flagver': 1,
-            'aparm|1': 2,
+    else:
+        results = {
+            beam: calibrate_beam(beam, args, disks[beam]) for beam in beams
         }
-    )
+    uvdata = {beam: AIPSUVData(*results[beam][0]) for beam in beams}
+    flagver = {beam: results[beam][1] for beam in beams}
     
     # apply dual-beam correction (A to B)
     tbin(intext=args.db_file, outdata=uvdata['A'])
-    snedt(indata=uvdata['A'], invers=8, params={'flagver': flagver['A']})
+    edit_sn(
+        indata=uvdata['A'], invers=8, 
+        mode=args.snedt, nsigma=args.snedt_nsigma, 
+        params={'flagver': flagver['A']}
+    )
     clcal(
         indata=uvdata['A'],
         snver=9, invers=9, gainver=5, gainuse=6,
@@ -348,7 +411,11 @@ if __name__ == "__main__":
             'dparm|3': args.maser_solwin
         }
     )
-    snedt(indata=uvdata['A'], invers=10, params={'flagver': flagver['A']})
+    edit_sn(
+        indata=uvdata['A'], invers=10, 
+        mode=args.snedt, nsigma=args.snedt_nsigma, 
+        params={'flagver': flagver['A']}
+    )
     clcal(
         indata=uvdata['A'],
         calsour=args.target,
@@ -5,8 +5,7 @@ from astropy.wcs import WCS
 import matplotlib.pyplot as plt
 import numpy as np
 
-from AIPS import AIPS
-from AIPSTask import AIPSList
+from backend import AIPS, AIPSList
 
 from tasks import *
 from wizardry import grab_im
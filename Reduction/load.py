@@ -1,8 +1,8 @@
 from argparse import ArgumentParser
 
-from AIPS import AIPS
+from backend import AIPS
 
-from tasks import fitld, msort, indxr
+from tasks import fitld, indxr, sort_tb
 
 # ----- #
 
@@ -61,6 +61,5 @@ if __name__ == '__main__':
             'wtthresh': 0.8
         }
     )
-    sorted_uvdata = msort(indata=uvdata, sort='TB')
-    uvdata.zap()
-    indxr(indata=sorted_uvdata, solint=args.clint)
+    uvdata = sort_tb(uvdata)
+    indxr(indata=uvdata, solint=args.clint)
@@ -1,123 +1,23 @@
 from argparse import ArgumentParser
+import os
 import yaml
 
-from AIPS import AIPS
-from AIPSTask import AIPSList
+from backend import AIPS, AIPSList
 
+from checkpoint import Checkpoint
+from estimate import load_cost_model, fits_dimensions, plan_pipeline, \
+    check_plan, print_plan
 from tasks import *
+from wizardry import compile_flags, write_flags
 
-# ----- #
-
-if __name__ == '__main__':
-    """
-    This script is the AIPS calibration pipeline for KaVA Star Formation
-    LP data, primarily for 22 GHz water masers.
-    """
-    # parse arguments
-    ps = ArgumentParser(
-        prog='KaVA Pipeline',
-        description='''AIPS calibration pipeline for KaVA Star Formation
-            LP data.''',
-        fromfile_prefix_chars='@'
-    )
-    ps.add_argument(
-        'userno', type=int, 
-        help='AIPS user number', 
-        metavar='USER_NO'
-    )
-    ps.add_argument(
-        '-f', '--file', type=str, 
-        help='Visibility file name to load', 
-        metavar='FILE', required=True
-    )
-    ps.add_argument(
-        '-t', '--target', type=str, 
-        help='Target maser source name', 
-        metavar='SOURCE', required=True
-    )
-    ps.add_argument(
-        '-c', '--calibrator', type=str, nargs='+', 
-        help='Continuum calibrator source name(s)', 
-        metavar=('CALIBRATOR_1', 'CALIBRATOR_2'), required=True
-    )
-    ps.add_argument(
-        '-d', '--disk', type=int, 
-        help='AIPS disk number to load into', 
-        metavar='DISK', default=1
-    )
-    ps.add_argument(
-        '-i', '--clint', type=float, 
-        help='Integration time in minutes', 
-        metavar='CLINT', default=0.0273
-    )
-    ps.add_argument(
-        '--log', type=str, 
-        help='Log file name', 
-        metavar='LOG', default=None
-    )
-    ps.add_argument(
-        '--flag_file', type=str, 
-        help='Flag table file name', 
-        metavar='FLAG_FILE', default=None
-    )
-    ps.add_argument(
-        '--antab_file', type=str, 
-        help='ANTAB file name', 
-        metavar='ANTAB_FILE', required=True
-    )
-    ps.add_argument(
-        '--refant', type=int, 
-        help='Reference antenna for phase, delay, and rate calibrations', 
-        metavar='REFANT', required=True
-    )
-    ps.add_argument(
-        '--continuum_solint', type=float, 
-        help='Continuum delay solution interval in minutes', 
-        metavar='SOLINT', default=10
-    )
-    ps.add_argument(
-        '--continuum_solwin', type=float, nargs=2, 
-        help='Continuum delay and rate solution windows in ns and mHz', 
-        metavar=('DELAY', 'RATE'), default=(120, 120)
-    )
-    ps.add_argument(
-        '--restfreq', type=float, nargs=2, 
-        help='Rest frequency of spectral line (FREQ_1 + FREQ_2)', 
-        metavar=('FREQ_1', 'FREQ_2'), default=(22.23E9, 5080000)
-    )
-    ps.add_argument(
-        '--phase_ref_chan', type=int, 
-        help='Phase reference channel in maser spectrum', 
-        metavar='CHANNEL', required=True
-    )
-    ps.add_argument(
-        '--maser_solint', type=float, 
-        help='Maser rate solution interval in minutes', 
-        metavar='SOLINT', default=1
-    )
-    ps.add_argument(
-        '--maser_solsub', type=float, 
-        help='Maser rate solution subinterval in minutes', 
-        metavar='SOLSUB', default=10
-    )
-    ps.add_argument(
-        '--maser_solwin', type=int, 
-        help='Maser rate solution window in mHz', 
-        metavar='RATE', default=800
-    )
-    args = ps.parse_args()
-    
-    # prepare AIPS
-    AIPS.userno = args.userno
-    if args.log is not None:
-        AIPS.log = open(args.log, 'w')
-    
+# pipeline stages
+def load(uvdata, file, disk, sources, clint):
     # load, sort, and index visibility data
     uvdata = fitld(
-        datain=args.file,
-        outdisk=args.disk,
-        sources=[args.target, *args.calibrator],
-        clint=args.clint,
+        datain=file,
+        outdisk=disk,
+        sources=sources,
+        clint=clint,
         params={
             'douvcomp': 1,
             'doconcat': -1,
@@ -125,34 +25,44 @@ if __name__ == '__main__':
             'wtthresh': 0.8,
         }
     )
-    sorted_uvdata = msort(indata=uvdata, sort='TB')
-    uvdata.zap()
-    uvdata = sorted_uvdata
-    indxr(indata=uvdata, solint=args.clint)
-    
-    # flag visibilities
-    if args.flag_file is not None:
-        with open(args.flag_file, 'r') as file:
-            flags = list(yaml.safe_load_all(file))
-        
-        for flag in flags:
-            uvflg(
-                indata=uvdata, 
-                outfgver=1, 
-                params={
-                    key: AIPSList(value)
-                    if type(value) == list
-                    else value
-                    for key, value in flag.items()
-                }
-            )
-        flagver = 1
-    else:
-        flagver = -1
+    uvdata = sort_tb(uvdata)
+    indxr(indata=uvdata, solint=clint)
+    return uvdata
+
+def flag(uvdata, flag_file):
+    # flag visibilities, compiling flags into a single FG table and 
+    # running UVFLG only for flags the compiler does not support
+    with open(flag_file, 'r') as file:
+        flags = [params for params in yaml.safe_load_all(file) if params]
     
+    rows, remaining = compile_flags(uvdata, flags)
+    write_flags(uvdata, rows, fgver=1)
+    print(
+        f'Compiled {len(flags) - len(remaining)} flags into {len(rows)} '
+        f'FG rows ({len(remaining)} left to UVFLG)'
+    )
+    for params in remaining:
+        uvflg(
+            indata=uvdata, 
+            outfgver=1, 
+            params={
+                key: AIPSList(value)
+                if type(value) == list
+                else value
+                for key, value in params.items()
+            }
+        )
+    return uvdata
+
+def calibrate_amplitudes(
+    uvdata, clint, flagver, antab_file, calibrator, snedt_mode, snedt_nsigma
+):
     # calibrate amplitudes
-    accor(indata=uvdata, solint=args.clint)
-    snedt(indata=uvdata, invers=1, params={'flagver': flagver})
+    accor(indata=uvdata, solint=clint)
+    edit_sn(
+        indata=uvdata, invers=1, 
+        mode=snedt_mode, nsigma=snedt_nsigma, params={'flagver': flagver}
+    )
     clcal(
         indata=uvdata,
         snver=2, invers=2, gainver=1, gainuse=2,
@@ -162,7 +72,7 @@ if __name__ == '__main__':
             'smotype': 'AMPL',
         }
     )
-    antab(indata=uvdata, calin=args.antab_file)
+    antab(indata=uvdata, calin=antab_file)
     apcal(indata=uvdata)
     clcal(
         indata=uvdata,
@@ -175,7 +85,7 @@ if __name__ == '__main__':
     )
     bpass(
         indata=uvdata,
-        calsour=args.calibrator,
+        calsour=calibrator,
         params={
             'docalib': 1,
             'gainuse': 3,
@@ -186,38 +96,42 @@ if __name__ == '__main__':
             'bpassprm|10': 1,
         }
     )
-    
+    return uvdata
+
+def calibrate_delays(uvdata, calibrator, flagver, refant, solint, solwin):
     # calibrate delay with continuum calibrator
     fring(
         indata=uvdata,
-        calsour=args.calibrator,
+        calsour=calibrator,
         params={
             'bchan': 1 + 50,
             'echan': 1024 - 50,
             'docalib': 1,
             'gainuse': 3,
             'flagver': flagver,
-            'refant': args.refant,
-            'solint': args.continuum_solint,
+            'refant': refant,
+            'solint': solint,
             'aparm|5': 1,
             'aparm|7': 3,
-            'dparm|2': args.continuum_solwin[0],
-            'dparm|3': args.continuum_solwin[1],
+            'dparm|2': solwin[0],
+            'dparm|3': solwin[1],
             'dparm|8': 1,
         }
     )
     clcal(
         indata=uvdata,
-        calsour=args.calibrator,
+        calsour=calibrator,
         snver=4, invers=4, gainver=3, gainuse=4,
         params={
             'opcode': 'CALI',
             'interpol': 'AMBG',
             'smotype': 'VLBI',
-            'refant': args.refant,
+            'refant': refant,
         }
     )
-    
+    return uvdata
+
+def calibrate_doppler(uvdata, target, restfreq):
     # calibrate doppler
     tabed(
         indata=uvdata,
@@ -232,18 +146,18 @@ if __name__ == '__main__':
     )
     setjy(
         indata=uvdata,
-        sources=args.target,
+        sources=target,
         params={
             'optype': 'VCAL',
-            'restfreq|1': args.restfreq[0],
-            'restfreq|2': args.restfreq[1],
+            'restfreq|1': restfreq[0],
+            'restfreq|2': restfreq[1],
             'veltyp': 'LSR',
             'veldef': 'RADIO',
         }
     )
     uvdata_cvel = cvel(
         indata=uvdata,
-        sources=args.target,
+        sources=target,
         params={
             'aparm|4': 1,
             'aparm|10': 1,
@@ -271,48 +185,53 @@ if __name__ == '__main__':
             'keystrng': 'KVN',
         }
     )
-    uvdata = uvdata_cvel
+    return uvdata_cvel
 
+def calibrate_rates(
+    uvdata, target, phase_ref_chan, flagver, refant, solint, solsub, solwin
+):
     # calibrate rate with phase reference channel
     fring(
         indata=uvdata,
-        calsour=[args.target],
+        calsour=[target],
         params={
-            'bchan': args.phase_ref_chan,
-            'echan': args.phase_ref_chan,
+            'bchan': phase_ref_chan,
+            'echan': phase_ref_chan,
             'docalib': 1,
             'gainuse': 4,
             'flagver': flagver,
             'doband': 2,
             'bpver': 1,
-            'refant': args.refant,
-            'solint': args.maser_solint,
-            'solsub': args.maser_solsub,
+            'refant': refant,
+            'solint': solint,
+            'solsub': solsub,
             'aparm|5': 1,
             'aparm|6': 1,
             'aparm|7': 3,
             'aparm|9': 1,
             'dparm|2': -1,
-            'dparm|3': args.maser_solwin
+            'dparm|3': solwin
         }
     )
     clcal(
         indata=uvdata,
-        sources=args.target,
-        calsour=args.target,
+        sources=target,
+        calsour=target,
         snver=5, invers=5, gainver=4, gainuse=5,
         params={
             'opcode': 'CALI',
             'interpol': 'AMBG',
             'smotype': 'VLBI',
-            'refant': args.refant,
+            'refant': refant,
         }
     )
-    
+    return uvdata
+
+def finalize(uvdata, target, flagver):
     # finalize reduction
-    uvdata_final = split(
+    return split(
         indata=uvdata,
-        sources=args.target,
+        sources=target,
         mode='both',
         params={
             'flagver': flagver,
@@ -322,6 +241,211 @@ if __name__ == '__main__':
             'bpver': 1
         }
     )
+
+# ----- #
+
+if __name__ == '__main__':
+    """
+    This script is the AIPS calibration pipeline for KaVA Star Formation
+    LP data, primarily for 22 GHz water masers.
+    """
+    # parse arguments
+    ps = ArgumentParser(
+        prog='KaVA Pipeline',
+        description='''AIPS calibration pipeline for KaVA Star Formation
+            LP data.''',
+        fromfile_prefix_chars='@'
+    )
+    ps.add_argument(
+        'userno', type=int, 
+        help='AIPS user number', 
+        metavar='USER_NO'
+    )
+    ps.add_argument(
+        '-f', '--file', type=str, 
+        help='Visibility file name to load', 
+        metavar='FILE', required=True
+    )
+    ps.add_argument(
+        '-t', '--target', type=str, 
+        help='Target maser source name', 
+        metavar='SOURCE', required=True
+    )
+    ps.add_argument(
+        '-c', '--calibrator', type=str, nargs='+', 
+        help='Continuum calibrator source name(s)', 
+        metavar=('CALIBRATOR_1', 'CALIBRATOR_2'), required=True
+    )
+    ps.add_argument(
+        '-d', '--disk', type=int, 
+        help='AIPS disk number to load into', 
+        metavar='DISK', default=1
+    )
+    ps.add_argument(
+        '-i', '--clint', type=float, 
+        help='Integration time in minutes', 
+        metavar='CLINT', default=0.0273
+    )
+    ps.add_argument(
+        '--log', type=str, 
+        help='Log file name', 
+        metavar='LOG', default=None
+    )
+    ps.add_argument(
+        '--flag_file', type=str, 
+        help='Flag table file name', 
+        metavar='FLAG_FILE', default=None
+    )
+    ps.add_argument(
+        '--antab_file', type=str, 
+        help='ANTAB file name', 
+        metavar='ANTAB_FILE', required=True
+    )
+    ps.add_argument(
+        '--refant', type=int, 
+        help='Reference antenna for phase, delay, and rate calibrations', 
+        metavar='REFANT', required=True
+    )
+    ps.add_argument(
+        '--continuum_solint', type=float, 
+        help='Continuum delay solution interval in minutes', 
+        metavar='SOLINT', default=10
+    )
+    ps.add_argument(
+        '--continuum_solwin', type=float, nargs=2, 
+        help='Continuum delay and rate solution windows in ns and mHz', 
+        metavar=('DELAY', 'RATE'), default=(120, 120)
+    )
+    ps.add_argument(
+        '--restfreq', type=float, nargs=2, 
+        help='Rest frequency of spectral line (FREQ_1 + FREQ_2)', 
+        metavar=('FREQ_1', 'FREQ_2'), default=(22.23E9, 5080000)
+    )
+    ps.add_argument(
+        '--phase_ref_chan', type=int, 
+        help='Phase reference channel in maser spectrum', 
+        metavar='CHANNEL', required=True
+    )
+    ps.add_argument(
+        '--maser_solint', type=float, 
+        help='Maser rate solution interval in minutes', 
+        metavar='SOLINT', default=1
+    )
+    ps.add_argument(
+        '--maser_solsub', type=float, 
+        help='Maser rate solution subinterval in minutes', 
+        metavar='SOLSUB', default=10
+    )
+    ps.add_argument(
+        '--maser_solwin', type=int, 
+        help='Maser rate solution window in mHz', 
+        metavar='RATE', default=800
+    )
+    ps.add_argument(
+        '--snedt', type=str, choices=['interactive', 'auto'], 
+        help='SN table editing mode (SNEDT or automatic outlier flagging)', 
+        metavar='MODE', default='interactive'
+    )
+    ps.add_argument(
+        '--snedt_nsigma', type=float, 
+        help='Outlier threshold in robust sigma for automatic SN editing', 
+        metavar='NSIGMA', default=5.0
+    )
+    ps.add_argument(
+        '--state', type=str, 
+        help='Pipeline state file for resuming from completed stages', 
+        metavar='STATE', default='pipeline_state.json'
+    )
+    ps.add_argument(
+        '--restart', action='store_true', 
+        help='Ignore the pipeline state file and run every stage'
+    )
+    ps.add_argument(
+        '--plan', action='store_true', 
+        help='Print the predicted runtime and disk usage, and exit'
+    )
+    ps.add_argument(
+        '--force', action='store_true', 
+        help='Run even if the projected disk usage exceeds free space'
+    )
+    ps.add_argument(
+        '--cost_model', type=str, 
+        help='Cost model file for runtime predictions (see estimate.py)', 
+        metavar='COST_MODEL', default=None
+    )
+    args = ps.parse_args()
+    
+    # plan runtime and disk usage (unless resuming)
+    resuming = os.path.exists(args.state) and not args.restart
+    if args.plan or not (args.force or resuming):
+        plan = plan_pipeline(
+            fits_dimensions(args.file), load_cost_model(args.cost_model)
+        )
+        print_plan(plan, 'stage')
+        check_plan(
+            ps, {args.disk: max(stage['peak'] for stage in plan)}, 
+            check=not args.force
+        )
+        if args.plan:
+            ps.exit()
+    
+    # prepare AIPS and pipeline state
+    AIPS.userno = args.userno
+    if args.log is not None:
+        AIPS.log = open(args.log, 'a' if not args.restart else 'w')
+    checkpoint = Checkpoint(args.state, restart=args.restart)
+    flagver = 1 if args.flag_file is not None else -1
+    
+    # run pipeline stages
+    uvdata = checkpoint.run(
+        'load', load, None, 
+        file=args.file, 
+        disk=args.disk, 
+        sources=[args.target, *args.calibrator], 
+        clint=args.clint
+    )
+    if args.flag_file is not None:
+        uvdata = checkpoint.run(
+            'flag', flag, uvdata, 
+            flag_file=args.flag_file
+        )
+    uvdata = checkpoint.run(
+        'calibrate_amplitudes', calibrate_amplitudes, uvdata, 
+        clint=args.clint, 
+        flagver=flagver, 
+        antab_file=args.antab_file, 
+        calibrator=args.calibrator, 
+        snedt_mode=args.snedt, 
+        snedt_nsigma=args.snedt_nsigma
+    )
+    uvdata = checkpoint.run(
+        'calibrate_delays', calibrate_delays, uvdata, 
+        calibrator=args.calibrator, 
+        flagver=flagver, 
+        refant=args.refant, 
+        solint=args.continuum_solint, 
+        solwin=args.continuum_solwin
+    )
+    uvdata = checkpoint.run(
+        'calibrate_doppler', calibrate_doppler, uvdata, 
+        target=args.target, 
+        restfreq=args.restfreq
+    )
+    uvdata = checkpoint.run(
+        'calibrate_rates', calibrate_rates, uvdata, 
+        target=args.target, 
+        phase_ref_chan=args.phase_ref_chan, 
+        flagver=flagver, 
+        refant=args.refant, 
+        solint=args.maser_solint, 
+        solsub=args.maser_solsub, 
+        solwin=args.maser_solwin
+    )
+    uvdata_final = checkpoint.run(
+        'finalize', finalize, uvdata, 
+        target=args.target, 
+        flagver=flagver
+    )
     
     # close log
     if args.log is not None:
@@ -2,11 +2,11 @@ from argparse import ArgumentParser
 
 import numpy as np
 
-from AIPS import AIPS
-from AIPSData import AIPSUVData
+from backend import AIPS, AIPSUVData
 
 from tasks import imagr
-from wizardry import grab_im
+from wizardry import grab_im, iter_uv, uv_frequencies, thermal_noise, \
+    grid_uv, dirty_image, image_rms
 
 # ----- #
 
@@ -45,7 +45,36 @@ if __name__ == '__main__':
         help='Image size in pixels', 
         metavar='IMSIZE', default=8192
     )
+    ps.add_argument(
+        '-s', '--source', type=str, 
+        help='Source name (for multi-source data)', 
+        metavar='SOURCE', default=None
+    )
+    ps.add_argument(
+        '--method', type=str, choices=['imagr', 'grid', 'thermal'], 
+        help='''Noise estimation method (IMAGR, gridding and FFT in 
+            Python for a quick natural-weighted dirty image, or the 
+            expected thermal noise from the visibility weights)''', 
+        metavar='METHOD', default='imagr'
+    )
+    ps.add_argument(
+        '--weighting', type=str, choices=['natural', 'uniform'], 
+        help='Imaging weights for the thermal noise method', 
+        metavar='WEIGHTING', default='natural'
+    )
+    ps.add_argument(
+        '--region', type=int, nargs=4, 
+        help='Image region to calculate the RMS in', 
+        metavar=('BLC_X', 'BLC_Y', 'TRC_X', 'TRC_Y'), default=None
+    )
+    ps.add_argument(
+        '--statistic', type=str, choices=['std', 'mad', 'clipped'], 
+        help='''Image noise statistic (standard deviation, MAD-based 
+            sigma, or sigma-clipped RMS)''', 
+        metavar='STATISTIC', default='std'
+    )
     args = ps.parse_args()
+    region = (args.region[:2], args.region[2:]) if args.region else ()
     args.catalogue[2] = int(args.catalogue[2])
     args.catalogue[3] = int(args.catalogue[3])
     
@@ -58,19 +87,47 @@ if __name__ == '__main__':
         args.catalogue[3], args.catalogue[2]
     )
     
-    # perform imaging
-    images = imagr(
-        indata=uvdata, 
-        cellsize=args.cellsize, 
-        imsize=args.imsize, 
-        params={
-            'bchan': args.channel,
-            'echan': args.channel,
-            'do3dimag': 1,
-            'dotv': -1
-        }
-    )
-    rms = np.std(grab_im(images[1]).flatten())
-    for image in images:
-        image.zap()
+    # perform imaging (or predict noise)
+    if args.method == 'thermal':
+        IFs = list(range(1, len(uv_frequencies(uvdata)) + 1))
+        noise = thermal_noise(
+            uvdata, args.source, weighting=args.weighting, 
+            cellsize=args.cellsize, imsize=args.imsize, IF=IFs
+        )[:, args.channel - 1]
+        rms = 1 / np.sqrt(np.nansum(1 / np.square(noise)))
+    elif args.method == 'grid':
+        header = uvdata.header
+        reffreq = header['crval'][header['ctype'].index('FREQ')]
+        freqs = uv_frequencies(uvdata)[:, args.channel - 1]
+        IFs = list(range(1, len(freqs) + 1))
+        grid, weight = None, 0.0
+        for chunk in iter_uv(uvdata, args.source, IF=IFs, compact=True):
+            grid, chunk_weight = grid_uv(
+                chunk, args.channel, args.cellsize, args.imsize, 
+                scale=freqs / reffreq, grid=grid
+            )
+            weight += chunk_weight
+        if not weight > 0:
+            ps.error('no unflagged visibilities selected for gridding')
+        rms = image_rms(
+            dirty_image(grid, weight), *region, statistic=args.statistic
+        )
+    else:
+        images = imagr(
+            indata=uvdata, 
+            srcname=args.source, 
+            cellsize=args.cellsize, 
+            imsize=args.imsize, 
+            params={
+                'bchan': args.channel,
+                'echan': args.channel,
+                'do3dimag': 1,
+                'dotv': -1
+            }
+        )
+        rms = image_rms(
+            grab_im(images[1]), *region, statistic=args.statistic
+        )
+        for image in images:
+            image.zap()
     print(f'RMS: {rms} Jy/beam')
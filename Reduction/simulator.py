@@ -0,0 +1,1051 @@
+from glob import glob
+import json
+import os
+import re
+import shutil
+import time
+from types import SimpleNamespace
+
+from astropy.io import fits
+import numpy as np
+
+# simulator location, number of disks, and visibilities per buffer
+ROOT = os.path.expanduser(os.environ.get('RCW142_LOCAL_ROOT', '~/.rcw142'))
+NDISKS = int(os.environ.get('RCW142_LOCAL_NDISKS', 4))
+BUFFER_ROWS = 4096
+
+# array adverbs (with their lengths) of the tasks used by the scripts
+ARRAY_ADVERBS = {
+    'aparm': 10, 'bparm': 10, 'cparm': 10, 'dparm': 10, 'antennas': 50,
+    'baseline': 50, 'bpassprm': 10, 'calsour': 30, 'cellsize': 2,
+    'imsize': 2, 'rashift': 64, 'decshift': 64, 'restfreq': 2,
+    'sources': 30, 'timerang': 8, 'smooth': 10,
+}
+
+# Wizardry keys of AIPS table columns that are not simply lower case
+# with underscores
+COLUMN_KEYS = {'ID. NO.': 'source_id', 'NOSTA': 'nosta'}
+
+# descriptor keys that are not part of the header
+DESC_KEYS = {
+    'nrparm', 'lrec', 'ilocu', 'ilocv', 'ilocw', 'iloct', 'ilocb',
+    'iloca1', 'iloca2', 'ilocsu', 'ilocit', 'isort', 'jlocf', 'jlocs',
+    'jlocif', 'VelDef', 'VelReference', 'altCrpix', 'altRef',
+}
+
+# simulator AIPS session
+class _Disk:
+    # local directory standing in for an AIPS disk
+    def __init__(self, disk):
+        self.disk = disk
+        self.url = None
+        self.dirname = os.path.join(ROOT, f'DISK{disk:02d}')
+
+class AIPS:
+    """
+    Local stand-in for the ParselTongue AIPS session, with disks as
+    directories under RCW142_LOCAL_ROOT (default ~/.rcw142).
+    """
+    userno = 0
+    log = None
+    disks = [None] + [_Disk(disk) for disk in range(1, NDISKS + 1)]
+
+class AIPSList(list):
+    # 1-based list, as for AIPS array adverbs
+    def __init__(self, values):
+        super().__init__([None] + list(values))
+
+class AIPSTV:
+    # no TV in the simulator
+    def start(self):
+        pass
+
+    def kill(self):
+        pass
+
+# simulator catalogue
+class CatalogueEntry(dict):
+    # catalogue entry with attribute access, as in AIPSCat
+    def __getattr__(self, key):
+        try:
+            return self[key]
+        except KeyError:
+            raise AttributeError(key)
+
+def AIPSCat(disk):
+    """
+    Lists the catalogue of the current user on a simulator disk.
+    Parameters:
+        disk (int): The disk number.
+    Returns:
+        dict: The catalogue entries, keyed by disk number.
+    """
+    return {
+        disk: [
+            CatalogueEntry(entry) for entry in _read_catalogue(disk)
+            if entry['userno'] == AIPS.userno
+        ]
+    }
+
+def _read_catalogue(disk):
+    filename = os.path.join(AIPS.disks[disk].dirname, 'catalogue.json')
+    if not os.path.exists(filename):
+        return []
+    with open(filename, 'r') as file:
+        return json.load(file)
+
+def _write_catalogue(disk, catalogue):
+    # replace the catalogue atomically
+    filename = os.path.join(AIPS.disks[disk].dirname, 'catalogue.json')
+    with open(f'{filename}.tmp', 'w') as file:
+        json.dump(catalogue, file, indent=1)
+    os.replace(f'{filename}.tmp', filename)
+
+def create_data(disk, name, klass, data_type, desc, array, tables={}):
+    """
+    Creates a new simulator catalogue entry with the next free sequence
+    number.
+    Parameters:
+        disk (int): The disk number.
+        name (str): The catalogue name.
+        klass (str): The catalogue class.
+        data_type (str): The data type ('UV' or 'MA').
+        desc (dict): The descriptor (header and, for UV data, random
+            parameter locations).
+        array (ndarray): The visibility records (nvis, lrec) or pixels.
+        tables (dict, optional): Tables as {(type, version): table},
+            with tables as dicts of keys and rows.
+    Returns:
+        AIPSUVData or AIPSImage: The new data object.
+    """
+    name, klass = name[:12].upper(), klass[:6].upper()
+    os.makedirs(AIPS.disks[disk].dirname, exist_ok=True)
+    catalogue = _read_catalogue(disk)
+    seq = 1 + max([
+        entry['seq'] for entry in catalogue
+        if entry['userno'] == AIPS.userno and entry['name'] == name
+        and entry['klass'] == klass and entry['type'] == data_type
+    ], default=0)
+    cno = 1 + max([entry['cno'] for entry in catalogue], default=0)
+    path = os.path.join(AIPS.disks[disk].dirname, f'{AIPS.userno}_{cno:03d}')
+    os.makedirs(os.path.join(path, 'tables'))
+    np.save(os.path.join(path, 'data.npy'), array)
+    with open(os.path.join(path, 'desc.json'), 'w') as file:
+        json.dump(desc, file, indent=1, default=_json_default)
+    for (table_type, version), table in tables.items():
+        _write_table(path, table_type, version, table)
+    catalogue.append({
+        'userno': AIPS.userno, 'cno': cno, 'name': name, 'klass': klass,
+        'seq': seq, 'type': data_type,
+        'date': time.strftime('%d-%b-%y'), 'time': time.strftime('%H:%M:%S'),
+    })
+    _write_catalogue(disk, catalogue)
+    data_class = AIPSUVData if data_type == 'UV' else AIPSImage
+    return data_class(name, klass, disk, seq)
+
+# simulator data
+class _AIPSData:
+    # catalogue entry on a simulator disk, with the ParselTongue AIPSData 
+    # interface (catalogue, header, and table listing only)
+    data_type = None
+
+    def __init__(self, name, klass, disk, seq):
+        self.name = name
+        self.klass = klass
+        self.disk = disk
+        self.seq = seq
+
+    def exists(self):
+        return self._entry() is not None
+
+    def zap(self):
+        catalogue = _read_catalogue(self.disk)
+        entry = self._entry()
+        shutil.rmtree(self._path)
+        _write_catalogue(
+            self.disk, [item for item in catalogue if item != entry]
+        )
+
+    @property
+    def header(self):
+        return _Header({
+            ('sortord' if key == 'isort' else key): value
+            for key, value in self._desc.items()
+            if key not in DESC_KEYS or key == 'isort'
+        })
+
+    @property
+    def tables(self):
+        return sorted(
+            [int(version), f'AIPS {table_type}']
+            for table_type, version in (
+                os.path.basename(filename)[:-5].split('_')
+                for filename in glob(os.path.join(self._path, 'tables', '*'))
+            )
+        )
+
+    def table_highver(self, table_type):
+        return max([
+            version for version, name in self.tables
+            if name == f'AIPS {table_type}'
+        ], default=0)
+
+    def zap_table(self, table_type, version):
+        table_type = table_type.replace('AIPS ', '')
+        for version_, name in self.tables:
+            if name == f'AIPS {table_type}' and version in (-1, version_):
+                os.remove(os.path.join(
+                    self._path, 'tables', f'{table_type}_{version_}.json'
+                ))
+
+    def _entry(self):
+        for entry in AIPSCat(self.disk)[self.disk]:
+            if (
+                entry['name'] == self.name and entry['klass'] == self.klass
+                and entry['seq'] == self.seq
+                and entry['type'] == self.data_type
+            ):
+                return entry
+        return None
+
+    @property
+    def _path(self):
+        return os.path.join(
+            AIPS.disks[self.disk].dirname,
+            f'{AIPS.userno}_{self._entry()["cno"]:03d}'
+        )
+
+    @property
+    def _array(self):
+        return np.load(os.path.join(self._path, 'data.npy'), mmap_mode='r')
+
+    @property
+    def _desc(self):
+        # descriptor as stored on disk
+        with open(os.path.join(self._path, 'desc.json'), 'r') as file:
+            return json.load(file)
+
+class AIPSUVData(_AIPSData):
+    """
+    Local stand-in for the ParselTongue AIPSUVData, with visibility 
+    records stored as a (nvis, lrec) float32 .npy file. As in 
+    ParselTongue, the visibilities themselves (and the length) are 
+    only available through the Wizardry AIPSUVData.
+    """
+    data_type = 'UV'
+
+    @property
+    def stokes(self):
+        desc = self._desc
+        i = desc['ctype'].index('STOKES')
+        names = {
+            1: 'I', 2: 'Q', 3: 'U', 4: 'V', -1: 'RR', -2: 'LL',
+            -3: 'RL', -4: 'LR', -5: 'XX', -6: 'YY', -7: 'XY', -8: 'YX'
+        }
+        return [
+            names[int(desc['crval'][i] + (j + 1 - desc['crpix'][i])
+            * desc['cdelt'][i])]
+            for j in range(desc['naxis'][i])
+        ]
+
+class AIPSImage(_AIPSData):
+    """
+    Local stand-in for the ParselTongue AIPSImage, with pixels stored 
+    as a .npy file in (reversed) axis order.
+    """
+    data_type = 'MA'
+
+class _Header(dict):
+    # header dictionary, as generated from the descriptor
+    def _generate_dict(self):
+        return dict(self)
+
+# simulator Wizardry
+class _WizardryData(_AIPSData):
+    # catalogue entry with the Wizardry AIPSData interface, reproducing 
+    # the Wizardry internals listed at the top of wizardry.py
+    def __init__(self, name, klass, disk, seq):
+        super().__init__(name, klass, disk, seq)
+        self._squeeze = False
+        if self.exists():
+            self._data = SimpleNamespace(
+                Desc=SimpleNamespace(Dict=super()._desc)
+            )
+
+    def update(self):
+        with open(os.path.join(self._path, 'desc.json'), 'w') as file:
+            json.dump(
+                self._data.Desc.Dict, file, indent=1, default=_json_default
+            )
+
+    def table(self, table_type, version):
+        version = version or self.table_highver(table_type)
+        return _Table(
+            self._path, table_type, version, 
+            **_read_table(self, table_type, version)
+        )
+
+    def attach_table(self, table_type, version, **kwargs):
+        return _Table(self._path, table_type, version, [], [])
+
+    @property
+    def _desc(self):
+        # descriptor as held (and edited) in memory
+        return self._data.Desc.Dict
+
+class WizardryUVData(_WizardryData):
+    """
+    Local stand-in for the Wizardry AIPSUVData, iterating over the
+    visibility records in buffers as Wizardry does.
+    """
+    data_type = 'UV'
+    stokes = AIPSUVData.stokes
+
+    def __len__(self):
+        return len(self._array)
+
+    def __iter__(self):
+        return _UVIterator(self)
+
+class WizardryImage(_WizardryData):
+    """
+    Local stand-in for the Wizardry AIPSImage, with the pixels as a
+    NumPy array.
+    """
+    data_type = 'MA'
+
+    def squeeze(self):
+        self._squeeze = True
+
+    @property
+    def pixels(self):
+        pixels = np.array(self._array)
+        return pixels.squeeze() if self._squeeze else pixels
+
+class _UVIterator:
+    # buffered visibility iterator with the Wizardry internals (_buffer,
+    # _count, _index) used by wizardry._uv_blocks
+    def __init__(self, uvdata):
+        self._records = uvdata._array
+        self._desc = uvdata._desc
+        self._first = -BUFFER_ROWS
+        self._count = 0
+        self._index = -1
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        self._index += 1
+        if self._index >= self._count:
+            self._first += max(self._count, BUFFER_ROWS * (self._first < 0))
+            self._buffer = np.array(
+                self._records[self._first:self._first + BUFFER_ROWS]
+            ).ravel()
+            self._count = len(self._buffer) // self._desc['lrec']
+            self._index = 0
+            if self._count == 0:
+                raise StopIteration
+        return self
+
+    def _rparm(self, key):
+        start = self._index * self._desc['lrec']
+        return self._buffer[start + self._desc[key]]
+
+    @property
+    def time(self):
+        return float(self._rparm('iloct'))
+
+    @property
+    def baseline(self):
+        packed = int(self._rparm('ilocb'))
+        return [packed // 256, packed % 256]
+
+    @property
+    def source(self):
+        return int(self._rparm('ilocsu'))
+
+    @property
+    def inttim(self):
+        return float(self._rparm('ilocit'))
+
+    @property
+    def uvw(self):
+        return [
+            float(self._rparm(key)) for key in ('ilocu', 'ilocv', 'ilocw')
+        ]
+
+    @property
+    def visibility(self):
+        start = self._index * self._desc['lrec']
+        return self._buffer[
+            start + self._desc['nrparm']:start + self._desc['lrec']
+        ]
+
+class _Table:
+    # AIPS table held in memory and written back on close, with its 
+    # rows as dicts of column keys and values
+    def __init__(self, path, table_type, version, keys, rows):
+        self._path = path
+        self.name = f'AIPS {table_type}'
+        self.version = version
+        self._keys = list(keys)
+        self._rows = rows
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __iter__(self):
+        for i in range(len(self._rows)):
+            yield _TableRow(self, self._rows[i], i)
+
+    def append(self, row):
+        values = row._key_values()
+        self._keys += [key for key in values if key not in self._keys]
+        self._rows.append(values)
+
+    def close(self):
+        _write_table(
+            self._path, self.name[5:], self.version,
+            {'keys': self._keys, 'rows': self._rows}
+        )
+
+class _TableRow:
+    # table row with attribute access, holding its values as Wizardry 
+    # does: an Obit row (_row) of value lists keyed by column name, and 
+    # the column name of each key (_fields); written back with update()
+    def __init__(self, table, values, index=None):
+        self.__dict__['_table'] = table
+        self.__dict__['_fields'] = {key: _column_name(key) for key in values}
+        self.__dict__['_row'] = {
+            self._fields[key]: list(value) if isinstance(value, list) 
+            else [value]
+            for key, value in values.items()
+        }
+        self.__dict__['_index'] = index
+
+    def __getattr__(self, key):
+        try:
+            value = self._row[self._fields[key]]
+        except KeyError:
+            raise AttributeError(key)
+        return value[0] if len(value) == 1 else value
+
+    def __setattr__(self, key, value):
+        # (unlike Wizardry, new keys add columns, as attached tables 
+        # start without any)
+        self._fields.setdefault(key, _column_name(key))
+        self._row[self._fields[key]] = (
+            list(value) if isinstance(value, list) else [value]
+        )
+
+    def update(self):
+        self._table._rows[self._index] = self._key_values()
+
+    def _key_values(self):
+        # values by column key, as stored by the simulator
+        return {
+            key: value[0] if len(value) == 1 else value
+            for key, value in (
+                (key, self._row[column]) 
+                for key, column in self._fields.items()
+            )
+        }
+
+def _column_name(key):
+    # AIPS column name of a Wizardry key
+    names = {key: name for name, key in COLUMN_KEYS.items()}
+    return names.get(key, key.upper().replace('_', ' '))
+
+def AIPSTableRow(table):
+    """
+    Creates a blank row for appending to a simulator table.
+    Parameters:
+        table: The table to create the row for.
+    Returns:
+        A row with zeroed values for the existing table columns.
+    """
+    return _TableRow(table, {key: 0 for key in table._keys})
+
+def _write_table(path, table_type, version, table):
+    filename = os.path.join(path, 'tables', f'{table_type}_{version}.json')
+    with open(filename, 'w') as file:
+        json.dump(table, file, default=_json_default)
+
+def _json_default(value):
+    # JSON representation of NumPy values
+    return value.tolist() if hasattr(value, 'tolist') else str(value)
+
+# simulator tasks
+class AIPSTask:
+    """
+    Local stand-in for AIPSTask. Adverbs are set as attributes (with
+    array adverbs as 1-based lists), and go() runs the task as a NumPy
+    operation on the simulator catalogue, or as a no-op for tasks that
+    only display or edit calibration. Every run is recorded in
+    tasks.jsonl under the simulator root.
+    Parameters:
+        name (str): The AIPS task name.
+    """
+    def __init__(self, name):
+        self.__dict__['_name'] = name.upper()
+        self.__dict__['_adverbs'] = {}
+
+    def __getattr__(self, key):
+        adverbs = self.__dict__['_adverbs']
+        if key not in adverbs:
+            if key in ARRAY_ADVERBS:
+                adverbs[key] = [None] + [0] * ARRAY_ADVERBS[key]
+            elif key.startswith('_'):
+                raise AttributeError(key)
+            elif key == 'outdisk':
+                # AIPS picks a disk for outdisk 0, here the input disk
+                return adverbs.get('indisk', 0)
+            else:
+                return 0
+        return adverbs[key]
+
+    def __setattr__(self, key, value):
+        if key in ('indata', 'in2data', 'outdata'):
+            prefix = key[:-4]
+            for suffix, attr in [
+                ('name', 'name'), ('class', 'klass'),
+                ('disk', 'disk'), ('seq', 'seq')
+            ]:
+                self._adverbs[f'{prefix}{suffix}'] = getattr(value, attr)
+        self._adverbs[key] = value
+
+    def go(self):
+        start = time.perf_counter()
+        TASKS.get(self._name, _no_op)(self)
+        elapsed = time.perf_counter() - start
+        record = {
+            'task': self._name, 'userno': AIPS.userno, 'elapsed': elapsed,
+            'adverbs': {
+                key: value for key, value in self._adverbs.items()
+                if isinstance(value, (int, float, str, list))
+            },
+        }
+        os.makedirs(ROOT, exist_ok=True)
+        with open(os.path.join(ROOT, 'tasks.jsonl'), 'a') as file:
+            file.write(json.dumps(record, default=_json_default) + '\n')
+        if AIPS.log is not None:
+            AIPS.log.write(f'{self._name}: simulated in {elapsed:.3f} s\n')
+
+def _no_op(task):
+    pass
+
+def _fitld(task):
+    # load random groups UV FITS (with AIPS tables as extensions)
+    with fits.open(task.datain) as hdul:
+        if not isinstance(hdul[0], fits.GroupsHDU):
+            raise NotImplementedError(
+                'the simulator only loads random groups UV FITS files'
+            )
+        header, data = hdul[0].header, hdul[0].data
+        tables = {
+            (hdu.name[5:], hdu.ver): _fits_table(hdu) for hdu in hdul[1:]
+            if hdu.name.startswith('AIPS ')
+        }
+        ptypes = [p.strip() for p in data.parnames]
+
+        # random parameters, with dates as days from the first day
+        columns = {}
+        for key, prefix in [
+            ('ilocu', 'UU'), ('ilocv', 'VV'), ('ilocw', 'WW'),
+            ('ilocb', 'BASELINE'), ('ilocsu', 'SOURCE'), ('ilocit', 'INTTIM')
+        ]:
+            match = [p for p in set(ptypes) if p.startswith(prefix)]
+            if match:
+                columns[key] = np.asarray(data.par(match[0]), dtype=float)
+        date = np.asarray(data.par('DATE'), dtype=float)
+        columns['iloct'] = date - np.floor(date.min() - 0.5) - 0.5
+        vis = np.asarray(data.data, dtype=np.float32).reshape(len(data), -1)
+
+    # scale uvw from seconds to wavelengths at the reference frequency
+    naxis = [header[f'NAXIS{i}'] for i in range(2, header['NAXIS'] + 1)]
+    ctype = [header[f'CTYPE{i}'].strip() for i in range(2, len(naxis) + 2)]
+    crval = [header[f'CRVAL{i}'] for i in range(2, len(naxis) + 2)]
+    for key in ('ilocu', 'ilocv', 'ilocw'):
+        columns[key] = columns[key] * crval[ctype.index('FREQ')]
+
+    # select sources
+    keep = np.ones(len(vis), dtype=bool)
+    su = tables.get(('SU', 1))
+    sources = [s for s in task.sources[1:] if s] if task.sources else []
+    if sources and su is not None and 'ilocsu' in columns:
+        ids = [
+            row['source_id'] for row in su['rows']
+            if row['source'].strip() in sources
+        ]
+        keep = np.isin(columns['ilocsu'], ids)
+
+    keys = [key for key in (
+        'ilocu', 'ilocv', 'ilocw', 'iloct', 'ilocb', 'ilocsu', 'ilocit'
+    ) if key in columns]
+    rparm = np.column_stack([columns[key][keep] for key in keys])
+    desc = _uv_desc(header, naxis, ctype, crval, keys)
+    desc['isort'] = '  '
+    create_data(
+        task.outdisk or 1,
+        task.outname or str(header.get('OBJECT', 'MULTI')).strip(),
+        task.outclass or 'UVDATA', 'UV', desc,
+        np.hstack([rparm, vis[keep]]).astype(np.float32), tables
+    )
+
+def _msort(task):
+    # copy visibilities in time-baseline order
+    uvdata = task.indata
+    records = np.array(uvdata._array)
+    desc = dict(uvdata._desc)
+    order = np.lexsort((
+        records[:, desc['ilocb']], records[:, desc['iloct']]
+    ))
+    desc['isort'] = 'TB'
+    _copy_uv(task, uvdata, 'MSORT', desc, records[order])
+
+def _cvel(task):
+    # copy visibilities (doppler shifts are not simulated)
+    uvdata = task.indata
+    records = np.array(uvdata._array)
+    _copy_uv(
+        task, uvdata, 'CVEL', dict(uvdata._desc),
+        records[_source_mask(uvdata, records, task.sources)]
+    )
+
+def _split(task):
+    # split visibilities into single-source data sets
+    uvdata = task.indata
+    records = np.array(uvdata._array)
+    desc = dict(uvdata._desc)
+    if desc['ilocsu'] < 0:
+        _copy_uv(task, uvdata, task._name, desc, records)
+        return
+    names = [s for s in task.sources[1:] if s] or [
+        row['source'].strip() for row in _read_table(uvdata, 'SU', 1)['rows']
+    ]
+
+    # drop the source random parameter and the SU table
+    keys = [key for key in desc if key.startswith('iloc') and desc[key] >= 0]
+    columns = [i for i in range(desc['lrec']) if i != desc['ilocsu']]
+    split_desc = {**desc, 'nrparm': desc['nrparm'] - 1, 'lrec': len(columns)}
+    for key in keys:
+        split_desc[key] = (
+            -1 if key == 'ilocsu'
+            else desc[key] - (desc[key] > desc['ilocsu'])
+        )
+    tables = {
+        (name[5:], version): _read_table(uvdata, name[5:], version)
+        for version, name in uvdata.tables if name not in ('AIPS SU',)
+    }
+    # set the pointing position of each source
+    positions = {
+        row['source'].strip(): (row['raepo'], row['decepo'])
+        for row in _read_table(uvdata, 'SU', 1)['rows']
+    }
+    for name in names:
+        mask = _source_mask(uvdata, records, [None, name])
+        crval = list(split_desc['crval'])
+        for axis, value in zip(('RA', 'DEC'), positions.get(name, (0, 0))):
+            if axis in split_desc['ctype']:
+                crval[split_desc['ctype'].index(axis)] = value
+        create_data(
+            task.outdisk or uvdata.disk, task.outname or name,
+            task.outclass or task._name, 'UV', {**split_desc, 'crval': crval},
+            records[mask][:, columns], tables
+        )
+
+def _imagr(task):
+    # dirty image and beam from gridded visibilities, with the image
+    # peak and a small negative component as clean components
+    uvdata = task.indata
+    desc = uvdata._desc
+    records = np.asarray(uvdata._array)
+    if desc['ilocsu'] >= 0 and task.srcname:
+        records = records[_source_mask(uvdata, records, [None, task.srcname])]
+    nif, nchan, nstokes = (
+        desc['naxis'][desc['ctype'].index(axis)]
+        for axis in ('IF', 'FREQ', 'STOKES')
+    )
+    vis = records[:, desc['nrparm']:].reshape(-1, nif, nchan, nstokes, 3)
+
+    # channel planes and uv grid
+    bchan = int(task.bchan) or 1
+    echan = int(task.echan) or nchan
+    nchav = int(task.nchav) or 1
+    planes = [
+        range(chan - 1, chan - 1 + nchav)
+        for chan in range(bchan, echan + 1, int(task.chinc) or nchav)
+        if chan - 1 + nchav <= echan
+    ]
+    imsize = int(task.imsize[1]) or 256
+    cellsize = np.radians(float(task.cellsize[1]) / 3600)
+    ifreq = desc['ctype'].index('FREQ')
+    freq = desc['crval'][ifreq] + (
+        np.arange(nchan) + 1 - desc['crpix'][ifreq]
+    ) * desc['cdelt'][ifreq]
+    scale = freq / desc['crval'][ifreq] * imsize * cellsize
+
+    images, beams, components = [], [], {}
+    for i, chans in enumerate(planes, start=1):
+        grid = np.zeros((imsize, imsize), dtype=complex)
+        weights = np.zeros((imsize, imsize))
+        for chan in chans:
+            u = np.rint(records[:, desc['ilocu']] * scale[chan]).astype(int)
+            v = np.rint(records[:, desc['ilocv']] * scale[chan]).astype(int)
+            data = vis[:, :, chan]
+            weig = np.clip(data[..., 2], 0, None)
+            value = np.sum((data[..., 0] + 1j * data[..., 1]) * weig, (1, 2))
+            weight = np.sum(weig, axis=(1, 2))
+            for sign in (1, -1):
+                index = (sign * v % imsize, sign * u % imsize)
+                np.add.at(grid, index, value if sign > 0 else value.conj())
+                np.add.at(weights, index, weight)
+        norm = max(weights.sum(), 1e-30)
+        image = np.fft.fftshift(np.fft.ifft2(grid).real) * imsize**2 / norm
+        beam = np.fft.fftshift(np.fft.ifft2(weights).real) * imsize**2 / norm
+        images.append(image[:, ::-1])
+        beams.append(beam[:, ::-1])
+        y, x = np.unravel_index(np.argmax(image[:, ::-1]), image.shape)
+        peak = float(image[:, ::-1][y, x])
+        dx, dy = np.degrees(
+            (np.array([x, y]) - imsize // 2) * cellsize * [-1, 1]
+        )
+        components[('CC', i)] = {
+            'keys': ['flux', 'deltax', 'deltay', '_status'],
+            'rows': [
+                {'flux': peak, 'deltax': dx, 'deltay': dy, '_status': 0},
+                {'flux': -abs(peak) * 1e-3, 'deltax': 0.0, 'deltay': 0.0,
+                 '_status': 0},
+            ],
+        }
+
+    # image descriptors (beam first, as the catalogue order of IMAGR)
+    name = task.outname or task.srcname or uvdata.name
+    ra, dec = (
+        desc['crval'][desc['ctype'].index(axis)] 
+        if axis in desc['ctype'] else 0.0 for axis in ('RA', 'DEC')
+    )
+    if uvdata.table_highver('SU'):
+        ra, dec = next((
+            (row['raepo'], row['decepo']) 
+            for row in _read_table(uvdata, 'SU', 1)['rows']
+            if row['source'].strip() == name
+        ), (ra, dec))
+    image_desc = {
+        key: value for key, value in desc.items() if key not in DESC_KEYS
+    }
+    image_desc.update({
+        'naxis': [imsize, imsize, len(planes), 1, 1, 1, 1],
+        'ctype': ['RA---SIN', 'DEC--SIN', 'FREQ', 'STOKES', '', '', ''],
+        'crval': [ra, dec, float(freq[bchan - 1]), 1.0, 0.0, 0.0, 0.0],
+        'cdelt': [
+            -float(task.cellsize[1]) / 3600, float(task.cellsize[1]) / 3600,
+            float(desc['cdelt'][ifreq] * nchav), 1.0, 1.0, 1.0, 1.0
+        ],
+        'crpix': [imsize / 2 + 1, imsize / 2 + 1, 1.0, 1.0, 1.0, 1.0, 1.0],
+        'crota': [0.0] * 7,
+        'bunit': 'JY/BEAM',
+        'jlocf': 2, 'VelDef': 1, 'VelReference': 1,
+        # reference velocity as set by SETJY (which is not simulated)
+        'altCrpix': 1.0, 'altRef': desc.get('altRef') or 1.0,
+    })
+    outdisk = task.outdisk or uvdata.disk
+    create_data(
+        outdisk, name, 'IBM001', 'MA', image_desc,
+        np.array(beams, dtype=np.float32)[None]
+    )
+    create_data(
+        outdisk, name, 'ICL001', 'MA', image_desc,
+        np.array(images, dtype=np.float32)[None], components
+    )
+
+def _fittp(task):
+    # write images as FITS (visibilities are not exported)
+    data = task.indata
+    if data.data_type != 'MA':
+        raise NotImplementedError('the simulator only exports images')
+    header = fits.Header()
+    for i, key in enumerate(data.header['ctype'], start=1):
+        if i > len(data._array.shape):
+            break
+        header[f'CTYPE{i}'] = key
+        header[f'CRVAL{i}'] = data.header['crval'][i - 1]
+        header[f'CDELT{i}'] = data.header['cdelt'][i - 1]
+        header[f'CRPIX{i}'] = data.header['crpix'][i - 1]
+    fits.PrimaryHDU(data=np.array(data._array), header=header).writeto(
+        task.dataout, overwrite=True
+    )
+
+def _tacop(task):
+    # copy tables
+    for i in range(int(task.ncount) or 1):
+        table = _read_table(task.indata, task.inext, task.invers + i)
+        _write_table(
+            task.outdata._path, task.inext,
+            (task.outvers or task.outdata.table_highver(task.inext) + 1) + i,
+            table
+        )
+
+def _tbin(task):
+    # create an (empty) table of the type and version in the text file
+    with open(task.intext, 'r') as file:
+        text = file.read()
+    name = re.search(r"EXTNAME\s*=\s*'AIPS (\w\w)", text)
+    version = re.search(r'EXTVER\s*=\s*(\d+)', text)
+    if name:
+        table_type = name.group(1)
+        _write_table(
+            task.outdata._path, table_type,
+            int(version.group(1)) if version
+            else task.outdata.table_highver(table_type) + 1,
+            {'keys': [], 'rows': []}
+        )
+
+def _indxr(task):
+    # index table, and a first calibration table
+    uvdata = task.indata
+    _write_table(uvdata._path, 'NX', 1, {'keys': [], 'rows': []})
+    if uvdata.table_highver('CL') == 0:
+        _write_table(uvdata._path, 'CL', 1, _solutions(uvdata, 'CL', 10))
+
+def _snedt(task):
+    # copy the solutions unedited
+    uvdata = task.indata
+    invers = task.invers or uvdata.table_highver('SN')
+    _write_table(
+        uvdata._path, 'SN', uvdata.table_highver('SN') + 1,
+        _read_table(uvdata, 'SN', invers)
+    )
+
+def _clcal(task):
+    # unit gains in the output CL table
+    uvdata = task.indata
+    gainuse = task.gainuse or uvdata.table_highver('CL') + 1
+    _write_table(uvdata._path, 'CL', gainuse, _solutions(uvdata, 'CL', 10))
+
+def _uvflg(task):
+    # an FG row for the flagged antennas and time range
+    uvdata = task.indata
+    fgver = task.outfgver or max(uvdata.table_highver('FG'), 1)
+    try:
+        table = _read_table(uvdata, 'FG', fgver)
+    except IOError:
+        table = {'keys': [], 'rows': []}
+    timerang = [t or 0 for t in task.timerang[1:]]
+    table['rows'].append({
+        'source': 0, 'subarray': 0, 'freq_id': -1,
+        'ants': [int(task.antennas[1] or 0), int(task.baseline[1] or 0)],
+        'time_range': [
+            sum(np.array(timerang[:4]) / [1, 24, 1440, 86400]),
+            sum(np.array(timerang[4:]) / [1, 24, 1440, 86400]) or 999.0
+        ],
+        'ifs': [int(task.bif or 0), int(task.eif or 0)],
+        'chans': [int(task.bchan or 0), int(task.echan or 0)],
+        'pflags': [1, 1, 1, 1], 'reason': str(task.reason or ''),
+    })
+    table['keys'] = list(table['rows'][0])
+    _write_table(uvdata._path, 'FG', fgver, table)
+
+def _solution_task(table_type):
+    # task writing unit gain solutions to the next table version
+    def run(task):
+        uvdata = task.indata
+        solint = float(
+            task.solint[1] if isinstance(task.solint, list) else task.solint
+        )
+        _write_table(
+            uvdata._path, table_type, uvdata.table_highver(table_type) + 1,
+            _solutions(uvdata, table_type, solint if solint > 0 else 10)
+        )
+    return run
+
+def _solutions(uvdata, table_type, solint):
+    # unit gain solutions per antenna and solution interval (minutes)
+    desc = uvdata._desc
+    records = np.asarray(uvdata._array)
+    nif = desc['naxis'][desc['ctype'].index('IF')]
+    npol = min(desc['naxis'][desc['ctype'].index('STOKES')], 2)
+    times = records[:, desc['iloct']]
+    packed = records[:, desc['ilocb']].astype(int)
+    antennas = np.union1d(packed // 256, packed % 256)
+    interval = solint / 1440
+    bins = np.unique(np.floor(times / interval)) if len(times) else []
+    rows = []
+    for t in bins:
+        for antenna in antennas:
+            row = {
+                'time': (t + 0.5) * interval, 'time_interval': interval,
+                'source_id': 1, 'antenna_no': int(antenna), 'subarray': 1,
+                'freq_id': 1,
+            }
+            for pol in range(1, npol + 1):
+                row.update({
+                    f'real{pol}': [1.0] * nif, f'imag{pol}': [0.0] * nif,
+                    f'rate_{pol}': [0.0] * nif, f'delay_{pol}': [0.0] * nif,
+                    f'weight_{pol}': [1.0] * nif, f'refant_{pol}': [1] * nif,
+                })
+            rows.append(row)
+    keys = list(rows[0]) if rows else []
+    return {'keys': keys, 'rows': rows}
+
+def _read_table(data, table_type, version):
+    # table of a catalogue entry as a dict of keys and rows
+    version = version or data.table_highver(table_type)
+    filename = os.path.join(
+        data._path, 'tables', f'{table_type}_{version}.json'
+    )
+    if not os.path.exists(filename):
+        raise IOError(f'{table_type} table {version} does not exist')
+    with open(filename, 'r') as file:
+        return json.load(file)
+
+def _copy_uv(task, uvdata, klass, desc, records):
+    # new UV data set with the tables of uvdata
+    tables = {
+        (name[5:], version): _read_table(uvdata, name[5:], version)
+        for version, name in uvdata.tables
+    }
+    create_data(
+        task.outdisk or uvdata.disk, task.outname or uvdata.name,
+        task.outclass or klass, 'UV', desc, records, tables
+    )
+
+def _source_mask(uvdata, records, sources):
+    # records of the given sources (all if none are given)
+    desc = uvdata._desc
+    names = [s for s in (sources or [None])[1:] if s]
+    if not names or desc['ilocsu'] < 0:
+        return np.ones(len(records), dtype=bool)
+    ids = [
+        row['source_id'] for row in _read_table(uvdata, 'SU', 1)['rows']
+        if row['source'].strip() in names
+    ]
+    return np.isin(records[:, desc['ilocsu']], ids)
+
+def _uv_desc(header, naxis, ctype, crval, keys):
+    # UV descriptor from a random groups header
+    nrparm = len(keys)
+    desc = {
+        'naxis': [n for n in naxis], 'ctype': ctype, 'crval': crval,
+        'cdelt': [header[f'CDELT{i}'] for i in range(2, len(naxis) + 2)],
+        'crpix': [header[f'CRPIX{i}'] for i in range(2, len(naxis) + 2)],
+        'crota': [
+            header.get(f'CROTA{i}', 0.0) for i in range(2, len(naxis) + 2)
+        ],
+        'object': str(header.get('OBJECT', '')).strip(),
+        'telescop': str(header.get('TELESCOP', '')).strip(),
+        'date_obs': str(header.get('DATE-OBS', '')).strip(),
+        'nrparm': nrparm, 'lrec': nrparm + int(np.prod(naxis)),
+        'jlocf': ctype.index('FREQ'), 'jlocs': ctype.index('STOKES'),
+        'jlocif': ctype.index('IF') if 'IF' in ctype else -1,
+    }
+    for key in (
+        'ilocu', 'ilocv', 'ilocw', 'iloct', 'ilocb', 'ilocsu', 'ilocit',
+        'iloca1', 'iloca2'
+    ):
+        desc[key] = keys.index(key) if key in keys else -1
+    return desc
+
+def _fits_table(hdu):
+    # AIPS table from a FITS binary table extension
+    keys = [
+        COLUMN_KEYS.get(name.strip(), name.strip().lower().replace(' ', '_'))
+        for name in hdu.columns.names
+    ]
+    rows = [
+        {
+            key: (value.strip() if isinstance(value, str) else value)
+            for key, value in zip(keys, row)
+        }
+        for row in hdu.data.tolist()
+    ]
+    return {'keys': keys, 'rows': rows}
+
+def synthesize_uvfits(
+    filename, sources=['TARGET', 'CALIBRATOR'], nant=7, nif=2, nchan=64, 
+    nstokes=1, ntime=100, inttime=1.6, freq=22.235e9, seed=0
+):
+    """
+    Writes a random groups UV FITS file of noise visibilities (with SU, 
+    AN, and FQ tables), for loading into the simulator with FITLD.
+    Parameters:
+        filename (str): The output FITS file name.
+        sources (list, optional): Source names, observed in turn.
+        nant (int, optional): The number of antennas.
+        nif (int, optional): The number of IFs.
+        nchan (int, optional): The number of channels per IF.
+        nstokes (int, optional): The number of polarizations (from LL).
+        ntime (int, optional): The number of integrations.
+        inttime (float, optional): The integration time in seconds.
+        freq (float, optional): The reference frequency in Hz.
+        seed (int, optional): The random seed.
+    """
+    rng = np.random.default_rng(seed)
+    ant1, ant2 = np.triu_indices(nant, k=1)
+    nbl = len(ant1)
+    times = np.repeat(np.arange(ntime) * inttime / 86400, nbl)
+    baseline = np.tile((ant1 + 1) * 256 + ant2 + 1, ntime)
+    source = np.repeat(np.arange(ntime) * len(sources) // ntime + 1, nbl)
+    positions = rng.normal(scale=1000, size=(nant, 3))
+    uvw = (positions[ant2] - positions[ant1])[np.tile(np.arange(nbl), ntime)]
+    uvw = uvw / 299792458.0
+
+    # visibilities (1, 1, IF, channel, stokes, complex)
+    shape = (len(times), 1, 1, nif, nchan, nstokes, 3)
+    data = np.empty(shape, dtype=np.float32)
+    data[..., :2] = rng.normal(size=(*shape[:-1], 2))
+    data[..., 2] = 1.0
+    groups = fits.GroupData(
+        data, bitpix=-32,
+        parnames=[
+            'UU---SIN', 'VV---SIN', 'WW---SIN', 'BASELINE', 'DATE', 'DATE',
+            'SOURCE', 'INTTIM'
+        ],
+        pardata=[
+            *uvw.T, baseline, np.full(len(times), 2460000.5), times, 
+            source, np.full(len(times), inttime)
+        ]
+    )
+    hdu = fits.GroupsHDU(groups)
+    for i, (ctype, crval, cdelt) in enumerate([
+        ('COMPLEX', 1.0, 1.0), ('STOKES', -2.0, -1.0), 
+        ('FREQ', freq, 15.625e3), ('IF', 1.0, 1.0), 
+        ('RA', 0.0, 1.0), ('DEC', 0.0, 1.0)
+    ], start=2):
+        hdu.header[f'CTYPE{i}'] = ctype
+        hdu.header[f'CRVAL{i}'] = crval
+        hdu.header[f'CDELT{i}'] = cdelt
+        hdu.header[f'CRPIX{i}'] = 1.0
+    hdu.header['OBJECT'] = 'MULTI'
+    hdu.header['TELESCOP'] = 'KAVA'
+
+    # source, antenna, and frequency tables
+    su = fits.BinTableHDU.from_columns([
+        fits.Column('ID. NO.', 'J', array=np.arange(1, len(sources) + 1)),
+        fits.Column('SOURCE', '16A', array=sources),
+        fits.Column('RAEPO', 'D', array=rng.uniform(0, 360, len(sources))),
+        fits.Column('DECEPO', 'D', array=rng.uniform(-60, 60, len(sources))),
+    ], name='AIPS SU')
+    an = fits.BinTableHDU.from_columns([
+        fits.Column('ANNAME', '8A', array=[f'A{i}' for i in range(nant)]),
+        fits.Column('NOSTA', 'J', array=np.arange(1, nant + 1)),
+    ], name='AIPS AN')
+    fq = fits.BinTableHDU.from_columns([
+        fits.Column('FRQSEL', 'J', array=[1]),
+        fits.Column(
+            'IF FREQ', f'{nif}D', array=[np.arange(nif) * nchan * 15.625e3]
+        ),
+        fits.Column('CH WIDTH', f'{nif}E', array=[np.full(nif, 15.625e3)]),
+    ], name='AIPS FQ')
+    fits.HDUList([hdu, su, an, fq]).writeto(filename, overwrite=True)
+
+TASKS = {
+    'FITLD': _fitld, 'MSORT': _msort, 'CVEL': _cvel,
+    'SPLIT': _split, 'SPLAT': _split, 'IMAGR': _imagr, 'FITTP': _fittp,
+    'TACOP': _tacop, 'TBIN': _tbin, 'INDXR': _indxr, 'SNEDT': _snedt,
+    'CLCAL': _clcal, 'UVFLG': _uvflg,
+    'ACCOR': _solution_task('SN'), 'APCAL': _solution_task('SN'),
+    'FRING': _solution_task('SN'), 'BPASS': _solution_task('BP'),
+    'ANTAB': _solution_task('TY'),
+}
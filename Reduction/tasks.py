@@ -1,9 +1,19 @@
+from collections import deque
+from functools import lru_cache, wraps
 from inspect import signature
+import json
 import os
+import shutil
+import time
 
-from AIPSData import AIPSCat, AIPSImage, AIPSUVData
-from AIPSTask import AIPSList, AIPSTask
-from AIPSTV import AIPSTV
+from backend import (
+    AIPS, AIPSCat, AIPSImage, AIPSList, AIPSTask, AIPSTV, AIPSUVData
+)
+
+from wizardry import flag_solutions, is_tb_sorted
+
+# number of most recent task profiles kept in pyAIPSTask.records
+PROFILE_RECORDS = 1000
 
 # main pyAIPSTask decorator
 class pyAIPSTask:
@@ -53,6 +63,18 @@ class pyAIPSTask:
             # Set additional task parameters here
             ...
         my_task(indata=..., outdata=..., ...)
+    Profiling:
+        Every call records its wall and CPU time (including the AIPS 
+        task process), the time spent in catalogue snapshots and TV 
+        startup, the change in used bytes of the filesystem holding the 
+        task disk (fs_bytes, which includes writes by anything else on 
+        that filesystem, e.g. concurrent AIPS jobs), and the task 
+        parameters (as reprs) in `pyAIPSTask.records`, which keeps the 
+        last PROFILE_RECORDS calls. If the PYAIPSTASK_TRACE 
+        environment variable is set, each call is also appended to 
+        that file as a Chrome trace event, with nested events for the 
+        catalogue snapshots and TV startup (open in chrome://tracing or 
+        Perfetto).
     Methods:
         __call__(func): Decorates the given function, handling argument 
             validation, task setup, execution, and output retrieval.
@@ -71,6 +93,8 @@ class pyAIPSTask:
         The result of the decorated function, or the created AIPS data 
             object(s) if `create_data` is set.
     """
+    records = deque(maxlen=PROFILE_RECORDS)
+
     def __init__(
         self, task_name, 
         indata=False, datain=False, intext=False, calin=False, 
@@ -97,22 +121,36 @@ class pyAIPSTask:
         self.create_type = create_type
 
     def __call__(self, func):
+        # compile argument specification and assignment plan once
+        assignments = [
+            (assign, name, getattr(self, name), options)
+            for assign, name, options in [
+                (self._assign_data, 'indata', {}),
+                (self._assign_data, 'datain', {'path': True}),
+                (self._assign_data, 'intext', {}),
+                (self._assign_data, 'calin', {'path': True}),
+                (self._assign_data, 'dataout', {'path': True}),
+                (self._assign_data, 'outdata', {}),
+                (self._assign_int, 'outdisk', {}),
+                (self._assign_data, 'outtext', {}),
+                (self._assign_list, 'sources', {}),
+                (self._assign_string, 'srcname', {}),
+                (self._assign_list, 'calsour', {}),
+            ]
+            if getattr(self, name)
+        ]
+        func_args = frozenset(signature(func).parameters)
+        all_args = func_args | {'params'} | {
+            name for _, name, _, _ in assignments
+        }
+
+        @wraps(func)
         def wrapper(*args, **kwargs):
             # argument filtering
             if args:
                 raise TypeError(
                     f'{func.__name__}() only accepts keyword arguments'
                 )
-            wrapper_args = {'params'} | {
-                field for field in [
-                    'indata', 'datain', 'intext', 'calin', 
-                    'outdisk', 'outdata', 'dataout', 'outtext',
-                    'sources', 'srcname', 'calsour'
-                ] 
-                if getattr(self, field)
-            }
-            func_args = signature(func).parameters.keys()
-            all_args = wrapper_args | func_args
             unexpected_args = [key for key in kwargs if key not in all_args]
             if unexpected_args:
                 raise TypeError(
@@ -121,35 +159,35 @@ class pyAIPSTask:
                 )
             
             # initialize task
+            start, cpu_start = time.perf_counter(), os.times()
+            spans = []
             task = AIPSTask(self.task_name)
 
             # prepare TV
             tv = AIPSTV() if self.requires_tv else None
-            if tv: tv.start()
+            if tv: 
+                tick = time.perf_counter()
+                tv.start()
+                spans.append(('tv', tick, time.perf_counter() - tick))
             
             # call main function
             func(task, **{k: v for k, v in kwargs.items() if k in func_args})
 
             # argument handling
-            self._assign_data(task, 'indata', kwargs, self.indata)
-            self._assign_data(task, 'datain', kwargs, self.datain, path=True)
-            self._assign_data(task, 'intext', kwargs, self.intext)
-            self._assign_data(task, 'calin', kwargs, self.calin, path=True)
-            self._assign_data(task, 'dataout', kwargs, self.dataout, path=True)
-            self._assign_data(task, 'outdata', kwargs, self.outdata)
-            self._assign_int(task, 'outdisk', kwargs, self.outdisk)
-            self._assign_data(task, 'outtext', kwargs, self.outtext)
-            self._assign_list(task, 'sources', kwargs, self.sources)
-            self._assign_string(task, 'srcname', kwargs, self.srcname)
-            self._assign_list(task, 'calsour', kwargs, self.calsour)
+            for assign, name, flag, options in assignments:
+                assign(task, name, kwargs, flag, **options)
 
             # parse extra parameters and run task
             parse_params(task, kwargs.get('params'))
+            outdisk = int(
+                getattr(task, 'indisk', 0) if not self.outdisk 
+                else task.outdisk
+            )
+            used = _disk_used(outdisk)
             if self.create_data: 
-                outdisk = int(
-                    task.indisk if not self.outdisk else task.outdisk
-                )
+                tick = time.perf_counter()
                 initial = grab_catalogue(outdisk)
+                spans.append(('catalogue', tick, time.perf_counter() - tick))
             task.go()
 
             # close TV if needed
@@ -158,8 +196,10 @@ class pyAIPSTask:
                     input('Press enter to continue...')
                 tv.kill()
 
-            # return results
+            # grab results
+            result = None
             if self.create_data:
+                tick = time.perf_counter()
                 final = grab_catalogue(outdisk)
                 data_class = (
                     AIPSUVData if self.create_type == 'UV' else AIPSImage
@@ -168,7 +208,7 @@ class pyAIPSTask:
                     output = compare_catalogues(
                         initial, final, return_multiple=True
                     )
-                    return [
+                    result = [
                         data_class(
                             obj.name, obj.klass, outdisk, obj.seq
                         )
@@ -176,12 +216,38 @@ class pyAIPSTask:
                     ]
                 else:
                     output = compare_catalogues(initial, final)
-                    return data_class(
+                    result = data_class(
                         output.name, output.klass, outdisk, output.seq
                     )
+                spans.append(('catalogue', tick, time.perf_counter() - tick))
+
+            # record profile and return results
+            cpu_end = os.times()
+            self._record({
+                'task': self.task_name,
+                'start': start,
+                'wall': time.perf_counter() - start,
+                'cpu': sum(cpu_end[:4]) - sum(cpu_start[:4]),
+                'catalogue': sum(s[2] for s in spans if s[0] == 'catalogue'),
+                'tv': sum(s[2] for s in spans if s[0] == 'tv'),
+                'disk': outdisk,
+                'fs_bytes': (
+                    _disk_used(outdisk) - used if used is not None else None
+                ),
+                'params': {key: repr(value) for key, value in kwargs.items()},
+                'spans': spans,
+            })
+            return result
 
         return wrapper
 
+    # helper methods for profiling
+    def _record(self, record):
+        pyAIPSTask.records.append(record)
+        filename = os.environ.get('PYAIPSTASK_TRACE')
+        if filename:
+            write_trace(filename, record)
+
     # helper methods for argument handling
     def _assign_data(self, task, name, kwargs, flag, path=False):
         if not flag: return
@@ -216,18 +282,64 @@ class pyAIPSTask:
                 setattr(task, name, AIPSList(val_list))
 
 # utility functions
+def write_trace(filename, record):
+    """
+    Appends a task profile record to a Chrome trace file, as a complete 
+    ("X") event for the task with nested events for catalogue snapshots 
+    and TV startup.
+    Parameters:
+        filename (str): The trace file (JSON array format).
+        record (dict): The profile record from pyAIPSTask.
+    Notes:
+        The trace is written without a closing bracket, which trace 
+        viewers accept, so events from several scripts (or processes) 
+        can be appended to the same file.
+    """
+    offset = time.time() - time.perf_counter()
+    event = {'pid': os.getpid(), 'tid': AIPS.userno, 'ph': 'X'}
+    events = [{
+        **event,
+        'name': record['task'], 'cat': 'task', 
+        'ts': (offset + record['start']) * 1e6,
+        'dur': record['wall'] * 1e6,
+        'args': {
+            key: value for key, value in record.items() 
+            if key not in ('task', 'start', 'wall', 'spans')
+        },
+    }]
+    for name, start, duration in record['spans']:
+        events.append({
+            **event, 
+            'name': name, 'cat': 'overhead', 
+            'ts': (offset + start) * 1e6, 
+            'dur': duration * 1e6
+        })
+    is_new = not os.path.exists(filename) or os.path.getsize(filename) == 0
+    lines = ''.join(json.dumps(e, default=str) + ',\n' for e in events)
+    with open(filename, 'a') as file:
+        file.write(('[\n' if is_new else '') + lines)
+
+def _disk_used(disk):
+    # bytes used on the whole filesystem holding an AIPS disk (None if 
+    # unknown)
+    try:
+        dirname = getattr(AIPS.disks[disk], 'dirname', None)
+        return shutil.disk_usage(dirname).used if dirname else None
+    except (IndexError, TypeError, OSError):
+        return None
+
 def grab_catalogue(disk):
-    # grab catalogue from disk
-    return AIPSCat(int(disk))[int(disk)]
+    # grab catalogue from disk, indexed by (name, class, seq, type)
+    return {
+        (item['name'], item['klass'], item['seq'], item['type']): item
+        for item in AIPSCat(int(disk))[int(disk)]
+    }
 
 def compare_catalogues(catalogue1, catalogue2, return_multiple=False):
-    # compare two catalogues
-    for catalogue in [catalogue1, catalogue2]:
-        for item in catalogue:
-            item.pop('date')
-            item.pop('time')
-    
-    new_items = [item for item in catalogue2 if item not in catalogue1]
+    # compare two indexed catalogues for new entries
+    new_items = [
+        item for key, item in catalogue2.items() if key not in catalogue1
+    ]
     if return_multiple:
         return new_items
     else:
@@ -238,11 +350,19 @@ def parse_params(task, params):
     if params:
         for key, value in params.items():
             if value is None: continue
-            if '|' in key:
-                temp = getattr(task, key.split('|')[0])
-                temp[int(key.split('|')[1])] = value
+            name, index = parse_key(key)
+            if index is not None:
+                getattr(task, name)[index] = value
             else: 
-                setattr(task, key, value)
+                setattr(task, name, value)
+
+@lru_cache(maxsize=None)
+def parse_key(key):
+    # parse parameter key into name and index (e.g. 'aparm|5')
+    if '|' in key:
+        name, index = key.split('|')
+        return name, int(index)
+    return key, None
 
 # tasks
 @pyAIPSTask('ACCOR', indata=True)
@@ -377,3 +497,44 @@ def uvplt(task):
 )
 def vplot(task):
     pass
+
+# task alternatives
+def edit_sn(indata, invers, mode='interactive', nsigma=5.0, params=None):
+    """
+    Edits an SN table into the next SN version, either interactively 
+    with SNEDT or automatically with wizardry.flag_solutions.
+    Parameters:
+        indata (AIPSUVData): The AIPS UV data object.
+        invers (int): The SN table version to edit.
+        mode (str, optional): The editing mode ('interactive' or 
+            'auto').
+        nsigma (float, optional): The outlier threshold in robust 
+            standard deviations (auto mode only).
+        params (dict, optional): Extra SNEDT parameters (interactive 
+            mode only).
+    """
+    if mode == 'auto':
+        tacop(
+            indata=indata, outdata=indata, 
+            inext='SN', invers=invers, outvers=invers + 1
+        )
+        nflag = flag_solutions(indata, invers + 1, nsigma=nsigma)
+        print(f'Flagged {nflag} solutions in SN table {invers + 1}')
+    else:
+        snedt(indata=indata, invers=invers, params=params)
+
+def sort_tb(indata):
+    """
+    Sorts UV data into time-baseline order with MSORT (replacing the 
+    original), unless it is already in that order.
+    Parameters:
+        indata (AIPSUVData): The AIPS UV data object.
+    Returns:
+        AIPSUVData: The sorted UV data (the input if already sorted).
+    """
+    if is_tb_sorted(indata):
+        print(f'{indata.name}.{indata.klass} already in TB order')
+        return indata
+    sorted_uvdata = msort(indata=indata, sort='TB')
+    indata.zap()
+    return sorted_uvdata
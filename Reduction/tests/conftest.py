@@ -0,0 +1,32 @@
+import os
+import sys
+
+import pytest
+
+# run the tests against the local simulator backend
+os.environ.setdefault('RCW142_BACKEND', 'local')
+sys.path.insert(
+    0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+)
+
+from backend import AIPS, AIPSTask, AIPSUVData
+from simulator import synthesize_uvfits
+
+@pytest.fixture
+def aips(tmp_path, monkeypatch):
+    # an empty simulator catalogue for user 5
+    monkeypatch.setattr(AIPS, 'userno', 5)
+    for disk in AIPS.disks[1:]:
+        monkeypatch.setattr(disk, 'dirname', str(tmp_path / str(disk.disk)))
+    return tmp_path
+
+@pytest.fixture
+def uvdata(aips):
+    # synthesized noise visibilities loaded with FITLD
+    filename = str(aips / 'synthetic.uvfits')
+    synthesize_uvfits(filename, nif=2, nchan=16, ntime=40)
+    fitld = AIPSTask('FITLD')
+    fitld.datain = filename
+    fitld.outname, fitld.outclass, fitld.outdisk = 'MULTI', 'UVDATA', 1
+    fitld.go()
+    return AIPSUVData('MULTI', 'UVDATA', 1, 1)
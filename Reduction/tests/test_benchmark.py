@@ -0,0 +1,9 @@
+from benchmark import benchmark_cases, run_benchmarks
+
+def test_benchmarks_run_on_synthesized_data(uvdata):
+    cases = benchmark_cases(uvdata, 'TARGET', 3, 1e-3, 128, 4, 100)
+    results = run_benchmarks(cases, 2)
+    assert list(results) == list(cases)
+    assert all(
+        0 < result['best'] <= result['mean'] for result in results.values()
+    )
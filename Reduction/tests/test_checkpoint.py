@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+from backend import AIPSCat
+from checkpoint import Checkpoint
+from simulator import create_data
+
+def _load(uvdata, fail=False):
+    # stage creating a new UV entry (as FITLD would), then failing
+    output = create_data(1, 'EPOCH', 'UVDATA', 'UV', {}, np.zeros((1, 1)))
+    if fail:
+        raise RuntimeError('stage failed')
+    return output
+
+def _entries():
+    return [(entry.name, entry.seq) for entry in AIPSCat(1)[1]]
+
+def test_failed_stage_zaps_its_entries(aips):
+    checkpoint = Checkpoint(str(aips / 'state.json'))
+    with pytest.raises(RuntimeError):
+        checkpoint.run('load', _load, None, fail=True)
+    assert _entries() == []
+    uvdata = Checkpoint(str(aips / 'state.json')).run('load', _load, None)
+    assert (uvdata.seq, _entries()) == (1, [('EPOCH', 1)])
+
+def test_rerun_zaps_entries_of_interrupted_stage(aips):
+    # a killed run leaves its stage running, with an orphaned entry
+    state = str(aips / 'state.json')
+    checkpoint = Checkpoint(state)
+    checkpoint.stages['load'] = {
+        'status': 'running', 'inputs': {}, 'catalogue': []
+    }
+    checkpoint._save()
+    _load(None)
+    uvdata = Checkpoint(state).run('load', _load, None)
+    assert (uvdata.seq, _entries()) == (1, [('EPOCH', 1)])
@@ -0,0 +1,195 @@
+import os
+import warnings
+
+from astropy.stats import sigma_clipped_stats
+import numpy as np
+import pytest
+
+from backend import AIPS
+from simulator import create_data
+import wizardry
+from wizardry import FBLANK, WizardryCache, _catalogue_stamp, \
+    dirty_image, flag_solutions, grab_table, grab_uv, grid_uv, image_stats, \
+    iter_uv, masked_scalar_average, masked_vector_average, scalar_average, \
+    thermal_noise, vector_average, weighted_average
+
+def _aips_files(dirname, cno, mtime):
+    # AIPS-style files (TTDVVVCCC.UUU;) of a catalogue entry, with a
+    # version 1 extension table that shares its number with entry 1
+    files = [
+        os.path.join(dirname, f'{kind}D{version:03d}{cno:03d}.005;')
+        for kind, version in [('MA', 0), ('CC', 1), ('CC', cno)]
+    ]
+    for file in files:
+        open(file, 'w').close()
+        os.utime(file, ns=(mtime, mtime))
+    return files
+
+def test_catalogue_stamp_is_per_entry(tmp_path, monkeypatch):
+    monkeypatch.setattr(AIPS, 'userno', 5)
+    monkeypatch.setattr(AIPS.disks[1], 'dirname', str(tmp_path))
+    first = create_data(1, 'FIRST', 'ICL001', 'MA', {}, np.zeros((2, 2)))
+    second = create_data(1, 'SECOND', 'ICL001', 'MA', {}, np.zeros((2, 2)))
+    _aips_files(tmp_path, 1, 10**18)
+    files = _aips_files(tmp_path, 2, 10**18)
+    
+    # grab both entries through the cache
+    calls = []
+    def grab_pixels(data):
+        calls.append(data.name)
+        return np.arange(4)
+    cache = WizardryCache(tmp_path / 'cache')
+    for data in (first, second, first, second):
+        cache._cached(grab_pixels, data, (), {})
+    assert calls == ['FIRST', 'SECOND']
+    
+    # touching the second entry only invalidates the second entry
+    stamp = _catalogue_stamp(first)
+    os.utime(files[1], ns=(2 * 10**18, 2 * 10**18))
+    assert _catalogue_stamp(first) == stamp
+    for data in (first, second):
+        cache._cached(grab_pixels, data, (), {})
+    assert calls == ['FIRST', 'SECOND', 'SECOND']
+
+def test_cache_is_per_user(tmp_path, monkeypatch):
+    monkeypatch.setattr(AIPS.disks[1], 'dirname', str(tmp_path))
+    cache = WizardryCache(tmp_path / 'cache')
+    calls = []
+    def grab_pixels(data):
+        calls.append(AIPS.userno)
+        return np.full(4, AIPS.userno)
+    for userno in (5, 6):
+        monkeypatch.setattr(AIPS, 'userno', userno)
+        data = create_data(1, 'SAME', 'ICL001', 'MA', {}, np.zeros((2, 2)))
+        assert cache._cached(grab_pixels, data, (), {})[0] == userno
+    assert calls == [5, 6]
+
+def test_averages_keep_precision():
+    rng = np.random.default_rng(0)
+    vis = (rng.normal(size=(50, 8)) + 1j*rng.normal(size=(50, 8)))
+    weig = rng.uniform(0.5, 1.0, size=(50, 8))
+    expected = np.average(vis, weights=weig, axis=0)
+    for vis_type, weig_type in [
+        (np.complex64, np.float32), (np.complex128, np.float64)
+    ]:
+        real_type = np.dtype(weig_type)
+        args = (vis.astype(vis_type), None, weig.astype(weig_type), 0)
+        for result in [
+            vector_average(*args), scalar_average(*args), 
+            weighted_average(*args), masked_vector_average(*args)[:2]
+        ]:
+            assert all(value.dtype == real_type for value in result)
+        amplitude, phase = vector_average(*args)
+        tolerance = 1e-5 if real_type == np.float32 else 1e-12
+        assert np.allclose(amplitude, np.abs(expected), rtol=tolerance)
+        assert np.allclose(phase, np.angle(expected), rtol=tolerance)
+    
+    # results are written into (and take the type of) given arrays
+    out = tuple(np.empty(8, np.float32) for _ in range(4))
+    result = weighted_average(vis, None, weig, 0, out=out)
+    assert all(value is array for value, array in zip(result, out))
+
+def test_masked_averages_of_flagged_slices_are_quiet():
+    vis = np.ones((4, 3), dtype=np.complex64)
+    weig = np.zeros((4, 3), dtype=np.float32)
+    weig[:, 0] = 1.0
+    out = tuple(np.empty(3, dtype=dtype) for dtype in ('f4', 'f4', int))
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        for average in (masked_scalar_average, masked_vector_average):
+            amplitude, phase, count = average(vis, None, weig, 0, chunk=2)
+            assert np.all(np.isnan(amplitude[1:]) & np.isnan(phase[1:]))
+            assert list(count) == [4, 0, 0]
+            average(vis, None, -weig, 0, out=out)
+            assert np.all(np.isnan(out[0])) and not np.any(out[2])
+            assert np.isnan(average(vis[:, 1], None, weig[:, 1], 0)[0])
+
+def test_flag_solutions_per_source(tmp_path, monkeypatch):
+    # a bright calibrator (source 1) and a faint target (source 2) on 
+    # one antenna, with one outlying target solution
+    monkeypatch.setattr(AIPS, 'userno', 5)
+    monkeypatch.setattr(AIPS.disks[1], 'dirname', str(tmp_path))
+    rng = np.random.default_rng(2)
+    sources = np.repeat([1, 2], [80, 20])
+    amplitude = np.where(sources == 1, 10.0, 1.0) + rng.normal(0, 1e-3, 100)
+    amplitude[95] = 1.5
+    rows = [
+        {
+            'time': i / 1440, 'source_id': int(source), 'antenna_no': 1, 
+            'subarray': 1, 'real1': [float(value)] * 2, 
+            'imag1': [0.0] * 2, 'rate_1': [0.0] * 2, 
+            'delay_1': [0.0] * 2, 'weight_1': [1.0] * 2
+        }
+        for i, (source, value) in enumerate(zip(sources, amplitude))
+    ]
+    uvdata = create_data(
+        1, 'SNTEST', 'UVDATA', 'UV', {}, np.zeros((1, 1)), 
+        {('SN', 1): {'keys': list(rows[0]), 'rows': rows}}
+    )
+    assert flag_solutions(uvdata, 1) == 2
+    weight = np.asarray(grab_table(uvdata, 'SN', 1)['weight_1'])
+    assert list(np.flatnonzero(weight[:, 0] == 0)) == [95]
+
+def test_thermal_noise_of_every_IF_in_one_pass(uvdata, monkeypatch):
+    passes = []
+    uv_blocks = wizardry._uv_blocks
+    monkeypatch.setattr(
+        wizardry, '_uv_blocks', 
+        lambda uvdata: passes.append(uvdata) or uv_blocks(uvdata)
+    )
+    for weighting in ('natural', 'uniform'):
+        passes.clear()
+        noise = thermal_noise(
+            uvdata, 'TARGET', weighting, 1e-3, 256, IF=[1, 2]
+        )
+        assert noise.shape == (2, 16) and len(passes) == 1
+        for IF in (1, 2):
+            assert np.allclose(noise[IF - 1], thermal_noise(
+                uvdata, 'TARGET', weighting, 1e-3, 256, IF=IF
+            ))
+    # 20 integrations of 21 baselines with unit weights
+    assert np.allclose(
+        thermal_noise(uvdata, 'TARGET', IF=[1, 2]), 1 / np.sqrt(420)
+    )
+
+def test_grid_every_IF_in_one_read(uvdata):
+    scale = np.array([1.0, 1.001])
+    grid, weight = None, 0.0
+    for chunk in iter_uv(uvdata, 'TARGET', 100, IF=[1, 2], compact=True):
+        grid, chunk_weight = grid_uv(chunk, 3, 1e-3, 128, scale, grid)
+        weight += chunk_weight
+    
+    # the same as gridding each IF in turn
+    expected, expected_weight = None, 0.0
+    for IF in (1, 2):
+        uv = grab_uv(uvdata, 'TARGET', IF=IF, compact=True)
+        expected, IF_weight = grid_uv(
+            uv, 3, 1e-3, 128, scale[IF - 1], expected
+        )
+        expected_weight += IF_weight
+    assert np.allclose(grid, expected) and weight == expected_weight
+    with pytest.raises(ValueError):
+        grid_uv(chunk, 3, 1e-3, 128)
+    with pytest.raises(ValueError):
+        dirty_image(None, 0.0)
+
+def test_image_stats_with_unrepresentative_first_tile(monkeypatch):
+    # the first tile of 64 rows is a bright source or blanked, and the 
+    # noise is only in the tiles after it
+    monkeypatch.setattr(wizardry, 'STATS_TILE_BYTES', 64 * 512 * 4)
+    rng = np.random.default_rng(1)
+    noise = rng.normal(0.0, 1.0, (512, 512)).astype(np.float32)
+    for first in (1000.0 + 1e-3 * noise[:64], np.full((64, 512), FBLANK)):
+        image = noise.copy()
+        image[:64] = first
+        valid = image[image != np.float32(FBLANK)].astype(float)
+        median = np.median(valid)
+        stats = image_stats(image)
+        _, _, clipped = sigma_clipped_stats(valid, sigma=3, maxiters=10)
+        assert stats['npix'] == len(valid)
+        assert np.isclose(stats['median'], median, atol=1e-3)
+        assert np.isclose(
+            stats['mad_sigma'], 1.4826 * np.median(np.abs(valid - median)), 
+            rtol=1e-3
+        )
+        assert np.isclose(stats['clipped_rms'], clipped, rtol=1e-2)
@@ -1,16 +1,73 @@
+from glob import glob
+import hashlib
+import json
+import os
+import shutil
+import warnings
+
 from astropy.io import fits
 from astropy.table import QTable, Table
 from astropy import units as u
 from astropy.wcs import WCS
 import numpy as np
 
-from AIPS import AIPS
-from AIPSData import AIPSImage, AIPSUVData
-from Wizardry.AIPSData import AIPSImage as wAIPSImage
-from Wizardry.AIPSData import AIPSUVData as wAIPSUVData
+from backend import (
+    AIPS, AIPSCat, AIPSImage, AIPSTableRow, AIPSUVData, wAIPSImage, 
+    wAIPSUVData
+)
+
+# AIPS magic value for blanked data
+FBLANK = 3.1415926e38
+
+# Wizardry internals used here beyond its documented interface, which 
+# the simulator's Wizardry classes reproduce, so they are pinned and 
+# must be checked against each new Wizardry version:
+#   AIPSUVData/AIPSImage ._data.Desc.Dict and .update(): the descriptor, 
+#       edited in place (is_tb_sorted, switch_spectral)
+#   the visibility iterator's ._buffer (a flat float32 buffer of lrec 
+#       records), ._count (records in the buffer), and ._index (of the 
+#       current record, which the next step increments) (_uv_blocks)
+#   table ._keys: the column keys (_read_table)
+#   table row ._row (the Obit row, with a list of values per column 
+#       name) and ._fields (the column name of each key) (_table_rows)
+
+# UVFLG adverbs understood by the flag compiler, polarization flags per 
+# UVFLG stokes selection, and the end of open-ended IF or channel ranges
+FLAG_ADVERBS = {
+    'sources', 'timerang', 'antennas', 'baseline', 'bif', 'eif', 
+    'bchan', 'echan', 'stokes', 'reason', 'opcode'
+}
+FLAG_STOKES = {
+    '': [1, 1, 1, 1], 'FULL': [1, 1, 1, 1], 
+    'RR': [1, 0, 0, 0], 'LL': [0, 1, 0, 0], 
+    'RL': [0, 0, 1, 0], 'LR': [0, 0, 0, 1], 
+    'RRLL': [1, 1, 0, 0], 'RLLR': [0, 0, 1, 1],
+}
+FLAG_LAST = 2**31 - 1
+
+# bytes of visibilities reduced per chunk by weighted_average
+AVERAGE_CHUNK_BYTES = 2**23
+
+# half-width (support) and 1/e width in cells of the gaussian gridding
+# kernel, and the number of grid updates accumulated per chunk
+GRID_SUPPORT = 3
+GRID_WIDTH = 0.7
+GRID_CHUNK = 2**22
+
+# bytes of pixels read per tile by image_stats, pixels in the strided 
+# sample that centres and scales each plane's histogram, and the number 
+# of histogram bins and their extent (in asinh of the offset over the 
+# sample's scale)
+STATS_TILE_BYTES = 2**24
+STATS_SAMPLE = 2**20
+HIST_BINS = 2**16
+HIST_EXTENT = np.arcsinh(1e6)
 
 # general wizardry functions
-def grab_table(data, table_name, table_index=0, ignore=[]):
+def grab_table(
+    data, table_name, table_index=0, ignore=[], 
+    columns=None, sources=[], antennas=[], timerange=None
+):
     """
     Grabs a table from an AIPSUVData or AIPSImage object.
     Parameters:
@@ -18,29 +75,46 @@ def grab_table(data, table_name, table_index=0, ignore=[]):
         table_name (str): The name of the table to retrieve.
         table_index (int, optional): The index of the table to retrieve.
         ignore (list, optional): List of columns to ignore.
+        columns (list, optional): List of columns to retrieve (all 
+            columns if not given).
+        sources (list, optional): List of source IDs to filter rows by.
+        antennas (list, optional): List of antenna numbers to filter 
+            rows by.
+        timerange (tuple, optional): Start and end time (in days) to 
+            filter rows by.
     Returns:
         astropy.table.Table: The specified table as an Astropy Table.
     Notes: 
         For AIPSUVData, currently only works for AN, CL, FQ, NX, and SU 
         tables. Not tested for BP, FG, GC, SN, and TY tables. For 
-        AIPSImage, currently works for CC and CG tables.
+        AIPSImage, currently works for CC and CG tables. The table is 
+        read in a single pass, and rows are filtered on the source_id, 
+        antenna_no, and time columns during the read.
     """
     temp_data = grab_data_copy(data)
-
-    table = temp_data.table(table_name, table_index)
-    table = Table(
-        data=[
-            [
-                getattr(row, col).strip()
-                if isinstance(getattr(row, col), str)
-                else getattr(row, col)
-                for row in table
-            ]
-            for col in table._keys if col not in ignore
-        ],
-        names=[col for col in table._keys if col not in ignore]
+    return _read_table(
+        temp_data, table_name, table_index, ignore, 
+        columns, sources, antennas, timerange
     )
-    return table
+
+def grab_tables(data, table_name, table_indices, **kwargs):
+    """
+    Grabs several versions of a table from an AIPSUVData or AIPSImage 
+    object, opening the data only once.
+    Parameters:
+        data (AIPSUVData or AIPSImage): The AIPS data object.
+        table_name (str): The name of the tables to retrieve.
+        table_indices (list): The indices of the tables to retrieve.
+        **kwargs: Additional arguments passed to grab_table (ignore, 
+            columns, sources, antennas, and timerange).
+    Returns:
+        list: The specified tables as Astropy Tables.
+    """
+    temp_data = grab_data_copy(data)
+    return [
+        _read_table(temp_data, table_name, table_index, **kwargs)
+        for table_index in table_indices
+    ]
 
 def grab_header(data):
     """
@@ -78,103 +152,274 @@ def grab_wcs(data):
 # data wizardry functions
 def grab_uv(
     uvdata, source, corr='cross', 
-    antennas=[], baselines=[], IF=1, stokes='LL'
+    antennas=[], baselines=[], IF=1, stokes='LL', compact=False
 ):
     """
     Grabs the UV data for a specific source from an AIPSUVData object.
     Parameters:
         uvdata (AIPSUVData): The AIPS UV data object.
-        source (str): The source name to filter by.
+        source (str or None): The source name to filter by (None for
+            every source, e.g. for single-source data).
         corr (str, optional): The correlation of data to grab ('cross', 
             'auto', 'both').
         antennas (list, optional): List of antennas to filter by.
         baselines (list, optional): List of baselines to filter by.
-        IF (int, optional): The IF number to filter by.
-        stokes (str, optional): The Stokes parameter to filter by.
+        IF (int or list, optional): The IF number(s) to filter by.
+        stokes (str or list, optional): The Stokes parameter(s) to 
+            filter by.
+        compact (bool, optional): Whether to store the visibilities 
+            in compact form (see Notes).
     Returns:
         astropy.table.QTable: The filtered UV data as an Astropy QTable.
     Notes:
         Currently only works for AIPSUVData objects with spectral FREQ
-        channels, and not VELO- or FELO- spectral channels.
+        channels, and not VELO- or FELO- spectral channels. The data 
+        is read in a single pass, one Wizardry buffer at a time, and 
+        the selection is applied to each buffer as a vectorized mask. 
+        Only the matched rows of each buffer are kept, so memory use 
+        scales with the selection rather than the whole file.
+        If IF and/or stokes are given as lists, the real, imag, and 
+        weig columns gain an IF and/or Stokes axis, i.e. each row is a 
+        (IF, channel, stokes) cube, and the selected IFs and Stokes 
+        parameters are stored in the table meta. In compact mode, the 
+        real and imag columns are replaced by a single complex64 vis 
+        column, weig, u, v, w, and inttime are float32, and baseline is 
+        int16, matching the precision AIPS stores the data in.
     """
-    def get_source_id(sources, source_name):
-        # get source ID from the source list
-        return sources[sources['source'] == source_name]['source_id'][0]
+    # load UV data and get parameters
+    temp_uv = wAIPSUVData(uvdata.name, uvdata.klass, uvdata.disk, uvdata.seq)
+    source_id, selection, shape, meta = _uv_selection(
+        temp_uv, source, IF, stokes
+    )
     
-    def match_row(row, source_id, corr):
-        # match row based on source, correlation, antennas, and baselines
-        source_match = row.source == source_id
-        baseline1, baseline2 = row.baseline
-        is_auto = baseline1 == baseline2
-        is_cross = baseline1 != baseline2
-        has_antenna = (baseline1 in antennas or baseline2 in antennas)
-        has_baseline = (
-            (baseline1 in baselines and baseline2 in baselines) or
-            (baseline2 in baselines and baseline1 in baselines)
-        )
-        
-        if corr == 'auto':
-            return source_match and is_auto and (not antennas or has_antenna)
-        elif corr == 'cross':
-            if antennas:
-                return source_match and is_cross and has_antenna
-            elif baselines:
-                return source_match and is_cross and has_baseline
-            else:
-                return source_match and is_cross
-        return False
+    # collect the matched rows of each block
+    blocks = list(_select_uv(
+        temp_uv, source_id, corr, antennas, baselines, selection, shape, 
+        compact
+    ))
     
-    def fill_row(visibility, i, row, stokes_id):
-        # fill the visibility table row with data
-        visibility['u'][i], visibility['v'][i], visibility['w'][i] = row.uvw
-        visibility['time'][i] = row.time
-        visibility['inttime'][i] = row.inttim
-        visibility['baseline'][i] = row.baseline
-        visibility['real'][i, :] = row.visibility[IF - 1, :, stokes_id, 0]
-        visibility['imag'][i, :] = row.visibility[IF - 1, :, stokes_id, 1]
-        visibility['weig'][i, :] = row.visibility[IF - 1, :, stokes_id, 2]
+    # join blocks into visibility arrays and build visibility table
+    columns = {
+        name: np.concatenate(
+            [array] + [block[name] for block in blocks], 
+            dtype=array.dtype, casting='unsafe'
+        )
+        for name, array in _uv_arrays(0, shape, compact).items()
+    }
+    return _uv_table(columns, meta)
 
+def iter_uv(
+    uvdata, source, chunk_rows=100000, corr='cross', 
+    antennas=[], baselines=[], IF=1, stokes='LL', compact=False
+):
+    """
+    Iterates over the UV data for a specific source from an AIPSUVData 
+    object in fixed-size chunks.
+    Parameters:
+        uvdata (AIPSUVData): The AIPS UV data object.
+        source (str or None): The source name to filter by (None for
+            every source, e.g. for single-source data).
+        chunk_rows (int, optional): The number of visibilities per 
+            chunk.
+        corr (str, optional): The correlation of data to grab ('cross', 
+            'auto', 'both').
+        antennas (list, optional): List of antennas to filter by.
+        baselines (list, optional): List of baselines to filter by.
+        IF (int or list, optional): The IF number(s) to filter by.
+        stokes (str or list, optional): The Stokes parameter(s) to 
+            filter by.
+        compact (bool, optional): Whether to store the visibilities 
+            in compact form (as in grab_uv).
+    Yields:
+        astropy.table.Table: Chunks of the filtered UV data, with the 
+            same columns as grab_uv and chunk_rows rows each (except 
+            for the last chunk).
+    Notes:
+        Only one chunk (plus one Wizardry buffer) is held in memory at 
+        a time, so the full data set never has to fit in memory.
+    """
     # load UV data and get parameters
     temp_uv = wAIPSUVData(uvdata.name, uvdata.klass, uvdata.disk, uvdata.seq)
-    sources = grab_table(temp_uv, 'SU')
-    source_id = get_source_id(sources, source)
-    stokes_id = temp_uv.stokes.index(stokes) - 1
-    nchan = temp_uv.header['naxis'][temp_uv.header['ctype'].index('FREQ')]
-    ntime = np.count_nonzero(
-        [match_row(row, source_id, corr) for row in temp_uv]
+    source_id, selection, shape, meta = _uv_selection(
+        temp_uv, source, IF, stokes
     )
     
-    # initialize visibility table
-    visibility = Table(
-        data=[
-            np.zeros(ntime),
-            np.zeros(ntime),
-            np.zeros(ntime),
-            np.zeros(ntime),
-            np.zeros(ntime),
-            np.zeros((ntime, 2)),
-            np.zeros((ntime, nchan)),
-            np.zeros((ntime, nchan)),
-            np.zeros((ntime, nchan))
-        ],
-        names=[
-            'u', 'v', 'w', 
-            'time', 'inttime', 'baseline', 
-            'real', 'imag', 'weig'
-        ],
-        units=[u.m, u.m, u.m, u.day, u.s, None, u.Jy, u.Jy, None]
-    )
+    # fill chunks block by block, yielding each chunk once full
+    columns, i = _uv_arrays(chunk_rows, shape, compact), 0
+    for block in _select_uv(
+        temp_uv, source_id, corr, antennas, baselines, selection, shape, 
+        compact
+    ):
+        j, n = 0, len(block['time'])
+        while j < n:
+            m = min(chunk_rows - i, n - j)
+            for name, array in columns.items():
+                array[i:i + m] = block[name][j:j + m]
+            i, j = i + m, j + m
+            if i == chunk_rows:
+                yield _uv_table(columns, meta)
+                columns, i = _uv_arrays(chunk_rows, shape, compact), 0
+    if i > 0:
+        yield _uv_table(
+            {name: array[:i] for name, array in columns.items()}, meta
+        )
+
+def uv_frequencies(uvdata):
+    """
+    Calculates the channel frequencies of each IF of an AIPSUVData 
+    object.
+    Parameters:
+        uvdata (AIPSUVData): The AIPS UV data object.
+    Returns:
+        ndarray: The (IF, channel) frequencies in Hz.
+    Notes:
+        IF offsets are read from the first row of the FQ table.
+    """
+    header = uvdata.header
+    axis = header['ctype'].index('FREQ')
+    nchan = header['naxis'][axis]
+    freq = header['crval'][axis] + (
+        np.arange(nchan) + 1 - header['crpix'][axis]
+    ) * header['cdelt'][axis]
+    offsets = np.zeros(1)
+    if 'IF' in header['ctype'] \
+    and header['naxis'][header['ctype'].index('IF')] > 1:
+        fq = grab_table(uvdata, 'FQ', columns=['if_freq'])
+        offsets = np.atleast_1d(fq['if_freq'][0])
+    return offsets[:, None] + freq[None, :]
+
+def thermal_noise(
+    uvdata, source, weighting='natural', cellsize=None, imsize=None,
+    IF=1, stokes='LL', chunk_rows=100000
+):
+    """
+    Calculates the expected thermal noise per channel of an image of
+    the UV data from the visibility weights, without imaging.
+    Parameters:
+        uvdata (AIPSUVData): The AIPS UV data object.
+        source (str or None): The source name to filter by (as in
+            grab_uv).
+        weighting (str, optional): The imaging weights ('natural' or
+            'uniform').
+        cellsize (float, optional): The image cell size in arcseconds
+            (for uniform weighting).
+        imsize (int, optional): The image size in pixels (for uniform
+            weighting).
+        IF (int or list, optional): The IF number(s).
+        stokes (str or list, optional): The Stokes parameter(s), with
+            several imaged together (as in grid_uv).
+        chunk_rows (int, optional): The number of visibilities read
+            per chunk (as in iter_uv).
+    Returns:
+        ndarray: The expected image RMS in Jy/beam for each channel, 
+            with an IF axis first if IF is a list (NaN for fully 
+            flagged channels).
+    Notes:
+        The weights are taken as 1/sigma**2 of the real and imaginary
+        parts, as calibrated data weights are in AIPS. The data is
+        read in a single pass with iter_uv, for every IF at once. For 
+        natural weighting, the noise is 1/sqrt(sum(weig)). For uniform 
+        weighting, the weights are summed per UV cell of the image grid
+        (at the mean frequency of each IF, with each visibility and its
+        conjugate in the same cell), and the noise is 
+        sqrt(sum(1/cell))/ncells over the occupied cells, i.e. every 
+        cell gets the same imaging weight. Flagged visibilities 
+        (non-positive weights) are skipped.
+    """
+    if weighting not in ('natural', 'uniform'):
+        raise ValueError("weighting must be 'natural' or 'uniform'.")
+    if weighting == 'uniform' and (cellsize is None or imsize is None):
+        raise ValueError('uniform weighting needs cellsize and imsize.')
+    freqs = uv_frequencies(uvdata)[np.atleast_1d(IF) - 1]
+    nif, nchan = freqs.shape
+    reffreq = uvdata.header['crval'][uvdata.header['ctype'].index('FREQ')]
+    if imsize is not None:
+        scale = freqs.mean(axis=1) / reffreq * imsize * np.radians(
+            cellsize / 3600
+        )
     
-    # populate visibility table
-    temp_uv = wAIPSUVData(
-        temp_uv.name, temp_uv.klass, temp_uv.disk, temp_uv.seq
-    )
-    i = 0
-    for row in temp_uv:
-        if match_row(row, source_id, corr):
-            fill_row(visibility, i, row, stokes_id)
-            i += 1
-    return visibility
+    # accumulate weights per IF and channel (and per UV cell of each IF 
+    # if uniform)
+    total = np.zeros((nif, nchan))
+    keys, cells = np.zeros(0, dtype=np.int64), np.zeros((0, nchan))
+    for chunk in iter_uv(
+        uvdata, source, chunk_rows=chunk_rows, IF=IF, stokes=stokes,
+        compact=True
+    ):
+        weig = np.maximum(np.asarray(chunk['weig'], dtype=float), 0)
+        weig = weig.reshape(len(weig), nif, nchan, -1).sum(axis=3)
+        if weighting == 'natural':
+            total += weig.sum(axis=0)
+            continue
+        x = np.rint(np.outer(chunk['u'], scale)).astype(np.int64)
+        y = np.rint(np.outer(chunk['v'], scale)).astype(np.int64)
+        mirror = (x < 0) | ((x == 0) & (y < 0))
+        x[mirror], y[mirror] = -x[mirror], -y[mirror]
+        keep = np.maximum(x, np.abs(y)) < imsize // 2
+        ifs = np.broadcast_to(np.arange(nif), x.shape)
+        chunk_keys, chunk_cells = _sum_by_key(
+            (ifs[keep] * imsize + y[keep] + imsize // 2) * imsize + x[keep], 
+            weig[keep]
+        )
+        keys, cells = _sum_by_key(
+            np.concatenate([keys, chunk_keys]),
+            np.concatenate([cells, chunk_cells])
+        )
+    
+    # expected image noise per IF and channel
+    noise = np.full((nif, nchan), np.nan)
+    if weighting == 'natural':
+        np.divide(1, np.sqrt(total), out=noise, where=total > 0)
+    else:
+        occupied = cells > 0
+        inverse = np.divide(
+            1, cells, out=np.zeros_like(cells), where=occupied
+        )
+        ifs = keys // imsize**2
+        total, count = np.zeros((nif, nchan)), np.zeros((nif, nchan))
+        np.add.at(total, ifs, inverse)
+        np.add.at(count, ifs, occupied)
+        np.divide(np.sqrt(total), count, out=noise, where=count > 0)
+    return noise if np.ndim(IF) > 0 else noise[0]
+
+def is_tb_sorted(uvdata, mark=True):
+    """
+    Checks whether the visibilities of an AIPSUVData object are in 
+    time-baseline (TB) order.
+    Parameters:
+        uvdata (AIPSUVData): The AIPS UV data object.
+        mark (bool, optional): Whether to set the header sort order to 
+            'TB' if the data turns out to be sorted.
+    Returns:
+        bool: Whether the data is in TB order.
+    Notes:
+        The header sort order is not trusted (e.g. FITLD copies it from 
+        the FITS file), so the time and baseline random parameters are 
+        always checked, block by block in one read-only pass, stopping 
+        at the first visibility out of order.
+    """
+    temp_uv = wAIPSUVData(uvdata.name, uvdata.klass, uvdata.disk, uvdata.seq)
+    desc = temp_uv._data.Desc.Dict
+    
+    # compare consecutive (time, baseline) keys, including across blocks
+    previous = None
+    for rparm, _ in _uv_blocks(temp_uv):
+        columns = _uv_columns(temp_uv, rparm)
+        time = columns['time']
+        baseline = columns['baseline'] @ np.array([256, 1])
+        if previous is not None:
+            time = np.concatenate([[previous[0]], time])
+            baseline = np.concatenate([[previous[1]], baseline])
+        dtime, dbaseline = np.diff(time), np.diff(baseline)
+        if np.any((dtime < 0) | ((dtime == 0) & (dbaseline < 0))):
+            return False
+        previous = time[-1], baseline[-1]
+    
+    if mark and desc['isort'].strip() != 'TB':
+        desc['isort'] = 'TB'
+        temp_uv._data.Desc.Dict = desc
+        temp_uv.update()
+    return True
 
 def grab_im(imdata):
     """
@@ -204,38 +449,466 @@ def grab_im(imdata):
     #         image.append(np.frombuffer(temp_im._data.PixBuf))
     #     return np.array(image)
 
+# table wizardry functions
+def flag_solutions(uvdata, snver, nsigma=5.0):
+    """
+    Flags outlying solutions in an SN table of an AIPSUVData object, 
+    as a non-interactive replacement for SNEDT.
+    Parameters:
+        uvdata (AIPSUVData): The AIPS UV data object.
+        snver (int): The SN table version to edit (in place).
+        nsigma (float, optional): The outlier threshold in robust 
+            standard deviations.
+    Returns:
+        int: The number of flagged solutions (per IF and polarization).
+    Notes:
+        For each source, subarray, antenna, IF, and polarization, the 
+        gain amplitudes, phases, rates, and delays are compared to 
+        their median (so a bright calibrator does not set the level of 
+        a faint target), and solutions more than nsigma robust standard 
+        deviations (from the median absolute deviation) away are 
+        flagged by blanking them and setting their weight to zero. 
+        Phases are compared to the direction of the mean unit phasor, 
+        so they are not affected by wrapping.
+    """
+    sn = grab_table(uvdata, 'SN', snver)
+    npol = 2 if 'real2' in sn.colnames else 1
+    _, groups = np.unique(
+        np.column_stack([
+            np.asarray(sn[key]) 
+            for key in ('source_id', 'subarray', 'antenna_no') 
+            if key in sn.colnames
+        ]), 
+        axis=0, return_inverse=True
+    )
+    groups = groups.ravel()
+    
+    # detect outliers per source, subarray, antenna, IF, and polarization
+    flags = []
+    for pol in range(1, npol + 1):
+        gain = (
+            _per_if(sn[f'real{pol}']) + 1j * _per_if(sn[f'imag{pol}'])
+        )
+        rate = _per_if(sn[f'rate_{pol}'])
+        delay = _per_if(sn[f'delay_{pol}'])
+        valid = (_per_if(sn[f'weight_{pol}']) > 0) & (
+            np.abs(gain.real) < FBLANK / 2
+        )
+        flagged = np.zeros(gain.shape, dtype=bool)
+        for group in np.unique(groups):
+            rows = groups == group
+            with np.errstate(divide='ignore', invalid='ignore'):
+                phasor = np.where(
+                    valid[rows], gain[rows] / np.abs(gain[rows]), 0
+                )
+            reference = np.exp(1j * np.angle(np.sum(phasor, axis=0)))
+            for values in [
+                np.abs(gain[rows]), 
+                np.angle(gain[rows] / reference), 
+                rate[rows], 
+                delay[rows]
+            ]:
+                flagged[rows] |= _robust_outliers(values, valid[rows], nsigma)
+        flags.append(flagged)
+    
+    # write flags back to the SN table
+    temp_uv = grab_data_copy(uvdata)
+    table = temp_uv.table('SN', snver)
+    for i, row in enumerate(table):
+        if not any(flagged[i].any() for flagged in flags):
+            continue
+        for pol, flagged in enumerate(flags, start=1):
+            for key in [
+                f'real{pol}', f'imag{pol}', f'rate_{pol}', f'delay_{pol}', 
+                f'weight_{pol}'
+            ]:
+                value = getattr(row, key)
+                array = np.atleast_1d(value).astype(float)
+                array[flagged[i]] = 0.0 if key.startswith('weight') else FBLANK
+                setattr(
+                    row, key, 
+                    array.tolist() if isinstance(value, list) else array[0]
+                )
+        row.update()
+    table.close()
+    return int(sum(np.count_nonzero(flagged) for flagged in flags))
+
+def compile_flags(uvdata, flags):
+    """
+    Compiles UVFLG-style flag specifications (e.g. documents of a YAML 
+    flag file) into merged FG table rows.
+    Parameters:
+        uvdata (AIPSUVData): The AIPS UV data object (for source IDs).
+        flags (list): Flag specifications as dicts of UVFLG adverbs 
+            (sources, timerang, antennas, baseline, bif, eif, bchan, 
+            echan, stokes, reason).
+    Returns:
+        list: FG rows as dicts (source, ants, time_range, ifs, chans, 
+            pflags, reason).
+        list: Flag specifications that cannot be compiled (other 
+            adverbs or opcodes), to be applied with UVFLG instead.
+    Notes:
+        Each specification is expanded into one row per source and 
+        antenna pair (as UVFLG does), and duplicate rows are dropped. 
+        Rows that differ only in their time range are then merged 
+        where the time ranges overlap or touch, followed by the same 
+        for channel ranges and IF ranges, so the table holds the 
+        fewest rows that flag the same data.
+    """
+    sources = grab_table(uvdata, 'SU', columns=['source', 'source_id'])
+    source_ids = dict(zip(sources['source'], sources['source_id']))
+    
+    # expand specifications into rows
+    rows, remaining = set(), []
+    for flag in flags:
+        stokes = str(flag.get('stokes') or '').strip().upper()
+        if (
+            set(flag) - FLAG_ADVERBS or stokes not in FLAG_STOKES
+            or str(flag.get('opcode') or 'FLAG').upper() != 'FLAG'
+            or any(a < 0 for a in _flag_list(flag.get('antennas')))
+        ):
+            remaining.append(flag)
+            continue
+        timerang = (list(flag.get('timerang') or []) + [0] * 8)[:8]
+        common = (
+            (
+                _flag_time(timerang[:4]), 
+                _flag_time(timerang[4:]) if any(timerang[4:]) else 999.0
+            ), 
+            _flag_range(flag.get('bif'), flag.get('eif')), 
+            _flag_range(flag.get('bchan'), flag.get('echan')), 
+            tuple(FLAG_STOKES[stokes]), 
+            str(flag.get('reason') or '')[:24]
+        )
+        for source in _flag_list(flag.get('sources')) or ['']:
+            source_id = int(source_ids[source]) if source else 0
+            for ants in _flag_antennas(flag):
+                rows.add((source_id, ants, *common))
+    
+    # merge time, channel, and IF ranges of otherwise identical rows
+    for index, gap in [(2, 0.0), (4, 1), (3, 1)]:
+        groups = {}
+        for row in rows:
+            key = row[:index] + row[index + 1:]
+            groups.setdefault(key, []).append(row[index])
+        rows = {
+            key[:index] + (interval,) + key[index:]
+            for key, intervals in groups.items()
+            for interval in _merge_intervals(intervals, gap)
+        }
+    
+    return [
+        {
+            'source': source, 'ants': list(ants), 
+            'time_range': list(time_range), 
+            'ifs': [ifs[0], ifs[1] % FLAG_LAST], 
+            'chans': [chans[0], chans[1] % FLAG_LAST], 
+            'pflags': list(pflags), 'reason': reason
+        }
+        for source, ants, time_range, ifs, chans, pflags, reason 
+        in sorted(rows)
+    ], remaining
+
+def write_flags(uvdata, rows, fgver=1):
+    """
+    Writes FG rows (e.g. from compile_flags) to an FG table of an 
+    AIPSUVData object in a single pass.
+    Parameters:
+        uvdata (AIPSUVData): The AIPS UV data object.
+        rows (list): FG rows as dicts (source, ants, time_range, ifs, 
+            chans, pflags, reason).
+        fgver (int, optional): The FG table version (appended to if it 
+            already exists).
+    Returns:
+        int: The number of rows written.
+    """
+    temp_uv = grab_data_copy(uvdata)
+    if [fgver, 'AIPS FG'] in [list(table) for table in uvdata.tables]:
+        table = temp_uv.table('FG', fgver)
+    else:
+        table = temp_uv.attach_table('FG', fgver)
+    for values in rows:
+        row = AIPSTableRow(table)
+        row.source = values['source']
+        row.subarray = 0
+        row.freq_id = -1
+        row.ants = values['ants']
+        row.time_range = values['time_range']
+        row.ifs = values['ifs']
+        row.chans = values['chans']
+        row.pflags = values['pflags']
+        row.reason = values['reason'].ljust(24)
+        table.append(row)
+    table.close()
+    return len(rows)
+
+# cache wizardry
+class WizardryCache:
+    """
+    Persistent on-disk cache for data grabbed with Wizardry. Extracted 
+    visibilities, tables, and image planes are written as .npy files 
+    and returned as memory-mapped (zero-copy, read-only) views on 
+    later calls. Entries are keyed by the catalogue entry (AIPS user 
+    number, name, class, disk, seq), the grab function and its 
+    arguments, and are invalidated when the modification stamp of the 
+    catalogue entry's files changes. Least recently used entries are 
+    evicted once the cache exceeds its size limit.
+    Parameters:
+        directory (str): Directory to store the cache in.
+        max_size (float, optional): Maximum size of the cache in bytes.
+    Usage:
+        cache = WizardryCache('/scratch/wizardry', max_size=50e9)
+        visibility = cache.grab_uv(uvdata, 'RCW142', IF=[1, 2])
+        cc = cache.grab_table(image, 'CC', table_index=1)
+        pixels = cache.grab_im(image)
+    Methods:
+        grab_uv(uvdata, *args, **kwargs): Cached grab_uv.
+        grab_table(data, *args, **kwargs): Cached grab_table.
+        grab_im(imdata): Cached grab_im.
+        clear(): Removes every entry in the cache.
+    """
+    def __init__(self, directory, max_size=20e9):
+        self.directory = os.path.realpath(directory)
+        self.max_size = max_size
+        os.makedirs(self.directory, exist_ok=True)
+
+    def grab_uv(self, uvdata, *args, **kwargs):
+        return self._cached(grab_uv, uvdata, args, kwargs)
+
+    def grab_table(self, data, *args, **kwargs):
+        return self._cached(grab_table, data, args, kwargs)
+
+    def grab_im(self, imdata):
+        return self._cached(grab_im, imdata, (), {})
+
+    def clear(self):
+        for entry in self._entries():
+            shutil.rmtree(entry, ignore_errors=True)
+
+    # helper methods for cache handling
+    def _cached(self, func, data, args, kwargs):
+        key = json.dumps(
+            [func.__name__, args, kwargs], default=str, sort_keys=True
+        )
+        path = os.path.join(
+            self.directory, 
+            f'{AIPS.userno}.{data.name}.{data.klass}.{data.disk}.'
+            f'{data.seq}'.replace(' ', '_'),
+            f'{func.__name__}-{hashlib.sha1(key.encode()).hexdigest()}'
+        )
+        stamp = _catalogue_stamp(data)
+        
+        # return cached entry if still valid
+        manifest = self._read_manifest(path)
+        if manifest is not None and manifest['stamp'] == stamp:
+            os.utime(os.path.join(path, 'manifest.json'))
+            return self._load(path, manifest)
+        
+        # otherwise grab data and store it
+        result = func(data, *args, **kwargs)
+        self._store(path, result, stamp)
+        result = self._load(path, self._read_manifest(path))
+        self._evict()
+        return result
+
+    def _read_manifest(self, path):
+        try:
+            with open(os.path.join(path, 'manifest.json'), 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def _store(self, path, result, stamp):
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        shutil.rmtree(temp_path, ignore_errors=True)
+        os.makedirs(temp_path)
+        if isinstance(result, Table):
+            manifest = {
+                'stamp': stamp, 
+                'kind': 'table',
+                'names': result.colnames,
+                'units': [
+                    None if result[name].unit is None 
+                    else result[name].unit.to_string()
+                    for name in result.colnames
+                ],
+                'meta': dict(result.meta),
+            }
+            arrays = [np.asarray(result[name]) for name in result.colnames]
+        else:
+            manifest = {'stamp': stamp, 'kind': 'array'}
+            arrays = [np.asarray(result)]
+        for i, array in enumerate(arrays):
+            np.save(os.path.join(temp_path, f'{i}.npy'), array)
+        with open(os.path.join(temp_path, 'manifest.json'), 'w') as file:
+            json.dump(manifest, file, default=str)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(temp_path, path)
+
+    def _load(self, path, manifest):
+        if manifest['kind'] == 'array':
+            return np.load(os.path.join(path, '0.npy'), mmap_mode='r')
+        return Table(
+            data=[
+                np.load(os.path.join(path, f'{i}.npy'), mmap_mode='r')
+                for i, _ in enumerate(manifest['names'])
+            ],
+            names=manifest['names'],
+            units=manifest['units'],
+            meta=manifest['meta'],
+            copy=False
+        )
+
+    def _entries(self):
+        return [
+            os.path.dirname(manifest) for manifest in glob(
+                os.path.join(self.directory, '*', '*', 'manifest.json')
+            )
+            if not os.path.dirname(manifest).endswith('.tmp')
+        ]
+
+    def _evict(self):
+        entries = []
+        for entry in self._entries():
+            files = [
+                os.path.join(entry, file) for file in os.listdir(entry)
+            ]
+            entries.append((
+                os.path.getmtime(os.path.join(entry, 'manifest.json')),
+                sum(os.path.getsize(file) for file in files),
+                entry
+            ))
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total <= self.max_size:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
 # calculation functions
-def uv_amplitude(real, imag):
+def uv_amplitude(real, imag=None):
     """
     Calculate the visibility amplitude from real and imaginary 
     components.
     Parameters:
-        real (array-like): Real part of the visibilities.
-        imag (array-like): Imaginary part of the visibilities.
+        real (array-like): Real part of the visibilities, or the 
+            complex visibilities if imag is not given.
+        imag (array-like, optional): Imaginary part of the visibilities.
     Returns:
         ndarray: Amplitude of the visibilities.
     """
+    if imag is None:
+        return np.abs(real)
     return np.sqrt(real**2 + imag**2)
 
-def uv_phase(real, imag):
+def uv_phase(real, imag=None):
     """
     Calculate the visibility phase from real and imaginary 
     components.
     Parameters:
-        real (array-like): Real part of the visibilities.
-        imag (array-like): Imaginary part of the visibilities.
+        real (array-like): Real part of the visibilities, or the 
+            complex visibilities if imag is not given.
+        imag (array-like, optional): Imaginary part of the visibilities.
     Returns:
         ndarray: Phase of the visibilities in radians.
     """
+    if imag is None:
+        return np.angle(real)
     return np.arctan2(imag, real)
 
+def weighted_average(
+    real, imag, weig, axis, mode='vector', out=None, chunk=None
+):
+    """
+    Calculate the weighted average amplitude and phase, summed weight, 
+    and effective sample count of complex visibilities in a single 
+    pass.
+    Parameters:
+        real (array-like): Real part of the visibilities, or the 
+            complex visibilities if imag is None.
+        imag (array-like or None): Imaginary part of the visibilities.
+        weig (array-like): Weights for averaging, with the same shape 
+            as the visibilities or 1-D along axis.
+        axis (int): Axis along which to average.
+        mode (str, optional): The averaging mode ('vector' for the 
+            amplitude of the weighted average vector, 'scalar' for the 
+            weighted average of the amplitudes).
+        out (tuple, optional): Arrays to write the amplitude, phase, 
+            weight, and effective sample count into (usually of the 
+            result type, see Notes).
+        chunk (int, optional): The number of slices along axis reduced 
+            at a time (defaults to about AVERAGE_CHUNK_BYTES of 
+            visibilities).
+    Returns:
+        tuple: (amplitude, phase, weight, neff) where phase is the 
+            phase of the weighted sum, weight is the sum of the 
+            weights, and neff is the effective sample count 
+            (sum(weig)**2/sum(weig**2)).
+    Notes:
+        The weighted sums are accumulated chunk by chunk with 
+        np.einsum, which multiplies and sums without allocating 
+        full-size temporaries, so each chunk is read once while it is 
+        in cache. Each chunk is summed in the precision of the data, 
+        and the chunk sums are accumulated in float64. The results are 
+        returned in the floating point type of the data and weights 
+        (e.g. float32 for complex64 visibilities), without upcasting. 
+        Amplitudes of slices whose weights sum to zero are NaN.
+    """
+    sums, dtype = _weighted_sums(real, imag, weig, axis, mode, chunk)
+    return _normalize_sums(sums, mode, dtype, out)
+
+def masked_scalar_average(real, imag, weig, axis, out=None, chunk=None):
+    """
+    Calculate the scalar average amplitude and phase for complex 
+    visibilities, excluding flagged visibilities.
+    Parameters:
+        real (array-like): Real part of the visibilities, or the 
+            complex visibilities if imag is None.
+        imag (array-like or None): Imaginary part of the visibilities.
+        weig (array-like): Weights for averaging, with non-positive 
+            weights marking flagged visibilities (as in AIPS).
+        axis (int): Axis along which to average.
+        out (tuple, optional): Arrays to write the amplitude, phase, 
+            and valid count into.
+        chunk (int, optional): The number of slices along axis reduced 
+            at a time (as in weighted_average).
+    Returns:
+        tuple: (amplitude, phase, count) as in scalar_average, with 
+            count the number of unflagged visibilities in each slice. 
+            Fully flagged slices have NaN amplitude and phase.
+    """
+    return _masked_average(real, imag, weig, axis, 'scalar', out, chunk)
+
+def masked_vector_average(real, imag, weig, axis, out=None, chunk=None):
+    """
+    Calculate the vector average amplitude and phase for complex 
+    visibilities, excluding flagged visibilities.
+    Parameters:
+        real (array-like): Real part of the visibilities, or the 
+            complex visibilities if imag is None.
+        imag (array-like or None): Imaginary part of the visibilities.
+        weig (array-like): Weights for averaging, with non-positive 
+            weights marking flagged visibilities (as in AIPS).
+        axis (int): Axis along which to average.
+        out (tuple, optional): Arrays to write the amplitude, phase, 
+            and valid count into.
+        chunk (int, optional): The number of slices along axis reduced 
+            at a time (as in weighted_average).
+    Returns:
+        tuple: (amplitude, phase, count) as in vector_average, with 
+            count the number of unflagged visibilities in each slice. 
+            Fully flagged slices have NaN amplitude and phase.
+    """
+    return _masked_average(real, imag, weig, axis, 'vector', out, chunk)
+
 def scalar_average(real, imag, weig, axis):
     """
     Calculate the scalar average amplitude and phase for complex 
     visibilities.
     Parameters:
-        real (array-like): Real part of the visibilities.
-        imag (array-like): Imaginary part of the visibilities.
+        real (array-like): Real part of the visibilities, or the 
+            complex visibilities if imag is None.
+        imag (array-like or None): Imaginary part of the visibilities.
         weig (array-like): Weights for averaging.
         axis (int): Axis along which to average.
     Returns:
@@ -243,11 +916,10 @@ def scalar_average(real, imag, weig, axis):
             average of the amplitudes, and phase is the phase of the 
             weighted sum.
     """
-    amplitude = np.average(uv_amplitude(real, imag), weights=weig, axis=axis)
-    phase = uv_phase(
-        np.sum(weig*real, axis=axis), 
-        np.sum(weig*imag, axis=axis)
+    amplitude, phase, weight, _ = weighted_average(
+        real, imag, weig, axis, mode='scalar'
     )
+    _check_weights(weight)
     return amplitude, phase
 
 def vector_average(real, imag, weig, axis):
@@ -255,8 +927,9 @@ def vector_average(real, imag, weig, axis):
     Calculate the vector average amplitude and phase for complex 
     visibilities.
     Parameters:
-        real (array-like): Real part of the visibilities.
-        imag (array-like): Imaginary part of the visibilities.
+        real (array-like): Real part of the visibilities, or the 
+            complex visibilities if imag is None.
+        imag (array-like or None): Imaginary part of the visibilities.
         weig (array-like): Weights for averaging.
         axis (int): Axis along which to average.
 
@@ -265,15 +938,326 @@ def vector_average(real, imag, weig, axis):
             the weighted average vector, and phase is the phase of the 
             weighted sum.
     """
-    avg_real = np.average(real, weights=weig, axis=axis)
-    avg_imag = np.average(imag, weights=weig, axis=axis)
-    amplitude = uv_amplitude(avg_real, avg_imag)
-    phase = uv_phase(
-        np.sum(weig*real, axis=axis), 
-        np.sum(weig*imag, axis=axis)
+    amplitude, phase, weight, _ = weighted_average(
+        real, imag, weig, axis, mode='vector'
     )
+    _check_weights(weight)
     return amplitude, phase
 
+def average_uv(uv, solint=None, mode='vector', gap=60.0):
+    """
+    Average visibilities per baseline over time bins or whole scans, 
+    as done by UVAVG.
+    Parameters:
+        uv (astropy.table.Table): Visibility table from grab_uv or 
+            iter_uv.
+        solint (float, optional): The averaging interval in seconds 
+            (defaults to averaging whole scans).
+        mode (str, optional): The averaging mode ('vector' or 'scalar', 
+            as in vector_average and scalar_average).
+        gap (float, optional): The minimum gap in seconds between 
+            scans.
+    Returns:
+        astropy.table.Table: The averaged visibility table, with the 
+            same columns as uv, one row per baseline and time bin, and 
+            weights summed over each bin.
+    Notes:
+        Scans are split wherever the visibilities have a gap longer 
+        than gap, and time bins never cross a scan boundary. Rows are 
+        ordered once by (scan, time bin, baseline) and every column is 
+        then reduced per group with np.add.reduceat. Visibilities are 
+        reduced chunk by chunk with the same masked weighted sums as 
+        masked_vector_average and masked_scalar_average, so flagged 
+        visibilities (non-positive weights) are excluded, and fully 
+        flagged groups have NaN visibilities and zero weight. Times, 
+        u, v, and w are averaged, and integration times are summed. In 
+        scalar mode, the averaged visibility has the weighted average 
+        amplitude and the phase of the weighted sum.
+    """
+    if mode not in ('vector', 'scalar'):
+        raise ValueError("mode must be 'vector' or 'scalar'.")
+    order, starts = _uv_groups(
+        np.asarray(uv['time']), np.asarray(uv['baseline']), solint, gap
+    )
+    counts = np.diff(np.append(starts, len(order)))
+    
+    # average or sum random parameters per group
+    columns = {}
+    for name in ('u', 'v', 'w', 'time'):
+        column = np.asarray(uv[name])
+        columns[name] = (
+            np.add.reduceat(column[order], starts) / counts
+        ).astype(column.dtype)
+    columns['inttime'] = np.add.reduceat(
+        np.asarray(uv['inttime'])[order], starts
+    ).astype(uv['inttime'].dtype)
+    columns['baseline'] = np.asarray(uv['baseline'])[order][starts]
+    
+    # average unflagged visibilities per group
+    if 'vis' in uv.colnames:
+        vis = np.asarray(uv['vis'])
+        real, imag = vis.real, vis.imag
+    else:
+        real, imag = np.asarray(uv['real']), np.asarray(uv['imag'])
+    sums, dtype = _grouped_sums(
+        real, imag, np.asarray(uv['weig']), order, starts, mode
+    )
+    amplitude, phase, weight, _ = _normalize_sums(sums, mode, dtype)
+    phase[sums[5] == 0] = np.nan
+    average = amplitude * np.exp(1j*phase)
+    
+    # build averaged visibility table
+    if 'vis' in uv.colnames:
+        columns['vis'] = average.astype(uv['vis'].dtype)
+    else:
+        columns['real'] = average.real
+        columns['imag'] = average.imag
+    columns['weig'] = weight.astype(uv['weig'].dtype)
+    columns = {name: columns[name] for name in uv.colnames}
+    meta = {**uv.meta, 'AVGMODE': mode, 'SOLINT': solint}
+    return _uv_table(columns, meta)
+
+def grid_uv(uv, channel, cellsize, imsize, scale=1.0, grid=None):
+    """
+    Grid the visibilities of a single channel onto a UV grid with a
+    gaussian convolution kernel, using natural weighting.
+    Parameters:
+        uv (astropy.table.Table): Visibility table from grab_uv or
+            iter_uv, for a single IF, or with an IF axis (IF given as 
+            a list) if scale is given per IF.
+        channel (int): The channel to grid (1-based, as in AIPS).
+        cellsize (float): The image cell size in arcseconds.
+        imsize (int): The image size in pixels.
+        scale (float or list, optional): The channel frequency over the
+            reference frequency (u and v are in wavelengths at the
+            reference frequency), or one per IF of uv.
+        grid (ndarray, optional): A grid to accumulate into, e.g. from
+            a previous chunk of iter_uv.
+    Returns:
+        tuple: (grid, weight) where grid is the (imsize, imsize)
+            complex UV grid and weight is the sum of the gridded
+            weights.
+    Notes:
+        Each visibility is spread over (2*GRID_SUPPORT + 1)**2 cells,
+        and the grid updates are accumulated with np.bincount,
+        GRID_CHUNK updates at a time. Only the given (u, v) are
+        gridded; dirty_image adds the conjugate visibilities at
+        (-u, -v). Flagged visibilities (non-positive weights) and
+        visibilities too far out for the grid are skipped. The channel 
+        of every IF (each at its own scale), and Stokes parameters if 
+        uv has a Stokes axis, are gridded together.
+    """
+    per_if = np.ndim(scale) > 0
+    if not per_if and len(uv.meta.get('IF', [1])) > 1:
+        raise ValueError('uv must hold a single IF, or scale one per IF.')
+    if grid is None:
+        grid = np.zeros((imsize, imsize), dtype=complex)
+    
+    # select channel (of each IF)
+    select = (slice(None),) * (1 + per_if) + (channel - 1,)
+    weig = np.asarray(uv['weig'])[select]
+    if 'vis' in uv.colnames:
+        vis = np.asarray(uv['vis'])[select]
+    else:
+        vis = (
+            np.asarray(uv['real'])[select]
+            + 1j*np.asarray(uv['imag'])[select]
+        )
+    
+    # UV positions in cells (per IF), flattened with any IF and Stokes 
+    # axes, keeping unflagged visibilities on the grid
+    shape = [1] * weig.ndim
+    if per_if:
+        shape[1] = -1
+    cells = np.reshape(scale, shape) * imsize * np.radians(cellsize / 3600)
+    x, y = (
+        np.broadcast_to(
+            np.reshape(uv[key], (-1, *[1] * (weig.ndim - 1))) * cells, 
+            weig.shape
+        ).ravel()
+        for key in ('u', 'v')
+    )
+    vis, weig = vis.ravel(), weig.ravel()
+    keep = (weig > 0) & (
+        np.maximum(np.abs(x), np.abs(y)) < imsize // 2 - GRID_SUPPORT - 1
+    )
+    x, y, vis, weig = x[keep], y[keep], vis[keep], weig[keep]
+    
+    # accumulate kernel-weighted visibilities chunk by chunk
+    offsets = np.arange(-GRID_SUPPORT, GRID_SUPPORT + 1)
+    rows = max(GRID_CHUNK // len(offsets)**2, 1)
+    for i in range(0, len(vis), rows):
+        kernels, indices = [], []
+        for position in (y[i:i + rows], x[i:i + rows]):
+            centre = np.rint(position)
+            kernel = np.exp(
+                -((offsets - (position - centre)[:, None]) / GRID_WIDTH)**2
+            )
+            kernels.append(kernel / kernel.sum(axis=1, keepdims=True))
+            indices.append((centre.astype(int)[:, None] + offsets) % imsize)
+        index = indices[0][:, :, None] * imsize + indices[1][:, None, :]
+        values = (
+            (weig[i:i + rows] * vis[i:i + rows])[:, None, None]
+            * kernels[0][:, :, None] * kernels[1][:, None, :]
+        ).ravel()
+        grid.real += np.bincount(
+            index.ravel(), values.real, minlength=imsize**2
+        ).reshape(imsize, imsize)
+        grid.imag += np.bincount(
+            index.ravel(), values.imag, minlength=imsize**2
+        ).reshape(imsize, imsize)
+    return grid, float(np.sum(weig))
+
+def dirty_image(grid, weight):
+    """
+    Calculate the dirty image of a UV grid from grid_uv with a real
+    FFT.
+    Parameters:
+        grid (ndarray): The (imsize, imsize) complex UV grid.
+        weight (float): The sum of the gridded weights.
+    Returns:
+        ndarray: The (imsize, imsize) dirty image in Jy/beam, with RA
+            increasing to the left and the phase centre at pixel
+            (imsize/2 + 1, imsize/2 + 1) (1-based, as in AIPS).
+    Raises:
+        ValueError: If nothing was gridded (weight is not positive).
+    Notes:
+        The conjugate visibilities at (-u, -v) are added by folding
+        the grid onto the half plane of non-negative u, which is
+        transformed with np.fft.irfft2. The image is corrected for the
+        gridding kernel.
+    """
+    if grid is None or not weight > 0:
+        raise ValueError('no unflagged visibilities were gridded.')
+    imsize = len(grid)
+    
+    # fold grid onto the Hermitian half plane and transform
+    flip = -np.arange(imsize) % imsize
+    half = grid[:, :imsize // 2 + 1] + np.conj(
+        grid[np.ix_(flip, flip[:imsize // 2 + 1])]
+    )
+    image = np.fft.irfft2(half, s=(imsize, imsize))
+    image *= imsize**2 / (2 * weight)
+    image = np.fft.fftshift(image)
+    
+    # correct for the gridding kernel and put RA increasing to the left
+    pixels = (np.arange(imsize) - imsize // 2) / imsize
+    correction = np.exp(-(np.pi * GRID_WIDTH * pixels)**2)
+    image /= correction[:, None] * correction[None, :]
+    return np.roll(image[:, ::-1], 1, axis=1)
+
+def image_rms(image, blc=None, trc=None, statistic='std'):
+    """
+    Calculate the RMS of an image, optionally within a sub-region.
+    Parameters:
+        image (array-like): The image, with axes (y, x), e.g. from 
+            grab_im, dirty_image, or a memory-mapped FITS image.
+        blc (list, optional): The bottom left corner (x, y) of the
+            region (1-based, as in AIPS).
+        trc (list, optional): The top right corner (x, y) of the
+            region (1-based and inclusive, as in AIPS).
+        statistic (str, optional): The noise statistic ('std' for the 
+            standard deviation, 'mad' for the MAD-based sigma, or 
+            'clipped' for the sigma-clipped RMS).
+    Returns:
+        float: The noise statistic of the pixels in the region.
+    Notes:
+        The statistics are from image_stats, so the image is read in 
+        tiles and blanked pixels are skipped.
+    """
+    key = {'std': 'std', 'mad': 'mad_sigma', 'clipped': 'clipped_rms'}
+    return float(image_stats(image, blc, trc)[key[statistic]])
+
+def image_stats(image, blc=None, trc=None, nsigma=3.0, niter=10):
+    """
+    Calculate the statistics of an image, reading it in tiles.
+    Parameters:
+        image (array-like): The image, with axes (y, x).
+        blc (list, optional): The bottom left corner (x, y) of the
+            region (1-based, as in AIPS).
+        trc (list, optional): The top right corner (x, y) of the
+            region (1-based and inclusive, as in AIPS).
+        nsigma (float, optional): The clipping threshold in sigma.
+        niter (int, optional): The maximum number of clipping
+            iterations.
+    Returns:
+        dict: The number of valid pixels (npix), mean, standard
+            deviation (std), median, MAD-based sigma (mad_sigma), and
+            sigma-clipped RMS (clipped_rms).
+    Notes:
+        Only one tile of STATS_TILE_BYTES is copied at a time, so the 
+        image is never flattened or copied whole. The mean and standard
+        deviation are exact. The median, MAD, and clipping are found
+        from a histogram of HIST_BINS bins (with the sum and sum of
+        squares of each bin), accumulated in the same pass, with bins
+        spaced in asinh of the offset from the median over the MAD of 
+        a strided sample of about STATS_SAMPLE pixels from the whole 
+        region, so they resolve the noise while still spanning bright 
+        sources. Blanked (FBLANK or NaN) pixels are skipped.
+    """
+    return _plane_stats(_image_region(image, blc, trc), nsigma, niter)
+
+def cube_stats(cube, blc=None, trc=None, nsigma=3.0, niter=10):
+    """
+    Calculate the statistics of each plane of a cube, reading it in
+    tiles.
+    Parameters:
+        cube (array-like): The cube, with axes (..., y, x), e.g. a
+            memory-mapped FITS cube.
+        blc (list, optional): The bottom left corner (x, y) of the
+            region in each plane (1-based, as in AIPS).
+        trc (list, optional): The top right corner (x, y) of the
+            region in each plane (1-based and inclusive, as in AIPS).
+        nsigma (float, optional): The clipping threshold in sigma.
+        niter (int, optional): The maximum number of clipping
+            iterations.
+    Returns:
+        astropy.table.Table: The statistics (as in image_stats) of each
+            plane, with planes numbered from 1 along the flattened
+            leading axes.
+    Notes:
+        Planes are read in order, and only the histogram of the 
+        current plane is kept.
+    """
+    cube = np.asanyarray(cube)
+    planes = cube.reshape(-1, *cube.shape[-2:])
+    rows = [
+        {
+            'plane': i, 
+            **_plane_stats(_image_region(plane, blc, trc), nsigma, niter)
+        }
+        for i, plane in enumerate(planes, start=1)
+    ]
+    return Table(rows=rows)
+
+def merge_components(cc):
+    """
+    Merge clean components at the same position by summing their 
+    fluxes, as done by CCMRG.
+    Parameters:
+        cc (astropy.table.Table): Clean component table with flux, 
+            deltax, and deltay columns.
+    Returns:
+        astropy.table.Table: The merged clean component table, ordered 
+            by descending absolute flux, as CCMRG orders its output.
+    Notes:
+        Only the returned table is merged; the CC table on disk is left 
+        as it is (run CCMRG to merge it in AIPS). Positions with equal 
+        absolute flux keep the order of their first occurrence.
+    """
+    positions = np.column_stack([cc['deltax'], cc['deltay']])
+    _, first, inverse = np.unique(
+        positions, axis=0, return_index=True, return_inverse=True
+    )
+    flux = np.bincount(
+        inverse.ravel(), weights=cc['flux'], minlength=len(first)
+    )
+    by_first = np.argsort(first)
+    order = by_first[np.argsort(-np.abs(flux[by_first]), kind='stable')]
+    merged = cc[first[order]]
+    merged['flux'] = flux[order].astype(cc['flux'].dtype)
+    return merged
+
 # utility functions
 def grab_data_copy(data):
     # Grabs a copy of the AIPS data object.
@@ -284,6 +1268,613 @@ def grab_data_copy(data):
     else:
         raise TypeError("data must be an AIPSUVData or AIPSImage object.")
 
+def _check_weights(weight):
+    # raise as np.average does for weights summing to zero
+    if np.any(weight == 0):
+        raise ZeroDivisionError("Weights sum to zero, can't be normalized")
+
+def _weighted_sums(real, imag, weig, axis, mode, chunk, masked=False):
+    # accumulates the weights, weighted real and imaginary parts, 
+    # squared weights (unmasked), weighted amplitudes (scalar mode), and 
+    # valid counts (masked) chunk by chunk along axis in float64, with 
+    # non-positive weights clipped to zero in a chunk-sized buffer that 
+    # the weighted sums then read (masked), and returns them with the 
+    # floating point type of the results
+    if mode not in ('vector', 'scalar'):
+        raise ValueError("mode must be 'vector' or 'scalar'.")
+    if imag is None:
+        real, imag = np.real(real), np.imag(real)
+    real, imag, weig = np.asarray(real), np.asarray(imag), np.asarray(weig)
+    if weig.ndim == 1 and real.ndim > 1:
+        shape = [1] * real.ndim
+        shape[axis] = -1
+        weig = np.broadcast_to(weig.reshape(shape), real.shape)
+    real, imag, weig = (np.moveaxis(a, axis, 0) for a in (real, imag, weig))
+    dtype = np.result_type(real.dtype, weig.dtype, 1.0)
+    if chunk is None:
+        chunk = max(AVERAGE_CHUNK_BYTES // max(real[:1].nbytes, 1), 1)
+    sums = np.zeros((6, *real.shape[1:]))
+    count_type = np.uint16 if chunk < 2**16 else np.int32
+    buffers, weights, valid = None, None, None
+    for i in range(0, len(real), chunk):
+        w, re, im = weig[i:i + chunk], real[i:i + chunk], imag[i:i + chunk]
+        if masked:
+            if weights is None:
+                weights = np.empty(w.shape, w.dtype)
+                valid = np.empty(w.shape, bool)
+            w = np.maximum(w, 0, out=weights[:len(w)])
+            np.greater(w, 0, out=valid[:len(w)])
+            sums[5] += np.einsum(
+                'i...->...', valid[:len(w)].view(np.uint8), dtype=count_type
+            )
+        else:
+            sums[3] += np.einsum('i...,i...->...', w, w)
+        sums[0] += np.einsum('i...->...', w)
+        sums[1] += np.einsum('i...,i...->...', w, re)
+        sums[2] += np.einsum('i...,i...->...', w, im)
+        if mode == 'scalar':
+            if buffers is None:
+                buffers = np.empty((2, *re.shape), np.result_type(re, im))
+            amplitude, square = buffers[0, :len(re)], buffers[1, :len(re)]
+            np.square(re, out=amplitude)
+            amplitude += np.square(im, out=square)
+            np.sqrt(amplitude, out=amplitude)
+            sums[4] += np.einsum('i...,i...->...', w, amplitude)
+    return sums, dtype
+
+def _grouped_sums(real, imag, weig, order, starts, mode):
+    # masked weighted sums (as in _weighted_sums) per group of the rows 
+    # taken in order, with groups starting at starts (as in 
+    # np.add.reduceat), reduced chunk by chunk so only chunk-sized 
+    # copies of the rows are made
+    dtype = np.result_type(real.dtype, weig.dtype, 1.0)
+    group = np.repeat(
+        np.arange(len(starts)), np.diff(np.append(starts, len(order)))
+    )
+    chunk = max(AVERAGE_CHUNK_BYTES // max(real[:1].nbytes, 1), 1)
+    sums = np.zeros((6, len(starts), *real.shape[1:]))
+    for i in range(0, len(order), chunk):
+        rows = order[i:i + chunk]
+        w = np.maximum(weig[rows], 0)
+        re, im = real[rows], imag[rows]
+        first = np.flatnonzero(np.diff(group[i:i + chunk], prepend=-1))
+        index = group[i:i + chunk][first]
+        sums[0, index] += np.add.reduceat(w, first)
+        sums[1, index] += np.add.reduceat(w * re, first)
+        sums[2, index] += np.add.reduceat(w * im, first)
+        sums[3, index] += np.add.reduceat(w * w, first)
+        if mode == 'scalar':
+            sums[4, index] += np.add.reduceat(w * np.hypot(re, im), first)
+        sums[5, index] += np.add.reduceat(w > 0, first, dtype=np.int32)
+    return sums, dtype
+
+def _normalize_sums(sums, mode, dtype, out=None):
+    # amplitude, phase, weight, and effective sample count from sums, 
+    # computed in float64 and cast to dtype (or written into out)
+    if out is None:
+        out = (None,) * 4
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if mode == 'scalar':
+            amplitude = sums[4] / sums[0]
+        else:
+            amplitude = np.hypot(sums[1], sums[2]) / sums[0]
+        phase = np.arctan2(sums[2], sums[1])
+        neff = sums[0]**2 / sums[3]
+    results = []
+    for value, array in zip((amplitude, phase, sums[0], neff), out):
+        if array is None:
+            results.append(value.astype(dtype)[()])
+        else:
+            array[...] = value
+            results.append(array)
+    return tuple(results)
+
+def _masked_average(real, imag, weig, axis, mode, out, chunk):
+    # masked scalar or vector average, with NaN for fully flagged slices
+    sums, dtype = _weighted_sums(
+        real, imag, weig, axis, mode, chunk, masked=True
+    )
+    out = (None,) * 3 if out is None else out
+    amplitude, phase, _, _ = _normalize_sums(
+        sums, mode, dtype, (out[0], out[1], None, None)
+    )
+    flagged = sums[5] == 0
+    if np.ndim(phase) == 0:
+        phase = dtype.type(np.nan) if flagged else phase
+    else:
+        phase[flagged] = np.nan
+    if out[2] is None:
+        count = sums[5].astype(int)[()]
+    else:
+        count = out[2]
+        count[...] = sums[5]
+    return amplitude, phase, count
+
+def _read_table(
+    temp_data, table_name, table_index=0, ignore=[], 
+    columns=None, sources=[], antennas=[], timerange=None
+):
+    # reads a table from a Wizardry data object in a single pass
+    table = temp_data.table(table_name, table_index)
+    
+    # check columns and filters
+    keys = [
+        col for col in (table._keys if columns is None else columns) 
+        if col not in ignore
+    ]
+    filters = {
+        'source_id': sources, 
+        'antenna_no': antennas, 
+        'time': timerange
+    }
+    for key in keys + [key for key, value in filters.items() if value]:
+        if key not in table._keys:
+            raise ValueError(f'{table_name} table has no {key} column.')
+    
+    # read each row once, keeping the matching rows
+    rows = [
+        values for values in _table_rows(
+            table, keys + [key for key, value in filters.items() if value]
+        )
+        if (not sources or values['source_id'] in sources)
+        and (not antennas or values['antenna_no'] in antennas)
+        and (not timerange or timerange[0] <= values['time'] <= timerange[1])
+    ]
+    
+    # build each column from the row values in one conversion
+    return Table(
+        data=[
+            np.array([
+                value.strip() if isinstance(value, str) else value
+                for value in (values[key] for values in rows)
+            ])
+            for key in keys
+        ],
+        names=keys
+    )
+
+def _table_rows(table, keys):
+    # yields the values of each row of a table as a dict, read from the 
+    # Obit row of the Wizardry table row instead of one attribute lookup 
+    # per cell
+    for row in table:
+        obit_row = row.__dict__.get('_row')
+        fields = row.__dict__.get('_fields')
+        if obit_row is None or fields is None:
+            yield {key: getattr(row, key) for key in keys}
+            continue
+        yield {
+            key: (
+                _obit_value(obit_row[fields[key]]) if key in fields 
+                else getattr(row, key)
+            )
+            for key in keys
+        }
+
+def _obit_value(value):
+    # Obit row value as Wizardry returns it (single values as scalars)
+    return value[0] if len(value) == 1 else value
+
+def _flag_list(value):
+    # UVFLG adverb value as a list without unset (zero/empty) entries
+    values = value if isinstance(value, list) else [value]
+    return [v for v in values if v not in (None, 0, '')]
+
+def _flag_time(timerang):
+    # UVFLG time (day, hour, minute, second) in days
+    day, hour, minute, second = timerang
+    return day + hour/24 + minute/1440 + second/86400
+
+def _flag_range(start, end):
+    # UVFLG IF or channel range, with an unset end as FLAG_LAST
+    return max(int(start or 0), 1), int(end or 0) or FLAG_LAST
+
+def _flag_antennas(flag):
+    # antenna pairs flagged by UVFLG antennas and baseline adverbs (0 
+    # for all antennas)
+    antennas = _flag_list(flag.get('antennas')) or [0]
+    baseline = _flag_list(flag.get('baseline')) or [0]
+    return {(int(a), int(b)) for a in antennas for b in baseline}
+
+def _merge_intervals(intervals, gap):
+    # merge overlapping intervals and intervals closer than gap
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1] + gap:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+def _per_if(column):
+    # table column as a (row, IF) array
+    array = np.asarray(column, dtype=float)
+    return array.reshape(len(array), -1)
+
+def _robust_outliers(values, valid, nsigma):
+    # flags values further than nsigma robust standard deviations (from 
+    # the median absolute deviation) from the median of each column
+    valid = valid & (np.abs(values) < FBLANK / 2)
+    masked = np.where(valid, values, np.nan)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        median = np.nanmedian(masked, axis=0)
+        sigma = 1.4826 * np.nanmedian(np.abs(masked - median), axis=0)
+    with np.errstate(invalid='ignore'):
+        return valid & (sigma > 0) & (np.abs(values - median) > nsigma * sigma)
+
+def _image_region(image, blc, trc):
+    # view of a 1-based, inclusive (x, y) region of an image
+    image = np.asanyarray(image)
+    blc = blc or (1, 1)
+    trc = trc or (image.shape[-1], image.shape[-2])
+    return image[..., blc[1] - 1:trc[1], blc[0] - 1:trc[0]]
+
+def _plane_stats(plane, nsigma, niter):
+    # exact moments and histogram of a plane accumulated tile by tile,
+    # then the robust statistics from the histogram
+    plane = plane.reshape(-1, plane.shape[-1])
+    rows = max(STATS_TILE_BYTES // max(plane[:1].nbytes, 1), 1)
+    
+    # centre and scale the histogram on a strided sample of the plane
+    step = max(int(np.sqrt(plane.size / STATS_SAMPLE)), 1)
+    sample = _valid_pixels(np.asarray(plane[::step, ::step]))
+    hist = _plane_histogram(sample) if len(sample) else None
+    
+    n, mean, m2 = 0, 0.0, 0.0
+    for i in range(0, len(plane), rows):
+        x = _valid_pixels(np.asarray(plane[i:i + rows]))
+        if len(x) == 0:
+            continue
+        if hist is None:
+            # the sample missed every valid pixel, so use this tile
+            hist = _plane_histogram(x)
+        
+        # merge tile moments (Chan et al.)
+        tile_mean = x.mean()
+        tile_m2 = np.sum(np.square(x - tile_mean))
+        delta = tile_mean - mean
+        total = n + len(x)
+        mean += delta * len(x) / total
+        m2 += tile_m2 + delta**2 * n * len(x) / total
+        n = total
+        
+        # accumulate histogram
+        offset = np.arcsinh((x - hist['centre']) / hist['scale'])
+        index = (offset + HIST_EXTENT) / (2 * HIST_EXTENT) * HIST_BINS
+        index = np.clip(index.astype(int), 0, HIST_BINS - 1)
+        hist['count'] += np.bincount(index, minlength=HIST_BINS)
+        hist['sum'] += np.bincount(index, x, minlength=HIST_BINS)
+        hist['sumsq'] += np.bincount(index, x * x, minlength=HIST_BINS)
+        hist['min'] = min(hist['min'], x.min())
+        hist['max'] = max(hist['max'], x.max())
+        hist['edges'][0] = min(hist['edges'][0], hist['min'])
+        hist['edges'][-1] = max(hist['edges'][-1], hist['max'])
+    
+    if n == 0:
+        return {
+            'npix': 0, 'mean': np.nan, 'std': np.nan, 'median': np.nan,
+            'mad_sigma': np.nan, 'clipped_rms': np.nan
+        }
+    median = _hist_quantile(hist, 0.5)
+    mad_sigma = 1.4826 * _hist_mad(hist, median, n)
+    return {
+        'npix': n, 'mean': mean, 'std': np.sqrt(m2 / n), 'median': median,
+        'mad_sigma': mad_sigma,
+        'clipped_rms': _hist_clipped_rms(
+            hist, median, mad_sigma, nsigma, niter
+        ),
+    }
+
+def _valid_pixels(values):
+    # finite, unblanked pixels as a flat float array
+    blank = values.dtype.type(FBLANK)
+    return values[np.isfinite(values) & (values != blank)].astype(float)
+
+def _plane_histogram(x):
+    # empty histogram centred and scaled on a sample of a plane
+    centre = np.median(x)
+    scale = 1.4826 * np.median(np.abs(x - centre))
+    if not scale > 0:
+        scale = np.std(x) if np.std(x) > 0 else max(abs(centre), 1.0)
+    edges = centre + scale * np.sinh(
+        np.linspace(-HIST_EXTENT, HIST_EXTENT, HIST_BINS + 1)
+    )
+    return {
+        'centre': centre, 'scale': scale, 'edges': edges,
+        'min': np.inf, 'max': -np.inf,
+        'count': np.zeros(HIST_BINS), 'sum': np.zeros(HIST_BINS),
+        'sumsq': np.zeros(HIST_BINS),
+    }
+
+def _hist_cdf(hist, value):
+    # number of pixels at or below value (linear within bins)
+    return np.interp(
+        value, hist['edges'], np.concatenate([[0], np.cumsum(hist['count'])])
+    )
+
+def _hist_quantile(hist, q, low=None, high=None):
+    # value below which a fraction q of the pixels in [low, high] lie
+    # (linear within bins, and within the data range)
+    cumulative = np.concatenate([[0], np.cumsum(hist['count'])])
+    start = 0.0 if low is None else _hist_cdf(hist, low)
+    end = cumulative[-1] if high is None else _hist_cdf(hist, high)
+    target = start + q * (end - start)
+    i = np.clip(
+        np.searchsorted(cumulative, target, side='left'), 1, HIST_BINS
+    )
+    lower, upper = cumulative[i - 1], cumulative[i]
+    fraction = (target - lower) / (upper - lower) if upper > lower else 0.5
+    value = hist['edges'][i - 1] + fraction * (
+        hist['edges'][i] - hist['edges'][i - 1]
+    )
+    return np.clip(value, hist['min'], hist['max'])
+
+def _hist_mad(hist, median, n):
+    # median absolute deviation, bisecting on the pixels within it
+    # (the interquartile range about the median holds at least half)
+    low, high = 0.0, max(
+        _hist_quantile(hist, 0.75) - median, 
+        median - _hist_quantile(hist, 0.25)
+    )
+    for _ in range(100):
+        mid = (low + high) / 2
+        inside = _hist_cdf(hist, median + mid) - _hist_cdf(hist, median - mid)
+        if inside < n / 2:
+            low = mid
+        else:
+            high = mid
+        if high - low <= 1e-6 * high:
+            break
+    return (low + high) / 2
+
+def _hist_clipped_rms(hist, centre, sigma, nsigma, niter):
+    # iterative sigma clipping about the median of the retained pixels,
+    # counting the fraction of each boundary bin inside the limits
+    edges = hist['edges']
+    width = np.diff(edges)
+    count = None
+    for _ in range(niter):
+        low, high = centre - nsigma * sigma, centre + nsigma * sigma
+        inside = np.clip(
+            (np.minimum(edges[1:], high) - np.maximum(edges[:-1], low))
+            / np.where(width > 0, width, 1),
+            0, 1
+        )
+        n = np.sum(inside * hist['count'])
+        if n == 0 or n == count:
+            break
+        count = n
+        mean = np.sum(inside * hist['sum']) / n
+        sigma = np.sqrt(max(np.sum(inside * hist['sumsq']) / n - mean**2, 0))
+        centre = _hist_quantile(hist, 0.5, low, high)
+    return sigma
+
+def _uv_selection(uvdata, source, IF, stokes):
+    # source ID, (IF, channel, stokes) indices, row shape, and table 
+    # meta of a visibility selection
+    source_id = None
+    if source is not None:
+        sources = grab_table(uvdata, 'SU')
+        match = sources[sources['source'] == source]['source_id']
+        if len(match) == 0:
+            raise ValueError(f"source '{source}' is not in the SU table.")
+        source_id = match[0]
+    IFs = np.atleast_1d(IF) - 1
+    stokes_ids = [uvdata.stokes.index(s) - 1 for s in np.atleast_1d(stokes)]
+    nchan = uvdata.header['naxis'][uvdata.header['ctype'].index('FREQ')]
+    selection = (IFs, np.arange(nchan), stokes_ids)
+    shape = (
+        *[len(IFs)] * (np.ndim(IF) > 0), 
+        nchan, 
+        *[len(stokes_ids)] * (np.ndim(stokes) > 0)
+    )
+    meta = {
+        'IF': [int(i) for i in IFs + 1], 
+        'stokes': [str(s) for s in np.atleast_1d(stokes)]
+    }
+    return source_id, selection, shape, meta
+
+def _select_uv(
+    uvdata, source_id, corr, antennas, baselines, selection, shape, 
+    compact=False
+):
+    # yields the selected visibility columns of each buffer, copying 
+    # only the selected (IF, channel, stokes) cube of the matched rows
+    for rparm, vis in _uv_blocks(uvdata):
+        columns = _uv_columns(uvdata, rparm)
+        mask = _uv_mask(columns, source_id, corr, antennas, baselines)
+        cube = vis[np.ix_(np.flatnonzero(mask), *selection)]
+        n = len(cube)
+        block = {
+            'u': columns['uvw'][mask, 0],
+            'v': columns['uvw'][mask, 1],
+            'w': columns['uvw'][mask, 2],
+            'time': columns['time'][mask],
+            'inttime': columns['inttime'][mask],
+            'baseline': columns['baseline'][mask],
+        }
+        if compact:
+            block['vis'] = np.empty((n, *shape), dtype=np.complex64)
+            block['vis'].real = cube[..., 0].reshape(n, *shape)
+            block['vis'].imag = cube[..., 1].reshape(n, *shape)
+        else:
+            block['real'] = cube[..., 0].reshape(n, *shape)
+            block['imag'] = cube[..., 1].reshape(n, *shape)
+        block['weig'] = cube[..., 2].reshape(n, *shape)
+        yield block
+
+def _uv_arrays(nrows, shape, compact=False):
+    # allocates visibility columns for nrows visibilities
+    if compact:
+        return {
+            'u': np.zeros(nrows, dtype=np.float32),
+            'v': np.zeros(nrows, dtype=np.float32),
+            'w': np.zeros(nrows, dtype=np.float32),
+            'time': np.zeros(nrows),
+            'inttime': np.zeros(nrows, dtype=np.float32),
+            'baseline': np.zeros((nrows, 2), dtype=np.int16),
+            'vis': np.zeros((nrows, *shape), dtype=np.complex64),
+            'weig': np.zeros((nrows, *shape), dtype=np.float32),
+        }
+    return {
+        'u': np.zeros(nrows),
+        'v': np.zeros(nrows),
+        'w': np.zeros(nrows),
+        'time': np.zeros(nrows),
+        'inttime': np.zeros(nrows),
+        'baseline': np.zeros((nrows, 2)),
+        'real': np.zeros((nrows, *shape)),
+        'imag': np.zeros((nrows, *shape)),
+        'weig': np.zeros((nrows, *shape)),
+    }
+
+def _uv_table(columns, meta):
+    # builds a visibility table from visibility columns (without copying)
+    units = {
+        'u': u.m, 'v': u.m, 'w': u.m, 'time': u.day, 'inttime': u.s, 
+        'real': u.Jy, 'imag': u.Jy, 'vis': u.Jy
+    }
+    return Table(
+        data=list(columns.values()),
+        names=list(columns.keys()),
+        units=[units.get(name) for name in columns],
+        meta=meta,
+        copy=False
+    )
+
+def _sum_by_key(keys, values):
+    # sorted unique keys and the values summed over the rows of each key
+    if len(keys) == 0:
+        return keys, values
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    starts = np.flatnonzero(np.append(True, keys[1:] != keys[:-1]))
+    return keys[starts], np.add.reduceat(values[order], starts, axis=0)
+
+def _uv_groups(time, baseline, solint, gap):
+    # sort order and group starts for averaging per (scan, time bin, 
+    # baseline), with scans split at gaps longer than gap seconds
+    by_time = np.argsort(time, kind='stable')
+    new_scan = np.diff(time[by_time]) > gap / 86400
+    scan = np.empty(len(time), dtype=int)
+    scan[by_time] = np.concatenate([[0], np.cumsum(new_scan)])
+    if solint is None:
+        time_bin = np.zeros(len(time), dtype=int)
+    else:
+        scan_start = time[by_time][np.flatnonzero(np.append(True, new_scan))]
+        # (rounded to 10 ms, about the precision of AIPS time stamps)
+        time_bin = np.floor(
+            np.round((time - scan_start[scan]) * 86400, 2) / solint
+        ).astype(int)
+    baseline = baseline.astype(int)
+    keys = (baseline[:, 0] * 256 + baseline[:, 1], time_bin, scan)
+    order = np.lexsort(keys)
+    changed = np.zeros(len(time), dtype=bool)
+    changed[:1] = True
+    for key in keys:
+        key = key[order]
+        changed[1:] |= key[1:] != key[:-1]
+    return order, np.flatnonzero(changed)
+
+def _uv_blocks(uvdata):
+    # yields (random parameters, visibilities) for each buffer read by 
+    # the Wizardry visibility iterator, with visibilities shaped as 
+    # (nvis, IF, channel, stokes, complex)
+    desc = uvdata._data.Desc.Dict
+    nrparm, lrec = desc['nrparm'], desc['lrec']
+    header = uvdata.header
+    shape = [
+        header['naxis'][header['ctype'].index(axis)]
+        if axis in header['ctype'] else 1
+        for axis in ['IF', 'FREQ', 'STOKES', 'COMPLEX']
+    ]
+    for row in uvdata:
+        count = row._count
+        block = np.ravel(row._buffer)[:count * lrec].reshape(count, lrec)
+        yield block[:, :nrparm], block[:, nrparm:].reshape(count, *shape)
+        # skip to the end of the buffer so the next step refills it
+        row._index = count - 1
+
+def _uv_columns(uvdata, rparm):
+    # decodes the random parameters of a block of visibilities
+    desc = uvdata._data.Desc.Dict
+    if desc['ilocb'] >= 0:
+        packed = rparm[:, desc['ilocb']].astype(int)
+        antenna1, antenna2 = packed // 256, packed % 256
+    else:
+        antenna1 = rparm[:, desc['iloca1']].astype(int)
+        antenna2 = rparm[:, desc['iloca2']].astype(int)
+    return {
+        'uvw': rparm[:, [desc['ilocu'], desc['ilocv'], desc['ilocw']]],
+        'time': rparm[:, desc['iloct']],
+        'inttime': (
+            rparm[:, desc['ilocit']] if desc['ilocit'] >= 0 
+            else np.zeros(len(rparm))
+        ),
+        'source': (
+            rparm[:, desc['ilocsu']].astype(int) if desc['ilocsu'] >= 0 
+            else np.ones(len(rparm), dtype=int)
+        ),
+        'baseline': np.column_stack([antenna1, antenna2]),
+    }
+
+def _uv_mask(columns, source_id, corr, antennas, baselines):
+    # vectorized match on source, correlation, antennas, and baselines
+    antenna1, antenna2 = columns['baseline'].T
+    source_match = (
+        columns['source'] == source_id if source_id is not None
+        else np.ones(len(antenna1), dtype=bool)
+    )
+    is_auto = antenna1 == antenna2
+    has_antenna = (
+        np.isin(antenna1, antennas) | np.isin(antenna2, antennas)
+    )
+    has_baseline = (
+        np.isin(antenna1, baselines) & np.isin(antenna2, baselines)
+    )
+    
+    if corr == 'auto':
+        return source_match & is_auto & (has_antenna if antennas else True)
+    elif corr == 'cross':
+        if antennas:
+            return source_match & ~is_auto & has_antenna
+        elif baselines:
+            return source_match & ~is_auto & has_baseline
+        else:
+            return source_match & ~is_auto
+    return np.zeros(len(source_match), dtype=bool)
+
+def _catalogue_stamp(data):
+    # modification stamp of an AIPS catalogue entry, from the latest 
+    # modification time of its files (or its catalogue date and time), 
+    # with AIPS file names laid out as TTDVVVCCC.UUU; (type, version, 
+    # catalogue number, and user number)
+    data_type = 'UV' if isinstance(data, (AIPSUVData, wAIPSUVData)) else 'MA'
+    entry = [
+        item for item in AIPSCat(data.disk)[data.disk]
+        if item['name'] == data.name and item['klass'] == data.klass
+        and item['seq'] == data.seq and item['type'] == data_type
+    ][0]
+    dirname = getattr(AIPS.disks[data.disk], 'dirname', None) \
+        or os.environ.get(f'DA{_ehex(data.disk, 2)}')
+    files = glob(os.path.join(
+        dirname or '', 
+        f'??D???{_ehex(entry["cno"], 3)}.{_ehex(AIPS.userno, 3)};'
+    ))
+    if dirname is None or not files:
+        return f'{entry["date"]} {entry["time"]}'
+    return max(os.stat(file).st_mtime_ns for file in files)
+
+def _ehex(n, width):
+    # AIPS extended hexadecimal (base 36) representation of n
+    digits = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    result = ''
+    while n > 0:
+        result = digits[n % 36] + result
+        n //= 36
+    return result.rjust(width, '0')
+
 def switch_spectral(data):
     '''
     Converts the frequency axis of an AIPSUVData or AIPSImage to 